@@ -27,8 +27,10 @@ schema_headers = {'APIKey':APIKey}
 output_directory = '..\..\Data\\'
 
 # Get the Stat-Xplore schema. This is used to find the codes of fields and values when getting data
-# This takes a while. Need to fix encoding issue so user can read in saved schema instead of querying API for new one
-df_schema = stat_xplore_schema.get_full_schema(schema_headers, check_cache = True, schema_filename = '.\stat_xplore_scraper\schema.csv')
+# Only the schema items the requests below need are requested from the API, and these are cached alongside the schema csv.
+# If the complete schema has been crawled and cached with stat_xplore_schema.get_full_schema it is used instead.
+schema_filename = '.\stat_xplore_scraper\schema.csv'
+df_schema = stat_xplore_schema.get_schema_tree(schema_headers, check_cache = True, schema_filename = schema_filename, lazy = True)
 
 #######################
 #
@@ -51,7 +53,9 @@ ca = stat_xplore_table.get_stat_xplore_measure_data(table_headers,
                                                     df_schema = df_schema, 
                                                     geog_folder_label = 'Geography (residence-based)', 
                                                     geog_field_label= 'National - Regional - LA - OAs', 
-                                                    geog_level_label = 'Local Authority')
+                                                    geog_level_label = 'Local Authority',
+                                                    check_cache = True,
+                                                    schema_filename = schema_filename)
 # Save the data and annotations
 ca['data'].to_csv(output_directory + 'carers_allowance_data.csv', index=False)
 with open(output_directory + 'carers_allowance_annotations.txt', 'w') as f:
@@ -69,7 +73,9 @@ pip = stat_xplore_table.get_stat_xplore_measure_data(table_headers,
                                                     df_schema = df_schema, 
                                                     geog_folder_label = 'Geography (residence-based)', 
                                                     geog_field_label= 'Country - Region - Local Authority', 
-                                                    geog_level_label = 'Local Authority')
+                                                    geog_level_label = 'Local Authority',
+                                                    check_cache = True,
+                                                    schema_filename = schema_filename)
 # Save the data and annotations
 pip['data'].to_csv(output_directory + 'personal_independence_payment_data.csv', index=False)
 with open(output_directory + 'pip_annotations.txt', 'w') as f:
@@ -86,7 +92,9 @@ pip_latest = stat_xplore_table.get_stat_xplore_measure_data(table_headers,
                                                             df_schema = df_schema, 
                                                             geog_folder_label = 'Geography (residence-based)', 
                                                             geog_field_label= 'Country - Region - Local Authority', 
-                                                            geog_level_label = 'Local Authority')
+                                                            geog_level_label = 'Local Authority',
+                                                            check_cache = True,
+                                                            schema_filename = schema_filename)
 # Save the data and annotations
 pip_latest['data'].to_csv(output_directory + 'personal_independence_payment_data_latest.csv', index=False)
 with open(output_directory + 'pip_annotations_latest.txt', 'w') as f:
@@ -104,7 +112,9 @@ nino = stat_xplore_table.get_stat_xplore_measure_data(  table_headers,
                                                         df_schema = df_schema, 
                                                         geog_folder_label = 'Location at Registration',
                                                         geog_field_label = 'National - Regional - Admin LA (Northern Ireland Districts included)',
-                                                        geog_level_label = 'Local Authority/Northern Ireland District')
+                                                        geog_level_label = 'Local Authority/Northern Ireland District',
+                                                        check_cache = True,
+                                                        schema_filename = schema_filename)
 
 nino['data'].to_csv(output_directory + 'nino_data.csv', index=False)
 with open(output_directory + 'nino_annotations.txt', 'w') as f:
@@ -0,0 +1,679 @@
+# Asyncio versions of the functions that request schema and table data from the Stat-Xplore API
+#
+# Requests are sent with an aiohttp session shared by all requests of a client. A semaphore limits the number of
+# requests in flight at once, so that a single event loop can request many tables concurrently, eg
+#
+#   async def get_tables(table_headers, schema_headers, measure_ids):
+#       client = await open_client(max_concurrency = 8)
+#       try:
+#           return await asyncio.gather(*[get_stat_xplore_measure_data(client, table_headers, schema_headers, measure_id) for measure_id in measure_ids])
+#       finally:
+#           await close_client(client)
+#
+# The schema items and geography recodes that a request body needs are also requested with the client, under the same limit.
+#
+# aiohttp is an optional dependency, only needed to use this module. Install it with 'pip install aiohttp'.
+import json
+import asyncio
+import threading
+import functools
+import concurrent.futures
+import pandas as pd
+import stat_xplore_client
+import stat_xplore_schema
+import stat_xplore_schema_tree
+import stat_xplore_table
+import stat_xplore_cache
+import stat_xplore_metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Default number of requests sent to the API at once by a client
+default_max_concurrency = 16
+
+
+async def open_client(max_concurrency = default_max_concurrency, timeout = stat_xplore_client.default_timeout):
+    '''Open an async client for the Stat-Xplore API. The client keeps connections to the API open between requests.
+    Close it with close_client when finished.
+
+    Kwargs:
+        max_concurrency (int): Default 16. The maximum number of requests the client sends at once
+        timeout (float or tuple): Default (10, 300). The (connect, read) timeouts in seconds
+
+    Returns:
+        dict: Dictionary with the following items: 'session' - the aiohttp ClientSession; 'semaphore' - the semaphore
+            limiting the number of requests in flight
+    '''
+    if aiohttp is None:
+        raise ImportError('The async Stat-Xplore API requires aiohttp. Install it with pip install aiohttp')
+
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(sock_connect = connect_timeout, sock_read = read_timeout),
+                                    connector = aiohttp.TCPConnector(limit = max_concurrency))
+
+    return {'session':session, 'semaphore':asyncio.Semaphore(max_concurrency)}
+
+async def close_client(client):
+    '''Close an async client and its open connections.
+
+    Args:
+        client (dict): The client, as returned by open_client
+    '''
+    await client['session'].close()
+
+async def run_blocking(func, *args, **kwargs):
+    '''Run a blocking function, such as reading a cached file or building a DataFrame, in a worker thread so that
+    it doesn't block the event loop.'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, stat_xplore_metrics.in_current_stage(functools.partial(func, *args, **kwargs)))
+
+async def send_request(client, method, url, headers = None, data = None):
+    '''Send a request using the client. Like the shared synchronous client, requests that fail with a connection error
+    or a transient error status are retried with backoff, waiting backoff_factor * 2^(retry number) seconds, or as long as
+    the Retry-After header of the response asks.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        method (str): The request method, 'GET' or 'POST'
+        url (str): The url of the request
+
+    Kwargs:
+        headers (dict, None): Default None. The headers of the request
+        data (str, None): Default None. The body of the request
+
+    Returns:
+        dict: Dictionary with the following items: 'success' - True if the response status was successful;
+            'content' - the response content, None if the request failed; 'headers' - dict of the response headers, with
+            lower case names; 'error' - a description of the error if the request failed
+    '''
+    max_retries = stat_xplore_client.max_retries
+    with stat_xplore_metrics.time_request(method, url) as event:
+        for retry_number in range(max_retries + 1):
+            event['retries'] = retry_number
+            wait = stat_xplore_client.backoff_factor * (2 ** retry_number)
+            try:
+                async with client['semaphore']:
+                    async with client['session'].request(method, url, headers = headers, data = data) as response:
+                        content = await response.read()
+                        response_headers = {name.lower():value for name, value in response.headers.items()}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = repr(err)
+            else:
+                event.update({'status':response.status, 'bytes':len(content)})
+                if response.status < 400:
+                    return {'success':True, 'content':content, 'headers':response_headers, 'error':None}
+
+                error = '{} {} for url: {}'.format(response.status, response.reason, url)
+                if response.status not in stat_xplore_client.retry_status_codes:
+                    break
+
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = int(retry_after)
+
+            if retry_number < max_retries:
+                await asyncio.sleep(wait)
+
+        event['error'] = error
+        return {'success':False, 'content':None, 'headers':None, 'error':error}
+
+async def request_schema(client, schema_headers, url = None):
+    '''Send request for schema to API using an async client. Check request was successful.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the request.
+
+    Kwargs:
+        url (str, None): Default None. The url of the request. If None the root folder of the schema is requested.
+
+    Returns:
+        dict: Dictionary with the following items: 'success'; 'response' - the JSON schema data; 'headers' - dict of the
+            response headers, with lower case names. 'response' and 'headers' are None if the request was unsuccessful.
+    '''
+    url = stat_xplore_schema.schema_url if url is None else url
+
+    schema_response = await send_request(client, 'GET', url, headers = schema_headers)
+    if schema_response['success'] == False:
+        print("Unsuccessful request to url:{}\nCheck url and API key.".format(url))
+        print("Response status:\n{}".format(schema_response['error']))
+        return {'success':False, 'response':None, 'headers':None}
+
+    return {'success':True, 'response':json.loads(schema_response['content']), 'headers':schema_response['headers']}
+
+async def request_table(client, table_headers, table_data):
+    '''Send request for table to API using an async client. Check request was successful.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        table_headers (dict): The headers of the request.
+        table_data (str): The JSON formatted body of the request.
+
+    Returns:
+        dict: Dictionary with the following items: 'success'; 'response' - the JSON table data; 'content' - the response
+            content as returned by the API. 'response' and 'content' are None if the request was unsuccessful.
+    '''
+    table_response = await send_request(client, 'POST', stat_xplore_table.table_url, headers = table_headers, data = table_data)
+    if table_response['success'] == False:
+        print("Unsuccessful request to url:{}\nCheck url and API key.".format(stat_xplore_table.table_url))
+        print("Response status:\n{}".format(table_response['error']))
+        return {'success':False, 'response':None, 'content':None}
+
+    with stat_xplore_metrics.time_stage('decode', bytes = len(table_response['content'])):
+        dict_response = json.loads(table_response['content'])
+
+    return {'success':True, 'response':dict_response, 'content':table_response['content']}
+
+async def acquire_lock(lock):
+    '''Acquire a threading lock without blocking the event loop. If the lock is held, it is waited for in a thread of its
+    own rather than the loop's default executor, so that waiting crawls can't take all the worker threads that the crawl
+    holding the lock needs for run_blocking. If the caller is cancelled while waiting, the lock is released as soon as
+    the thread acquires it.
+
+    Args:
+        lock (threading Lock): The lock to acquire
+    '''
+    if lock.acquire(blocking = False):
+        return
+
+    acquired = concurrent.futures.Future()
+
+    def wait_for_lock():
+        lock.acquire()
+        acquired.set_result(True)
+
+    threading.Thread(target = wait_for_lock, daemon = True).start()
+    try:
+        await asyncio.shield(asyncio.wrap_future(acquired))
+    except asyncio.CancelledError:
+        acquired.add_done_callback(lambda future: lock.release())
+        raise
+
+async def get_full_schema(client, schema_headers, types_to_include = ["FOLDER","DATABASE","MEASURE","FIELD"], check_cache = False, schema_filename = 'schema.csv', resume = True, checkpoint_batch_size = 100):
+    '''Get the schema information of all elements of the Stat-Xplore schema, crawling the schema tree from the root folder.
+    The crawl is checkpointed and resumable in the same way as stat_xplore_schema.get_full_schema. The schema locations
+    of each batch are requested concurrently, up to the client's concurrency limit.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers to use in the html request to the stat-xplore API.
+
+    Kwargs:
+        types_to_include (list of str): Defaults to ["FOLDER","DATABASE","MEASURE","FIELD"].
+            The schema element types to include in the schema dataframe
+        check_cache (bool): Default False. Set whether to check the cached schema csv for schema information
+        schema_filename (str): Default 'schema.csv'. The filename of the chached schema
+        resume (bool): Default True. Set whether to resume from the checkpoint of an interrupted crawl, if there is one
+        checkpoint_batch_size (int): Default 100. The number of schema locations to request between checkpoints
+
+    Returns:
+        pandas DataFrame: The full schema. None if the root folder could not be requested.
+    '''
+    # Hold the same lock as stat_xplore_schema.get_full_schema, so that sync and async crawls of the same schema file
+    # wait for each other
+    crawl_lock = stat_xplore_schema.get_schema_crawl_lock(schema_filename)
+    await acquire_lock(crawl_lock)
+    try:
+        with stat_xplore_metrics.time_stage('schema_crawl', schema_filename = schema_filename):
+            crawl = None
+            if resume == True:
+                crawl = await run_blocking(stat_xplore_schema.resume_schema_crawl, schema_filename)
+
+            # Index the cached schema once so that cached locations are looked up without requests
+            schema_store = None
+            if check_cache == True:
+                try:
+                    schema_store = await run_blocking(stat_xplore_schema.load_schema_store, schema_filename)
+                except OSError:
+                    schema_store = None
+
+            if crawl is None:
+                df_root_schema = pd.DataFrame()
+                if schema_store is not None:
+                    df_root_schema = await run_blocking(stat_xplore_schema.get_cached_root_schema, schema_filename)
+
+                if len(df_root_schema) == 0:
+                    root_reponse = await request_schema(client, schema_headers)
+                    if root_reponse['success'] == False:
+                        return
+                    df_root_schema = stat_xplore_schema.root_schema_to_dataframe(root_reponse['response'])
+
+                crawl = await run_blocking(stat_xplore_schema.start_schema_crawl, df_root_schema, schema_filename)
+
+            while len(crawl['still_to_map']) >0:
+
+                batch = crawl['still_to_map'][:checkpoint_batch_size]
+                crawl['still_to_map'] = crawl['still_to_map'][checkpoint_batch_size:]
+
+                children_schema_results = await asyncio.gather(*[get_children_schema_of_url(client, location, schema_headers, schema_store = schema_store) for location in batch])
+
+                await run_blocking(stat_xplore_schema.record_schema_crawl_batch, crawl, batch, children_schema_results, types_to_include)
+
+            return await run_blocking(stat_xplore_schema.finish_schema_crawl, crawl)
+    finally:
+        crawl_lock.release()
+
+async def get_children_schema_of_url(client, url, schema_headers, schema_store = None):
+    '''Given a url of a Stat-xplore schema item, get the schema details of the children (component) items,
+    using an async client. See stat_xplore_schema.get_children_schema_of_url.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        url (str): The url of the schema item to get the children schema details of.
+        schema_headers (dict): The headers to use in the html request to the stat-xplore API.
+
+    Kwargs:
+        schema_store (dict, None): Default None. An indexed cached schema, as returned by stat_xplore_schema.load_schema_store.
+            If given, the children schema is taken from it when the url is cached.
+
+    Returns:
+        dict: Dictionary with the following items: 'success'; 'schema' - DataFrame of the children schema; 'from_cache'
+    '''
+    if schema_store is not None:
+        parent_id = schema_store['id_by_location'].get(url)
+        df_schema = schema_store['children_by_parent_id'].get(parent_id)
+        is_cached = (df_schema is not None) and (len(df_schema) != 0)
+        stat_xplore_metrics.record_cache('schema_cache', is_cached, url = url)
+        if is_cached:
+            return {'success':True, 'schema':df_schema, 'from_cache':True}
+
+    schema_response = await request_schema(client, schema_headers, url = url)
+    if schema_response['success'] == False:
+        return {'success':False, 'schema':None, 'from_cache':False}
+
+    schema_response_json = schema_response['response']
+    df_schema = pd.DataFrame(schema_response_json['children'])
+    df_schema['parent_id'] = schema_response_json['id']
+
+    return {'success':True, 'schema':df_schema, 'from_cache':False}
+
+async def get_schema_tree(schema_headers, df_schema = None, check_cache = False, schema_filename = 'schema.csv'):
+    '''Get the schema as a SchemaTree without requesting anything. A schema DataFrame is converted and a complete cached
+    schema is indexed in a worker thread, otherwise a LazySchemaTree is returned, whose items are requested with
+    load_lazy_schema_path. See stat_xplore_schema.get_schema_tree.
+
+    Args:
+        schema_headers (dict): The headers of the schema requests
+
+    Kwargs:
+        df_schema (pandas DataFrame, SchemaTree, None): Default None. The stat-xplore schema
+        check_cache (bool): Default False. Set whether to use the cached schema
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
+
+    Returns:
+        SchemaTree: The schema tree
+    '''
+    if isinstance(df_schema, stat_xplore_schema_tree.SchemaTree):
+        return df_schema
+    return await run_blocking(stat_xplore_schema.get_schema_tree, schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename, lazy = True)
+
+async def load_lazy_schema_item(client, schema_headers, schema_tree, location):
+    '''Add a schema item and its children to a LazySchemaTree, from the tree's cache or requested with the async client,
+    unless they are already in the tree.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        schema_tree (LazySchemaTree): The schema tree
+        location (str): The location (url) of the item
+
+    Returns:
+        SchemaNode: The node of the item. Raises a KeyError if the item could not be requested.
+    '''
+    if schema_tree.is_loaded(location):
+        return schema_tree.get_by_location(location)
+
+    item_json = schema_tree.get_cached_item(location) if schema_tree.get_cached_item is not None else None
+    if item_json is None:
+        schema_response = await request_schema(client, schema_headers, url = location)
+        if schema_response['success'] == False:
+            raise KeyError('Unable to get the schema item at {}'.format(location))
+        item_json = stat_xplore_schema.get_schema_item_json(schema_response['response'])
+        if schema_tree.cache_item is not None:
+            schema_tree.cache_item(location, item_json)
+
+    return schema_tree.add_loaded_item(location, item_json)
+
+async def load_lazy_schema_path(client, schema_headers, schema_tree, id, labels):
+    '''Add the items along a path of child labels from a node to a LazySchemaTree, requesting them with the async client,
+    so that looking the path up, or the children of any node along it, makes no requests. See SchemaTree.resolve.
+    A schema tree that isn't lazy already has every item.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        schema_tree (SchemaTree): The schema tree
+        id (str): The id of the node to start from
+        labels (list of str): The label of the child to follow at each step
+    '''
+    if isinstance(schema_tree, stat_xplore_schema_tree.LazySchemaTree) == False:
+        return
+
+    node = schema_tree.nodes_by_id.get(id)
+    node = await load_lazy_schema_item(client, schema_headers, schema_tree, schema_tree.root_location + '/' + id if node is None else node.location)
+    for label in labels:
+        # A missing label is reported when the path is looked up
+        if label not in node.children_by_label:
+            break
+        node = await load_lazy_schema_item(client, schema_headers, schema_tree, node.children_by_label[label].location)
+
+    if schema_tree.save_items is not None:
+        await run_blocking(schema_tree.save_items)
+
+async def get_valueset_recodes(client, schema_headers, valueset_url, check_cache = False, recode_cache_filename = 'schema_recodes.json', recode_cache_ttl = None):
+    '''Get the recodes of a valueset, from the recode cache or requested with the async client. See stat_xplore_schema.get_valueset_recodes.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        valueset_url (str): Location of the valueset to return recodes from
+
+    Kwargs:
+        check_cache (bool): Default False. Set whether to check and update the recode cache
+        recode_cache_filename (str): Default 'schema_recodes.json'. The filename of the recode cache
+        recode_cache_ttl (int, None): Default None. The age in seconds after which cached recodes are requested from the API again.
+
+    Returns:
+        list of str: List of all recode IDs. None if the recodes could not be requested.
+    '''
+    if check_cache == True:
+        cached_recodes = await run_blocking(stat_xplore_schema.get_cached_valueset_recodes, recode_cache_filename, valueset_url, recode_cache_ttl = recode_cache_ttl)
+        if cached_recodes is not None:
+            return cached_recodes
+
+    with stat_xplore_metrics.time_stage('valueset_recodes', url = valueset_url) as event:
+        recodes = await get_recodes_from_valueset_location_all_pages(client, schema_headers, valueset_url)
+        if recodes is None:
+            event['error'] = 'Unable to get all pages of recodes'
+            return None
+        event['recodes'] = len(recodes)
+
+    if check_cache == True:
+        await run_blocking(stat_xplore_schema.cache_valueset_recodes, recode_cache_filename, valueset_url, recodes)
+
+    return recodes
+
+async def get_recodes_from_valueset_location_single_page(client, schema_headers, valueset_url):
+    '''Request a page of the recodes of a valueset with the async client. See stat_xplore_schema.get_recodes_from_valueset_location_single_page.
+
+    Returns:
+        dict: Keys: 'recodes' - list of string recode IDs; 'next_page_url'; 'last_page_url'. None if the page could not be requested.
+    '''
+    schema_response = await request_schema(client, schema_headers, url = valueset_url)
+    if schema_response['success'] == False:
+        return None
+
+    links = stat_xplore_schema.parse_link_header(schema_response['headers'])
+    return {'recodes':[child['id'] for child in schema_response['response']['children']], 'next_page_url':links.get('next'), 'last_page_url':links.get('last')}
+
+async def get_recodes_from_valueset_location_all_pages(client, schema_headers, valueset_first_page_url, page_batch_size = 8):
+    '''Request all pages of the recodes of a valueset with the async client. Where the page urls contain a page number
+    query parameter, the remaining pages are requested concurrently, up to the client's concurrency limit. Otherwise each
+    page is requested in turn by following the link to the next page. See stat_xplore_schema.get_recodes_from_valueset_location_all_pages.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        valueset_first_page_url (str): Location of the first page of the valueset
+
+    Kwargs:
+        page_batch_size (int): Default 8. The number of pages to request at once when the number of pages is not known
+
+    Returns:
+        list of str: List of all recode IDs, in page order. None if any page could not be requested.
+    '''
+    dict_get_recodes = await get_recodes_from_valueset_location_single_page(client, schema_headers, valueset_first_page_url)
+    if dict_get_recodes is None:
+        print('Failed to get recodes from valueset location {}'.format(valueset_first_page_url))
+        return None
+    all_recodes = list(dict_get_recodes['recodes'])
+    next_page_url = dict_get_recodes['next_page_url']
+    if next_page_url is None:
+        return all_recodes
+
+    page_param = stat_xplore_schema.get_page_query_parameter(next_page_url)
+    if page_param is not None:
+        first_page_number = stat_xplore_schema.get_query_parameter_value(valueset_first_page_url, page_param)
+        if first_page_number is None:
+            # The first page url doesn't include the page parameter, get the second page to find the step between pages
+            dict_get_recodes = await get_recodes_from_valueset_location_single_page(client, schema_headers, next_page_url)
+            if dict_get_recodes is None:
+                print('Failed to get recodes from valueset location {}'.format(next_page_url))
+                return None
+            all_recodes += dict_get_recodes['recodes']
+            if dict_get_recodes['next_page_url'] is None:
+                return all_recodes
+            first_page_number = stat_xplore_schema.get_query_parameter_value(next_page_url, page_param)
+            next_page_url = dict_get_recodes['next_page_url']
+
+        next_page_number = stat_xplore_schema.get_query_parameter_value(next_page_url, page_param)
+        page_step = next_page_number - first_page_number
+        if page_step > 0:
+            last_page_number = None
+            if dict_get_recodes['last_page_url'] is not None:
+                last_page_number = stat_xplore_schema.get_query_parameter_value(dict_get_recodes['last_page_url'], page_param)
+
+            page_recodes = await get_recodes_from_numbered_pages(client, schema_headers, next_page_url, page_param, next_page_number, page_step, last_page_number, page_batch_size = page_batch_size)
+            if page_recodes is None:
+                return None
+            return all_recodes + page_recodes
+
+    # Request each page in turn
+    while next_page_url is not None:
+        dict_get_recodes = await get_recodes_from_valueset_location_single_page(client, schema_headers, next_page_url)
+        if dict_get_recodes is None:
+            print('Failed to get recodes from valueset location {}'.format(next_page_url))
+            return None
+        all_recodes += dict_get_recodes['recodes']
+        next_page_url = dict_get_recodes['next_page_url']
+    return all_recodes
+
+async def get_recodes_from_numbered_pages(client, schema_headers, page_url, page_param, page_number, page_step, last_page_number = None, page_batch_size = 8):
+    '''Request pages of recodes concurrently with the async client by setting the page query parameter of the page url.
+    See stat_xplore_schema.get_recodes_from_numbered_pages.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        page_url (str): The url of the first page to request
+        page_param (str): The name of the query parameter that sets the page
+        page_number (int): The value of the page query parameter of the first page to request
+        page_step (int): The increase in the page query parameter from one page to the next
+
+    Kwargs:
+        last_page_number (int, None): Default None. The value of the page query parameter of the last page. If known all
+            remaining pages are requested at once, otherwise in batches of page_batch_size until the last page is reached.
+        page_batch_size (int): Default 8. The number of pages to request at once when the last page is not known
+
+    Returns:
+        list of str: List of the recode IDs of the requested pages, in page order. None if a page could not be requested,
+            even when retried on its own.
+    '''
+    all_recodes = []
+    while True:
+        if last_page_number is not None:
+            page_numbers = range(page_number, last_page_number + 1, page_step)
+        else:
+            page_numbers = range(page_number, page_number + page_batch_size*page_step, page_step)
+        page_urls = [stat_xplore_schema.set_query_parameter_value(page_url, page_param, n) for n in page_numbers]
+
+        pages = await asyncio.gather(*[get_recodes_from_valueset_location_single_page(client, schema_headers, url) for url in page_urls])
+        for url, dict_get_recodes in zip(page_urls, pages):
+            if dict_get_recodes is None:
+                # Retry the page on its own so that a failed page is not skipped
+                dict_get_recodes = await get_recodes_from_valueset_location_single_page(client, schema_headers, url)
+                if dict_get_recodes is None:
+                    print('Failed to get recodes from valueset location {}'.format(url))
+                    return None
+            all_recodes += dict_get_recodes['recodes']
+            if dict_get_recodes['next_page_url'] is None:
+                return all_recodes
+
+        if last_page_number is not None:
+            return all_recodes
+        page_number += page_batch_size*page_step
+
+async def build_request_body(client, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', check_cache = False, schema_filename = 'schema.csv', field_recodes = None):
+    '''Async version of stat_xplore_table.build_request_body. The schema items and geography recodes the body needs are
+    taken from the cache, or requested with the async client.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        schema_headers (dict): The headers of the schema requests
+        measure_id (str or list of str): The id of the measure, or a list of ids of measures from the same database, to request data for
+
+    Kwargs:
+        See stat_xplore_table.build_request_body.
+
+    Returns:
+        dict: Dictionary with keys 'database', 'measures', 'recodes', 'dimensions'. Raises a ValueError if the geography recodes
+            could not all be requested, or a KeyError if the schema items could not be requested.
+    '''
+    schema_tree = await get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename)
+    database_id = stat_xplore_table.get_database_id(measure_id)
+
+    # Load the database, for its fields, and the path to the geography field, for its valuesets
+    await load_lazy_schema_path(client, schema_headers, schema_tree, database_id, [geog_folder_label, geog_field_label])
+
+    geog_field_id, geog_field_valueset_loc = stat_xplore_schema.get_geography_valueset_location(schema_tree, database_id, geog_folder_label, geog_field_label, geog_level_label)
+    dimensions_values = stat_xplore_table.get_dimensions_body(schema_headers, database_id, field_ids, df_schema = schema_tree)
+
+    geog_recodes = await get_valueset_recodes(client, schema_headers, geog_field_valueset_loc, check_cache = check_cache,
+                                              recode_cache_filename = stat_xplore_schema.get_recode_cache_filename(schema_filename))
+    # Fail rather than request data for only some geographies
+    if geog_recodes is None:
+        raise ValueError('Unable to get the {} recodes of {}.'.format(geog_level_label, database_id))
+    recodes_values = stat_xplore_table.format_recodes_for_api({geog_field_id:geog_recodes}, include_total = True)
+
+    return stat_xplore_table.assemble_request_body(database_id, measure_id, recodes_values, dimensions_values, fields_include_total = fields_include_total, field_recodes = field_recodes)
+
+async def get_stat_xplore_measure_data(client, table_headers, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', categorical = False, check_cache = False, schema_filename = 'schema.csv', max_cells = None, split_field_id = None, table_cache = None, field_recodes = None, row_field_ids = None, column_field_ids = None, drop_zeros = False, cube_directory = None):
+    '''Async version of stat_xplore_table.get_stat_xplore_measure_data. Table requests, including the chunks of a
+    chunked request, and the schema and geography recode requests needed to build the request body, are sent with the
+    async client. Pass a SchemaTree as df_schema when requesting several tables, so the schema is only indexed once.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
+        schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
+        measure_id (str or list of str): The id of the measure, or a list of ids of measures from the same database, to request data for
+
+    Kwargs:
+        See stat_xplore_table.get_stat_xplore_measure_data. Chunks are requested concurrently up to the client's concurrency limit.
+
+    Returns:
+        dict: Dictionary with the following items: 'data' - a pandas Data Frame of the request data, or None if request was unsucessfull;
+                'annotations' - A string of the annotations accoumpanying the data. Contains info on what the data show.
+    '''
+    # Build request body
+    with stat_xplore_metrics.time_stage('build_body', measure_id = measure_id):
+        body = await build_request_body(client, schema_headers, measure_id, field_ids = field_ids, fields_include_total = fields_include_total, df_schema = df_schema,
+                                        geog_folder_label = geog_folder_label, geog_field_label = geog_field_label, geog_level_label = geog_level_label, check_cache = check_cache, schema_filename = schema_filename, field_recodes = field_recodes)
+
+    # Request data
+    with stat_xplore_metrics.time_stage('request', measure_id = measure_id, chunked = max_cells is not None):
+        if max_cells is None:
+            json_data = await request_table_json(client, table_headers, body, table_cache = table_cache)
+        else:
+            json_data = await request_table_in_chunks(client, table_headers, body, stat_xplore_table.get_geography_field_id(body), max_cells, split_field_id = split_field_id, table_cache = table_cache)
+
+    if json_data is None:
+        return {'data':None, 'annotations':None}
+
+    # Format data into dataframe
+    with stat_xplore_metrics.time_stage('unpack', measure_id = measure_id) as event:
+        if row_field_ids is None:
+            df_data = await run_blocking(stat_xplore_table.json_response_to_dataframe, json_data, categorical = categorical, drop_zeros = drop_zeros)
+        else:
+            df_data = await run_blocking(stat_xplore_table.json_response_to_wide_dataframe, json_data, row_field_ids, column_field_ids = column_field_ids)
+        event['rows'] = len(df_data)
+
+    if cube_directory is not None:
+        with stat_xplore_metrics.time_stage('store_cube', measure_id = measure_id):
+            await run_blocking(stat_xplore_table.write_response_cube, json_data, cube_directory)
+
+    # Get database annotations (footnaotes)
+    database_annotations = stat_xplore_table.get_database_annotations(json_data)
+
+    return {'data': df_data, 'annotations':database_annotations}
+
+async def request_table_json(client, table_headers, body, table_cache = None):
+    '''Send a request body to the table end point using an async client and return the JSON data of the response.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        table_headers (dict): The headers of the request.
+        body (dict): The request body, as returned by stat_xplore_table.build_request_body
+
+    Kwargs:
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache.
+            If the cache has a response for the body it is used instead of sending the request. Otherwise the response is cached.
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point. None if the request was unsuccessful.
+    '''
+    if table_cache is not None:
+        content = await run_blocking(stat_xplore_cache.get_cached_response, table_cache, body)
+        if content is not None:
+            with stat_xplore_metrics.time_stage('decode', bytes = len(content)):
+                return json.loads(content)
+
+    response_dict = await request_table(client, table_headers, json.dumps(body))
+    if response_dict['success'] == False:
+        return None
+
+    if table_cache is not None:
+        await run_blocking(stat_xplore_cache.cache_response, table_cache, body, response_dict['content'])
+
+    return response_dict['response']
+
+async def request_table_in_chunks(client, table_headers, body, geog_field_id, max_cells, split_field_id = None, table_cache = None):
+    '''Request table data in chunks so that no single request is larger than max_cells, using an async client.
+    See stat_xplore_table.request_table_in_chunks.
+
+    Args:
+        client (dict): The client, as returned by open_client
+        table_headers (dict): The headers of the request.
+        body (dict): The request body, as returned by stat_xplore_table.build_request_body
+        geog_field_id (str): The field ID of the geography field, whose recodes are split into chunks
+        max_cells (int): The maximum number of cells to request in a single request
+
+    Kwargs:
+        split_field_id (str, None): Default None. The field ID of a second field to split into chunks if a single geography is
+            larger than max_cells.
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache. Each chunk is cached separately.
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point, combined from all chunks. None if any request was unsuccessful.
+    '''
+    # Request the whole table if the recodes show it is small enough, without probing
+    n_body_cells = stat_xplore_table.get_body_cube_size(body)
+    if (n_body_cells is not None) and (n_body_cells <= max_cells):
+        return await request_table_json(client, table_headers, body, table_cache = table_cache)
+
+    # Request the first geography to find the number of cells per geography
+    probe_body = stat_xplore_table.get_probe_body(body, geog_field_id)
+    probe_data = await request_table_json(client, table_headers, probe_body, table_cache = table_cache)
+    if probe_data is None:
+        return None
+
+    chunk_plan = stat_xplore_table.plan_table_chunks(body, geog_field_id, probe_data, max_cells, split_field_id = split_field_id)
+    if chunk_plan is None:
+        if probe_body is body:
+            return probe_data
+        return await request_table_json(client, table_headers, body, table_cache = table_cache)
+
+    async def request_chunk(chunk_body):
+        if chunk_body == probe_body:
+            return probe_data
+        return await request_table_json(client, table_headers, chunk_body, table_cache = table_cache)
+
+    print('Requesting table in {} chunks.'.format(len(chunk_plan['bodies'])))
+    chunk_data = await asyncio.gather(*[request_chunk(chunk_body) for chunk_body in chunk_plan['bodies']])
+    if any(data is None for data in chunk_data):
+        return None
+
+    return await run_blocking(stat_xplore_table.combine_table_chunks, chunk_plan, list(chunk_data))
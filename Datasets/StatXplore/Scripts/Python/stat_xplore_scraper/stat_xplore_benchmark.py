@@ -0,0 +1,526 @@
+# Benchmarks of the scraper against the local mock Stat-Xplore API
+#
+# Times the schema crawl, lazy schema lookups, the paging of valueset recodes, table requests and a full measure data
+# request against stat_xplore_mock_server, counting the requests made, and times the unpacking of table responses of
+# realistic sizes into long, wide and sparse DataFrames and reloading them from the cube store, reporting throughput and
+# peak memory. Each benchmark is run several times and the fastest run kept.
+#
+# Results can be saved and compared with a previous run to catch performance regressions.
+#
+# Usage:
+#   python stat_xplore_benchmark.py [--output results.json] [--baseline results.json] [--tolerance 0.2] [--cube-shapes 400x12x5 ...]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import asyncio
+import tracemalloc
+import numpy as np
+import stat_xplore_client
+import stat_xplore_schema
+import stat_xplore_table
+import stat_xplore_stream
+import stat_xplore_async
+import stat_xplore_cube_store
+import stat_xplore_mock_server
+
+# Default size of the mock schema. Each database has n_fields + 2 fields, and valuesets of n_values values
+default_schema_size = {'n_folders':10, 'n_databases':5, 'n_fields':5, 'n_values':20, 'n_geography_values':2000}
+
+# Default shapes of the cubes to unpack: local authorities by quarters by one or two other fields
+default_cube_shapes = [(400, 12, 5), (400, 40, 10, 4)]
+
+# The fraction of the cells of a cube that are not zero, in the sparse unpacking benchmarks
+default_sparse_density = 0.05
+
+# Metrics compared with the baseline. A larger value is a regression.
+regression_metrics = ['seconds', 'requests', 'peak_mb']
+
+
+def time_best_of(function, repeats = 3, setup = None):
+    '''Run a function several times and return the time of the fastest run and the result of the last.
+
+    Args:
+        function (callable): The function to time, called without arguments
+
+    Kwargs:
+        repeats (int): Default 3. The number of runs
+        setup (callable, None): Default None. A function called before each run, not included in the time
+
+    Returns:
+        tuple: The time of the fastest run in seconds, float; the result of the last run
+    '''
+    best_seconds = None
+    result = None
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    return best_seconds, result
+
+def get_peak_memory(function):
+    '''Get the peak memory allocated while running a function, in MB. numpy arrays are included.'''
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / (1024*1024)
+
+def count_requests(mock_server, function):
+    '''Run a function and return the number of schema and table requests it made to the mock server, and its result.'''
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+    result = function()
+    return sum(mock_server['counts'].values()), result
+
+def benchmark_schema_crawl(mock_server, work_dir, max_workers = 8, repeats = 3):
+    '''Benchmark a full crawl of the mock schema with stat_xplore_schema.get_full_schema.
+
+    Args:
+        mock_server (dict): The mock server, as returned by stat_xplore_mock_server.start_mock_server
+        work_dir (str): A directory to write the crawled schema to
+
+    Kwargs:
+        max_workers (int): Default 8. The number of schema requests sent concurrently
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'requests'; 'items' - the number of schema items crawled
+    '''
+    schema_filename = os.path.join(work_dir, 'crawl_schema.csv')
+
+    def setup():
+        if os.path.exists(schema_filename):
+            os.remove(schema_filename)
+        stat_xplore_client.clear_cache()
+
+    def crawl():
+        return stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename, max_workers = max_workers)
+
+    seconds, df_schema = time_best_of(crawl, repeats = repeats, setup = setup)
+    setup()
+    n_requests, df_schema = count_requests(mock_server, crawl)
+    return {'seconds':seconds, 'requests':n_requests, 'items':len(df_schema)}
+
+def benchmark_async_schema_crawl(mock_server, work_dir, max_concurrency = 8, repeats = 3):
+    '''Benchmark a full crawl of the mock schema with stat_xplore_async.get_full_schema. Returns None if aiohttp is not installed.
+    See benchmark_schema_crawl.'''
+    if stat_xplore_async.aiohttp is None:
+        return None
+
+    schema_filename = os.path.join(work_dir, 'async_crawl_schema.csv')
+
+    def setup():
+        if os.path.exists(schema_filename):
+            os.remove(schema_filename)
+
+    async def crawl_async():
+        client = await stat_xplore_async.open_client(max_concurrency = max_concurrency)
+        try:
+            return await stat_xplore_async.get_full_schema(client, {}, schema_filename = schema_filename)
+        finally:
+            await stat_xplore_async.close_client(client)
+
+    def crawl():
+        return asyncio.run(crawl_async())
+
+    seconds, df_schema = time_best_of(crawl, repeats = repeats, setup = setup)
+    setup()
+    n_requests, df_schema = count_requests(mock_server, crawl)
+    return {'seconds':seconds, 'requests':n_requests, 'items':len(df_schema)}
+
+def benchmark_lazy_schema(mock_server, database_id, repeats = 3):
+    '''Benchmark finding the geography valueset of a database with a LazySchemaTree, see stat_xplore_schema.get_lazy_schema_tree,
+    from a cold start without a cached schema.
+
+    Args:
+        mock_server (dict): The mock server, as returned by stat_xplore_mock_server.start_mock_server
+        database_id (str): The id of a database of the mock schema
+
+    Kwargs:
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'requests'
+    '''
+    def resolve():
+        schema_tree = stat_xplore_schema.get_lazy_schema_tree({})
+        return stat_xplore_schema.get_geography_valueset_location(schema_tree, database_id, 'Geography (residence-based)', 'National - Regional - LA - OAs', 'Local Authority')
+
+    seconds, location = time_best_of(resolve, repeats = repeats, setup = stat_xplore_client.clear_cache)
+    stat_xplore_client.clear_cache()
+    n_requests, location = count_requests(mock_server, resolve)
+    return {'seconds':seconds, 'requests':n_requests}
+
+def benchmark_recode_paging(mock_server, valueset_url, max_workers = 8, repeats = 3):
+    '''Benchmark getting all pages of the recodes of a valueset with stat_xplore_schema.get_recodes_from_valueset_location_all_pages.
+
+    Args:
+        mock_server (dict): The mock server, as returned by stat_xplore_mock_server.start_mock_server
+        valueset_url (str): The location of the valueset
+
+    Kwargs:
+        max_workers (int): Default 8. The number of pages requested concurrently
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'requests'; 'recodes' - the number of recodes
+    '''
+    def get_recodes():
+        return stat_xplore_schema.get_recodes_from_valueset_location_all_pages({}, valueset_url, max_workers = max_workers)
+
+    seconds, recodes = time_best_of(get_recodes, repeats = repeats, setup = stat_xplore_client.clear_cache)
+    stat_xplore_client.clear_cache()
+    n_requests, recodes = count_requests(mock_server, get_recodes)
+    return {'seconds':seconds, 'requests':n_requests, 'recodes':len(recodes)}
+
+def get_cube_body(database_id, measure_id, cube_shape):
+    '''Build a table request body for a cube of a given shape. The mock server returns a cube with a dimension per
+    recoded field, so synthetic fields and values are used.
+
+    Args:
+        database_id (str): The id of a database of the mock schema
+        measure_id (str): The id of a measure of the database
+        cube_shape (tuple of int): The number of values of each field
+
+    Returns:
+        dict: The request body
+    '''
+    field_ids = ['str:field:BENCHMARK:F{}'.format(i) for i in range(len(cube_shape))]
+    recodes = {field_id:{'map':[['str:value:BENCHMARK:F{}:{}'.format(i, j)] for j in range(n)], 'total':False} for i, (field_id, n) in enumerate(zip(field_ids, cube_shape))}
+    return {'database':database_id, 'measures':[measure_id], 'dimensions':[[field_id] for field_id in field_ids], 'recodes':recodes}
+
+def benchmark_table_request(mock_server, body, stream = False, repeats = 3):
+    '''Benchmark a table request with stat_xplore_table.request_table_json, including decoding the response.
+
+    Args:
+        mock_server (dict): The mock server, as returned by stat_xplore_mock_server.start_mock_server
+        body (dict): The request body
+
+    Kwargs:
+        stream (bool): Default False. Set whether to stream the response, see stat_xplore_table.request_table_json
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'requests'
+    '''
+    def request():
+        return stat_xplore_table.request_table_json({}, body, stream = stream)
+
+    seconds, dict_response = time_best_of(request, repeats = repeats)
+    n_requests, dict_response = count_requests(mock_server, request)
+    if dict_response is None:
+        raise RuntimeError('Table request to the mock server failed.')
+    return {'seconds':seconds, 'requests':n_requests}
+
+def benchmark_unpack(content, categorical = False, stream = False, repeats = 3):
+    '''Benchmark decoding the content of a table response and unpacking it into a DataFrame with
+    stat_xplore_table.json_response_to_dataframe.
+
+    Args:
+        content (bytes): The content of the table response
+
+    Kwargs:
+        categorical (bool): Default False. Set whether to unpack the field columns as Categoricals
+        stream (bool): Default False. Set whether to decode the response with stat_xplore_stream.decode_table_response
+            from a file, rather than with the json module
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'bytes' - the size of the content; 'cells' - the number of values
+            unpacked; 'cells_per_second'; 'peak_mb' - the peak memory allocated while decoding and unpacking
+    '''
+    def unpack():
+        if stream:
+            with tempfile.TemporaryFile() as response_file:
+                response_file.write(content)
+                dict_response = stat_xplore_stream.decode_table_response(response_file)
+        else:
+            dict_response = json.loads(content)
+        return stat_xplore_table.json_response_to_dataframe(dict_response, categorical = categorical)
+
+    seconds, df_data = time_best_of(unpack, repeats = repeats)
+    peak_mb = get_peak_memory(unpack)
+    return {'seconds':seconds, 'bytes':len(content), 'cells':len(df_data), 'cells_per_second':len(df_data) / seconds, 'peak_mb':peak_mb}
+
+def benchmark_wide(dict_response, pivot = False, repeats = 3):
+    '''Benchmark reshaping a table response into a wide DataFrame, with the first field as rows and the other fields as
+    columns, either directly with stat_xplore_table.json_response_to_wide_dataframe, or by building the long DataFrame
+    and pivoting it.
+
+    Args:
+        dict_response (dict): The decoded table response
+
+    Kwargs:
+        pivot (bool): Default False. Set whether to build the long DataFrame and pivot it
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'cells' - the number of values; 'peak_mb'
+    '''
+    field_ids = [field['uri'] for field in dict_response['fields']]
+    field_labels = [field['label'] for field in dict_response['fields']]
+
+    def reshape():
+        if pivot:
+            df_data = stat_xplore_table.json_response_to_dataframe(dict_response)
+            return df_data.set_index(field_labels)['value'].unstack(field_labels[1:])
+        return stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids[:1], column_field_ids = field_ids[1:])
+
+    seconds, df_data = time_best_of(reshape, repeats = repeats)
+    peak_mb = get_peak_memory(reshape)
+    return {'seconds':seconds, 'cells':int(df_data.size), 'peak_mb':peak_mb}
+
+def get_sparse_response(dict_response, density = default_sparse_density, seed = 0):
+    '''Copy a decoded table response, setting all but a fraction of the cells of each cube to zero.
+
+    Args:
+        dict_response (dict): The decoded table response
+
+    Kwargs:
+        density (float): Default 0.05. The fraction of cells that are not zero
+        seed (int): Default 0. The seed of the choice of cells
+
+    Returns:
+        dict: The sparse table response
+    '''
+    rng = np.random.default_rng(seed)
+    sparse_response = dict(dict_response)
+    sparse_response['cubes'] = {}
+    for measure_uri, cube in dict_response['cubes'].items():
+        cubes_array = np.asarray(cube['values'], dtype = 'float64')
+        sparse_response['cubes'][measure_uri] = {'values':np.where(rng.random(cubes_array.shape) < density, cubes_array, 0)}
+    return sparse_response
+
+def benchmark_sparse_unpack(dict_response, drop_zeros = True, repeats = 3):
+    '''Benchmark unpacking a mostly zero table response into a long DataFrame with stat_xplore_table.json_response_to_dataframe,
+    with or without dropping the zero cells.
+
+    Args:
+        dict_response (dict): The decoded table response, see get_sparse_response
+
+    Kwargs:
+        drop_zeros (bool): Default True. Set whether to drop the cells that are zero
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'rows'; 'peak_mb'
+    '''
+    def unpack():
+        return stat_xplore_table.json_response_to_dataframe(dict_response, categorical = True, drop_zeros = drop_zeros)
+
+    seconds, df_data = time_best_of(unpack, repeats = repeats)
+    peak_mb = get_peak_memory(unpack)
+    return {'seconds':seconds, 'rows':len(df_data), 'peak_mb':peak_mb}
+
+def benchmark_select_geography(content, cube_directory = None, repeats = 3):
+    '''Benchmark getting the data of the first item of the first field, eg one geography, of a table response as a
+    DataFrame, either by reopening the cube saved to the cube store and selecting the item, or by parsing the response
+    again and filtering the DataFrame.
+
+    Args:
+        content (bytes): The content of the table response
+
+    Kwargs:
+        cube_directory (str, None): Default None. A directory to save the cube to. If None the response is parsed again.
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'rows'; 'peak_mb'
+    '''
+    dict_response = json.loads(content)
+    field_id = dict_response['fields'][0]['uri']
+    item_uri = dict_response['fields'][0]['items'][0]['uris'][0]
+
+    if cube_directory is not None:
+        stat_xplore_table.write_response_cube(dict_response, cube_directory)
+    del dict_response
+
+    def select():
+        if cube_directory is not None:
+            cube = stat_xplore_cube_store.read_cube(cube_directory)
+            return stat_xplore_table.stored_cube_to_dataframe(stat_xplore_cube_store.select_cube(cube, {field_id:item_uri}))
+        df_data = stat_xplore_table.json_response_to_dataframe(json.loads(content))
+        return df_data.loc[df_data[field_id] == item_uri]
+
+    seconds, df_data = time_best_of(select, repeats = repeats)
+    peak_mb = get_peak_memory(select)
+    return {'seconds':seconds, 'rows':len(df_data), 'peak_mb':peak_mb}
+
+def benchmark_measure_data(mock_server, database_id, schema_filename, repeats = 3):
+    '''Benchmark getting the data of a measure by the first field of its database, including the total, and local authority
+    with stat_xplore_table.get_stat_xplore_measure_data, using the crawled schema. The geography recodes are requested
+    from the mock server on every run.
+
+    Args:
+        mock_server (dict): The mock server, as returned by stat_xplore_mock_server.start_mock_server
+        database_id (str): The id of a database of the mock schema
+        schema_filename (str): The crawled schema. The geography recodes are cached alongside it.
+
+    Kwargs:
+        repeats (int): Default 3. The number of runs
+
+    Returns:
+        dict: Dictionary with the following items: 'seconds'; 'requests'; 'rows' - the number of rows of data
+    '''
+    schema_tree = stat_xplore_schema.get_schema_tree(check_cache = True, schema_filename = schema_filename)
+    measure_id = schema_tree.children(database_id, type = 'COUNT')[0].id
+    field_id = schema_tree.children(database_id, type = 'FIELD')[0].id
+    recode_cache_filename = stat_xplore_schema.get_recode_cache_filename(schema_filename)
+
+    def setup():
+        stat_xplore_client.clear_cache()
+        stat_xplore_schema.invalidate_recode_cache(recode_cache_filename)
+
+    def get_data():
+        return stat_xplore_table.get_stat_xplore_measure_data({}, {}, measure_id, field_ids = [field_id], fields_include_total = field_id,
+                                                              df_schema = schema_tree, check_cache = True, schema_filename = schema_filename)
+
+    seconds, result = time_best_of(get_data, repeats = repeats, setup = setup)
+    setup()
+    n_requests, result = count_requests(mock_server, get_data)
+    if result['data'] is None:
+        raise RuntimeError('Measure data request to the mock server failed.')
+    return {'seconds':seconds, 'requests':n_requests, 'rows':len(result['data'])}
+
+def run_benchmarks(schema_size = None, cube_shapes = default_cube_shapes, latency = 0.002, table_latency = 0.02, max_workers = 8, repeats = 3, sparse_density = default_sparse_density):
+    '''Start a mock server and run all benchmarks against it.
+
+    Kwargs:
+        schema_size (dict, None): Default None. The kwargs of stat_xplore_mock_server.build_mock_schema. If None default_schema_size is used.
+        cube_shapes (list of tuple): The shapes of the cubes to request and unpack
+        latency (float): Default 0.002. The latency of the mock schema end point, in seconds
+        table_latency (float): Default 0.02. The latency of the mock table end point, in seconds
+        max_workers (int): Default 8. The number of requests sent concurrently
+        repeats (int): Default 3. The number of runs of each benchmark. The fastest is kept.
+        sparse_density (float): Default 0.05. The fraction of cells that are not zero in the sparse unpacking benchmarks
+
+    Returns:
+        dict: The results of each benchmark, keyed by benchmark name
+    '''
+    schema_size = dict(default_schema_size if schema_size is None else schema_size)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as work_dir, stat_xplore_mock_server.mock_stat_xplore_api(latency = latency, table_latency = table_latency, **schema_size) as mock_server:
+        mock_schema = mock_server['server'].mock['schema']
+        database_id = [id for id, item in mock_schema['items'].items() if item['type'] == 'DATABASE'][0]
+        measure_id = [id for id in mock_schema['items'][database_id]['children'] if mock_schema['items'][id]['type'] == 'COUNT'][0]
+        valueset_id = [id for id, item in mock_schema['items'].items() if (item['type'] == 'VALUESET') and (item['label'] == 'Local Authority')][0]
+        valueset_url = stat_xplore_mock_server.get_item_location(mock_server['url'], valueset_id, mock_schema['root_id'])
+
+        print('Crawling the schema')
+        results['schema_crawl'] = benchmark_schema_crawl(mock_server, work_dir, max_workers = max_workers, repeats = repeats)
+        async_result = benchmark_async_schema_crawl(mock_server, work_dir, max_concurrency = max_workers, repeats = repeats)
+        if async_result is not None:
+            results['async_schema_crawl'] = async_result
+        results['lazy_schema'] = benchmark_lazy_schema(mock_server, database_id, repeats = repeats)
+
+        print('Paging recodes')
+        results['recode_paging'] = benchmark_recode_paging(mock_server, valueset_url, max_workers = 1, repeats = repeats)
+        results['recode_paging_concurrent'] = benchmark_recode_paging(mock_server, valueset_url, max_workers = max_workers, repeats = repeats)
+
+        print('Requesting measure data')
+        schema_filename = os.path.join(work_dir, 'crawl_schema.csv')
+        results['measure_data'] = benchmark_measure_data(mock_server, database_id, schema_filename, repeats = repeats)
+
+        for cube_shape in cube_shapes:
+            shape_name = 'x'.join(str(n) for n in cube_shape)
+            print('Requesting and unpacking a {} cube'.format(shape_name))
+            body = get_cube_body(database_id, measure_id, cube_shape)
+            results['table_request_{}'.format(shape_name)] = benchmark_table_request(mock_server, body, repeats = repeats)
+            results['table_request_stream_{}'.format(shape_name)] = benchmark_table_request(mock_server, body, stream = True, repeats = repeats)
+
+            content = stat_xplore_table.request_table({}, json.dumps(body))['response'].content
+            results['unpack_{}'.format(shape_name)] = benchmark_unpack(content, repeats = repeats)
+            results['unpack_categorical_{}'.format(shape_name)] = benchmark_unpack(content, categorical = True, repeats = repeats)
+            results['unpack_stream_{}'.format(shape_name)] = benchmark_unpack(content, categorical = True, stream = True, repeats = repeats)
+
+            dict_response = json.loads(content)
+            results['wide_{}'.format(shape_name)] = benchmark_wide(dict_response, repeats = repeats)
+            results['wide_pivot_{}'.format(shape_name)] = benchmark_wide(dict_response, pivot = True, repeats = repeats)
+
+            sparse_response = get_sparse_response(dict_response, density = sparse_density)
+            results['unpack_sparse_{}'.format(shape_name)] = benchmark_sparse_unpack(sparse_response, repeats = repeats)
+            results['unpack_sparse_all_cells_{}'.format(shape_name)] = benchmark_sparse_unpack(sparse_response, drop_zeros = False, repeats = repeats)
+            del dict_response, sparse_response
+
+            results['select_cube_store_{}'.format(shape_name)] = benchmark_select_geography(content, cube_directory = os.path.join(work_dir, 'cube_' + shape_name), repeats = repeats)
+            results['select_reparse_{}'.format(shape_name)] = benchmark_select_geography(content, repeats = repeats)
+
+    return results
+
+def compare_results(results, baseline, tolerance = 0.2):
+    '''Compare benchmark results with a baseline. A metric has regressed if it is more than tolerance larger than the baseline.
+
+    Args:
+        results (dict): The benchmark results, as returned by run_benchmarks
+        baseline (dict): The baseline benchmark results
+
+    Kwargs:
+        tolerance (float): Default 0.2. The allowed increase, as a fraction of the baseline
+
+    Returns:
+        list of str: A description of each regression. Empty if there are none.
+    '''
+    regressions = []
+    for name, result in results.items():
+        for metric in regression_metrics:
+            if (metric not in result) or (metric not in baseline.get(name, {})):
+                continue
+            baseline_value = baseline[name][metric]
+            if result[metric] > baseline_value * (1 + tolerance):
+                regressions.append('{} {}: {:.4g} against a baseline of {:.4g}'.format(name, metric, result[metric], baseline_value))
+    return regressions
+
+def print_results(results):
+    '''Print benchmark results, one line per benchmark.'''
+    for name, result in results.items():
+        print('{:<40} {}'.format(name, ', '.join('{} {:.4g}'.format(metric, value) for metric, value in result.items())))
+
+def parse_cube_shape(cube_shape):
+    '''Parse a cube shape of the form '400x12x5' into a tuple of int.'''
+    return tuple(int(n) for n in cube_shape.lower().split('x'))
+
+
+def main(args = None):
+    '''Command line entry point. Run the benchmarks and optionally save and compare the results.'''
+    parser = argparse.ArgumentParser(description = 'Benchmark the Stat-Xplore scraper against a local mock API.')
+    parser.add_argument('--output', default = None, help = 'Save the results to this json file')
+    parser.add_argument('--baseline', default = None, help = 'Compare the results with a json file of previous results')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'The allowed increase over the baseline, as a fraction')
+    parser.add_argument('--cube-shapes', nargs = '+', default = None, help = 'The shapes of the cubes to unpack, eg 400x12x5')
+    parser.add_argument('--latency', type = float, default = 0.002, help = 'Seconds the mock server waits before each schema response')
+    parser.add_argument('--table-latency', type = float, default = 0.02, help = 'Seconds the mock server waits before each table response')
+    parser.add_argument('--max-workers', type = int, default = 8, help = 'The number of requests sent concurrently')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'The number of runs of each benchmark')
+    parsed_args = parser.parse_args(args)
+
+    cube_shapes = default_cube_shapes if parsed_args.cube_shapes is None else [parse_cube_shape(cube_shape) for cube_shape in parsed_args.cube_shapes]
+    results = run_benchmarks(cube_shapes = cube_shapes, latency = parsed_args.latency, table_latency = parsed_args.table_latency,
+                             max_workers = parsed_args.max_workers, repeats = parsed_args.repeats)
+    print_results(results)
+
+    if parsed_args.output is not None:
+        with open(parsed_args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+    if parsed_args.baseline is not None:
+        with open(parsed_args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, tolerance = parsed_args.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if len(regressions) > 0:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
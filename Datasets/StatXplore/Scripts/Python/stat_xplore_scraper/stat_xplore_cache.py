@@ -0,0 +1,215 @@
+# Disk cache of responses from the 'table' end point of the Stat-Xplore API, keyed by a hash of the request body
+import os
+import json
+import gzip
+import shutil
+import time
+import hashlib
+import threading
+import stat_xplore_metrics
+
+
+def create_table_cache(cache_dir, max_age = None, max_bytes = None):
+    '''Create a table response cache. Responses are stored gzip compressed in cache_dir, one file per request body.
+    The returned dictionary is passed to the table functions to use the cache, and records the cache hits and misses.
+
+    Args:
+        cache_dir (str): The directory to store cached responses in. Created if it doesn't exist.
+
+    Kwargs:
+        max_age (float, None): Default None. The age in seconds after which a cached response is not used, and is deleted
+            when it is next looked up or when responses are evicted. If None cached responses don't expire.
+        max_bytes (int, None): Default None. The maximum total size of the cached files. When exceeded, the least recently used
+            responses are removed. If None the cache size is not limited.
+
+    Returns:
+        dict: Dictionary with the following items: 'cache_dir', 'max_age', 'max_bytes' - the cache settings;
+            'stats' - dict with the number of 'hits', 'misses', 'evictions' and 'expired' responses deleted; 'lock' - lock used
+            to update the stats and evict files
+    '''
+    os.makedirs(cache_dir, exist_ok = True)
+    return {'cache_dir':cache_dir,
+            'max_age':max_age,
+            'max_bytes':max_bytes,
+            'stats':{'hits':0, 'misses':0, 'evictions':0, 'expired':0},
+            'lock':threading.Lock()}
+
+def get_body_key(body):
+    '''Get the cache key of a request body. The body is serialised with sorted keys and no whitespace so that
+    equal bodies always have the same key, then hashed.
+
+    Args:
+        body (dict): The request body, as returned by stat_xplore_table.build_request_body
+
+    Returns:
+        str: The SHA-256 hash of the request body
+    '''
+    canonical_body = json.dumps(body, sort_keys = True, separators = (',', ':'), ensure_ascii = True)
+    return hashlib.sha256(canonical_body.encode('utf-8')).hexdigest()
+
+def get_cache_filename(table_cache, body):
+    '''Get the filename of the cached response for a request body.'''
+    return os.path.join(table_cache['cache_dir'], get_body_key(body) + '.json.gz')
+
+def is_expired(table_cache, modified_time):
+    '''Check whether a cached response, with the modified time of its file, is older than the max age of the cache.'''
+    return (table_cache['max_age'] is not None) and (time.time() - modified_time >= table_cache['max_age'])
+
+def remove_cached_file(table_cache, filename):
+    '''Remove a cached response file, unless it has already been removed. Files that can't be removed, such as a file
+    that is open on Windows, are left to be removed later. Call with the cache lock held.
+
+    Returns:
+        bool: True if the file was removed
+    '''
+    try:
+        os.remove(os.path.join(table_cache['cache_dir'], filename))
+        return True
+    except OSError:
+        return False
+
+def get_cached_response(table_cache, body):
+    '''Get the cached response content for a request body. A cache hit marks the response as recently used.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+        body (dict): The request body
+
+    Returns:
+        bytes: The response content. None if there is no cached response or it is older than the max age.
+    '''
+    cached_file = open_cached_response(table_cache, body)
+    if cached_file is None:
+        return None
+
+    with cached_file:
+        return cached_file.read()
+
+def open_cached_response(table_cache, body):
+    '''Open the cached response for a request body, to read the response content from file. A cache hit marks 
+    the response as recently used.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+        body (dict): The request body
+
+    Returns:
+        file: The open gzip file of the response content, which the caller closes. None if there is no cached response 
+            or it is older than the max age, in which case the expired response is deleted.
+    '''
+    cache_filename = get_cache_filename(table_cache, body)
+
+    cached_file = None
+    if os.path.exists(cache_filename):
+        # The modified time is the time the response was cached
+        modified_time = os.path.getmtime(cache_filename)
+        if is_expired(table_cache, modified_time):
+            with table_cache['lock']:
+                # Check the file again, since it may have been replaced by a new response since it was checked
+                if os.path.exists(cache_filename) and is_expired(table_cache, os.path.getmtime(cache_filename)):
+                    if remove_cached_file(table_cache, os.path.basename(cache_filename)):
+                        table_cache['stats']['expired'] += 1
+        else:
+            try:
+                cached_file = gzip.open(cache_filename, 'rb')
+                # Check the file can be read before returning it
+                cached_file.peek(1)
+                # The access time is used to find the least recently used responses
+                os.utime(cache_filename, (time.time(), modified_time))
+            except (OSError, EOFError):
+                if cached_file is not None:
+                    cached_file.close()
+                cached_file = None
+
+    with table_cache['lock']:
+        if cached_file is None:
+            table_cache['stats']['misses'] += 1
+        else:
+            table_cache['stats']['hits'] += 1
+    stat_xplore_metrics.record_cache('table_cache', cached_file is not None, key = os.path.basename(cache_filename))
+
+    return cached_file
+
+def cache_response(table_cache, body, content):
+    '''Save the response content for a request body to the cache, then remove expired responses and evict the least 
+    recently used responses if the cache is larger than its max size. See evict_responses.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+        body (dict): The request body
+        content (bytes): The response content
+    '''
+    cache_filename = get_cache_filename(table_cache, body)
+
+    # Write to a temporary file first so that a partly written response is never read
+    temp_filename = '{}.{}.tmp'.format(cache_filename, threading.get_ident())
+    with gzip.open(temp_filename, 'wb') as f:
+        f.write(content)
+    os.replace(temp_filename, cache_filename)
+
+    if (table_cache['max_bytes'] is not None) or (table_cache['max_age'] is not None):
+        evict_responses(table_cache)
+
+def cache_response_file(table_cache, body, response_file):
+    '''Save the response content for a request body to the cache from a file, such as a streamed response spooled 
+    to file, without reading the whole response into memory. The file is left positioned at the start.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+        body (dict): The request body
+        response_file (file): A binary file of the response content
+    '''
+    cache_filename = get_cache_filename(table_cache, body)
+
+    temp_filename = '{}.{}.tmp'.format(cache_filename, threading.get_ident())
+    response_file.seek(0)
+    with gzip.open(temp_filename, 'wb') as f:
+        shutil.copyfileobj(response_file, f)
+    response_file.seek(0)
+    os.replace(temp_filename, cache_filename)
+
+    if (table_cache['max_bytes'] is not None) or (table_cache['max_age'] is not None):
+        evict_responses(table_cache)
+
+def evict_responses(table_cache):
+    '''Remove the cached responses that are older than the max age, then the least recently used cached responses until 
+    the cache is no larger than its max size.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+    '''
+    with table_cache['lock']:
+        cached_files = []
+        for filename in os.listdir(table_cache['cache_dir']):
+            if filename.endswith('.json.gz'):
+                try:
+                    file_stat = os.stat(os.path.join(table_cache['cache_dir'], filename))
+                except FileNotFoundError:
+                    continue
+                if is_expired(table_cache, file_stat.st_mtime):
+                    if remove_cached_file(table_cache, filename):
+                        table_cache['stats']['expired'] += 1
+                        continue
+                cached_files.append((file_stat.st_atime, file_stat.st_size, filename))
+
+        if table_cache['max_bytes'] is None:
+            return
+
+        total_bytes = sum(size for _, size, _ in cached_files)
+        for _, size, filename in sorted(cached_files):
+            if total_bytes <= table_cache['max_bytes']:
+                break
+            if remove_cached_file(table_cache, filename):
+                total_bytes -= size
+                table_cache['stats']['evictions'] += 1
+
+def clear_table_cache(table_cache):
+    '''Remove all cached responses.
+
+    Args:
+        table_cache (dict): The table response cache, as returned by create_table_cache
+    '''
+    with table_cache['lock']:
+        for filename in os.listdir(table_cache['cache_dir']):
+            if filename.endswith('.json.gz'):
+                os.remove(os.path.join(table_cache['cache_dir'], filename))
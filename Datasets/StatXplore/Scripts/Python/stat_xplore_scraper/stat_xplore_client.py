@@ -0,0 +1,272 @@
+# Shared HTTP client used for all requests to the Stat-Xplore API
+import re
+import time
+import threading
+import collections
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import stat_xplore_metrics
+
+# Default (connect, read) timeouts in seconds. Table requests for large geographies can take minutes to return.
+default_timeout = (10, 300)
+
+# Number of connections kept open to the API. Should be at least the number of requests sent concurrently.
+pool_maxsize = 16
+
+# Retry settings for transient errors. The wait between retries is backoff_factor * 2^(retry number) seconds
+max_retries = 5
+backoff_factor = 1
+retry_status_codes = (429, 500, 502, 503, 504)
+
+session = None
+session_lock = threading.Lock()
+
+# The content, headers and validators of responses to GET requests, keyed by url and request headers, in least recently
+# used order. Used to send conditional requests and to reuse responses that are still fresh.
+get_cache = collections.OrderedDict()
+get_cache_lock = threading.Lock()
+
+# The maximum total size of the content in the GET cache, in bytes. The least recently used responses are removed first.
+get_cache_max_bytes = 64*1024*1024
+get_cache_bytes = 0
+
+# Request headers that aren't part of the GET cache key
+conditional_headers = ['if-none-match', 'if-modified-since']
+
+
+def get_session():
+    '''Get the shared requests Session, creating it on first use. The session keeps connections to the API open
+    between requests and retries requests that fail with transient errors.
+
+    Returns:
+        requests Session: The shared session
+    '''
+    global session
+    with session_lock:
+        if session is None:
+            session = create_session()
+        return session
+
+def create_session(pool_maxsize = None, max_retries = None, backoff_factor = None):
+    '''Create a requests Session with a connection pool and retry with backoff on connection errors and transient error statuses.
+
+    Kwargs:
+        pool_maxsize (int, None): Default None. The number of connections to keep open to each host. If None the module
+            pool_maxsize, 16, is used.
+        max_retries (int, None): Default None. The maximum number of retries of a request. If None the module max_retries, 5, is used.
+        backoff_factor (float, None): Default None. Sets the wait between retries, backoff_factor * 2^(retry number) seconds.
+            If None the module backoff_factor, 1, is used.
+
+    Returns:
+        requests Session: The new session
+    '''
+    pool_maxsize = globals()['pool_maxsize'] if pool_maxsize is None else pool_maxsize
+    max_retries = globals()['max_retries'] if max_retries is None else max_retries
+    backoff_factor = globals()['backoff_factor'] if backoff_factor is None else backoff_factor
+
+    retry = Retry(  total = max_retries,
+                    backoff_factor = backoff_factor,
+                    status_forcelist = retry_status_codes,
+                    allowed_methods = frozenset(['GET', 'POST']),
+                    respect_retry_after_header = True,
+                    raise_on_status = False)
+    adapter = HTTPAdapter(pool_connections = pool_maxsize, pool_maxsize = pool_maxsize, max_retries = retry)
+
+    new_session = requests.Session()
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+def get(url, headers = None, timeout = default_timeout, use_cache = True):
+    '''Send a GET request using the shared session. Responses with an ETag, Last-Modified or Cache-Control max-age header
+    are cached. While a cached response is fresh it is returned without a request. Once it is stale a conditional request
+    is sent and the cached response is returned if the API reports it has not been modified.
+
+    Args:
+        url (str): The url of the request
+
+    Kwargs:
+        headers (dict, None): Default None. The headers of the request
+        timeout (float or tuple): Default (10, 300). The (connect, read) timeouts in seconds
+        use_cache (bool): Default True. Set whether to use and update the cache of GET responses. The cache is not used
+            if the request headers already include conditional headers.
+
+    Returns:
+        requests Response: The response
+    '''
+    headers = {} if headers is None else dict(headers)
+
+    # Requests that set their own conditional headers expect to see the API's response to them
+    if ('If-None-Match' in headers) or ('If-Modified-Since' in headers):
+        use_cache = False
+
+    cache_key = get_cache_key(url, headers)
+
+    with stat_xplore_metrics.time_request('GET', url) as event:
+        cached = None
+        if use_cache:
+            with get_cache_lock:
+                cached = get_cache.get(cache_key)
+                if cached is not None:
+                    get_cache.move_to_end(cache_key)
+            if cached is not None:
+                if time.time() < cached['expires']:
+                    event.update({'status':cached['status_code'], 'cache':'fresh'})
+                    return build_cached_response(url, cached)
+                if cached['etag'] is not None:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified'] is not None:
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        response = get_session().get(url, headers = headers, timeout = timeout)
+        set_response_metrics(event, response)
+
+        if use_cache == False:
+            return response
+
+        if (response.status_code == 304) and (cached is not None):
+            # Not modified, keep the cached response and update how long it is fresh for
+            with get_cache_lock:
+                cached['expires'] = get_expiry_time(response.headers)
+            event['cache'] = 'revalidated'
+            return build_cached_response(url, cached)
+
+        if response.status_code == 200:
+            cache_response(cache_key, response)
+
+        return response
+
+def post(url, headers = None, data = None, timeout = default_timeout, stream = False):
+    '''Send a POST request using the shared session.
+
+    Args:
+        url (str): The url of the request
+
+    Kwargs:
+        headers (dict, None): Default None. The headers of the request
+        data (str, None): Default None. The body of the request
+        timeout (float or tuple): Default (10, 300). The (connect, read) timeouts in seconds
+        stream (bool): Default False. Set whether to read the response content only when it is accessed, rather than straight away
+
+    Returns:
+        requests Response: The response
+    '''
+    with stat_xplore_metrics.time_request('POST', url) as event:
+        response = get_session().post(url, headers = headers, data = data, timeout = timeout, stream = stream)
+        set_response_metrics(event, response, stream = stream)
+        return response
+
+def set_response_metrics(event, response, stream = False):
+    '''Set the status, size and number of retries of a response in its request event. See stat_xplore_metrics.time_request.
+
+    Args:
+        event (dict): The request event
+        response (requests Response): The response
+
+    Kwargs:
+        stream (bool): Default False. Set whether the response is streamed, in which case its size is taken from the
+            Content-Length header rather than read from the content.
+    '''
+    event['status'] = response.status_code
+    if response.status_code >= 400:
+        event['error'] = '{} {}'.format(response.status_code, response.reason)
+    if stream:
+        content_length = response.headers.get('Content-Length', '')
+        event['bytes'] = int(content_length) if content_length.isdigit() else None
+    else:
+        event['bytes'] = len(response.content)
+
+    # The retry history of the underlying urllib3 response, if any retries were needed
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    event['retries'] = len(retries.history) if retries is not None else 0
+
+def get_cache_key(url, headers):
+    '''Get the GET cache key of a request, from its url and headers, so that responses to requests with different headers,
+    eg a different APIKey, aren't shared. Conditional headers are left out, since they are set from the cache.
+
+    Args:
+        url (str): The url of the request
+        headers (dict): The headers of the request
+
+    Returns:
+        tuple: The cache key
+    '''
+    return (url, tuple(sorted((str(key).lower(), str(value)) for key, value in headers.items() if str(key).lower() not in conditional_headers)))
+
+def cache_response(cache_key, response):
+    '''Add the content, headers and validators of a GET response to the cache if it can be revalidated or has a max-age.
+    Least recently used responses are removed to keep the cache within get_cache_max_bytes.
+
+    Args:
+        cache_key (tuple): The cache key of the request, see get_cache_key
+        response (requests Response): The response to cache
+    '''
+    global get_cache_bytes
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    expires = get_expiry_time(response.headers)
+    if (etag is None) and (last_modified is None) and (expires <= time.time()):
+        return
+
+    content = response.content
+    if len(content) > get_cache_max_bytes:
+        return
+
+    with get_cache_lock:
+        if cache_key in get_cache:
+            get_cache_bytes -= len(get_cache.pop(cache_key)['content'])
+        get_cache[cache_key] = {'content':content, 'status_code':response.status_code, 'headers':dict(response.headers), 'encoding':response.encoding,
+                                'etag':etag, 'last_modified':last_modified, 'expires':expires}
+        get_cache_bytes += len(content)
+
+        while get_cache_bytes > get_cache_max_bytes:
+            get_cache_bytes -= len(get_cache.popitem(last = False)[1]['content'])
+
+def build_cached_response(url, cached):
+    '''Build a requests Response from the content and headers of a cached response. A new Response is built each time,
+    so that callers can't change the cached one.
+
+    Args:
+        url (str): The url of the request
+        cached (dict): The cached response
+
+    Returns:
+        requests Response: The response
+    '''
+    response = requests.Response()
+    response.status_code = cached['status_code']
+    response.reason = 'OK'
+    response.headers = CaseInsensitiveDict(cached['headers'])
+    response.encoding = cached['encoding']
+    response.url = url
+    response._content = cached['content']
+    return response
+
+def get_expiry_time(response_headers):
+    '''Get the time until which a response is fresh from its Cache-Control header. Responses without a max-age,
+    or with no-cache, expire immediately and must be revalidated before they are reused.
+
+    Args:
+        response_headers (dict): The headers of the response
+
+    Returns:
+        float: The expiry time, in seconds since the epoch
+    '''
+    cache_control = response_headers.get('Cache-Control', '').lower()
+    max_age = re.search(r'max-age=(\d+)', cache_control)
+    if ('no-cache' in cache_control) or (max_age is None):
+        return 0
+    return time.time() + int(max_age.group(1))
+
+def clear_cache():
+    '''Remove all cached GET responses.'''
+    global get_cache_bytes
+    with get_cache_lock:
+        get_cache.clear()
+        get_cache_bytes = 0
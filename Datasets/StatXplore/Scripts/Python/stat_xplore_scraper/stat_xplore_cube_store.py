@@ -0,0 +1,218 @@
+# Store the data cubes returned by the Stat-Xplore table end point on disk, and reopen them memory mapped
+#
+# Each cube is saved to its own directory: the values of each measure as a raw .npy array, with a dimension per field,
+# and a cube.json file of the field and measure uris and labels, the items of each field and the database annotations.
+# The arrays are reopened with numpy memory mapping, so nothing is parsed on reload and selecting one geography or
+# period of a cube only reads the parts of the file that hold it. Save the cube of a table response with
+# stat_xplore_table.write_response_cube, and unpack a cube with stat_xplore_table.stored_cube_to_dataframe:
+#
+#   stat_xplore_table.write_response_cube(dict_response, 'cubes/carers_allowance')
+#   cube = stat_xplore_cube_store.read_cube('cubes/carers_allowance')
+#   df = stat_xplore_table.stored_cube_to_dataframe(stat_xplore_cube_store.select_cube(cube, {geog_field_id:'Leeds'}))
+#
+# The arrays of each write are saved to a new data directory within the cube directory, and cube.json, which names the
+# arrays, is replaced last. A reader therefore always sees the metadata and arrays of the same write.
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import stat_xplore_schema
+
+# The filename of the metadata of a cube, within the cube directory
+cube_metadata_filename = 'cube.json'
+
+# The prefix of the data directories of the arrays of each write, within the cube directory
+data_directory_prefix = 'data_'
+
+
+def get_measure_filename(measure_index):
+    '''Get the filename of the values array of a measure, within its data directory. Measure uris contain characters that
+    aren't allowed in filenames, so measures are numbered in the order of the cube metadata.'''
+    return 'measure_{}.npy'.format(measure_index)
+
+def write_cube(cube_directory, field_items, field_headers, measures, cubes_arrays, annotations = None, dtype = 'float64'):
+    '''Write a data cube to a cube directory. The values array of each measure is saved as a .npy file in a new data
+    directory, then the fields, measures and annotations are saved to the cube metadata, replacing the metadata of any
+    cube already in the directory. The arrays of the replaced cube are kept until the next write, so that a reader
+    that has just read the old metadata can still open them. Older data directories are removed.
+
+    Args:
+        cube_directory (str): The directory to write the cube to. Created if it doesn't exist.
+        field_items (dict): The 'uris' and 'labels' of the items of each field, see stat_xplore_table.unpack_response_fields
+        field_headers (dict): The 'uris' and 'labels' of the fields, see stat_xplore_table.unpack_response_fields
+        measures (list of dict): The 'uri' and 'label' of each measure
+        cubes_arrays (list of multi-dim array): The values of each measure, with a dimension per field
+
+    Kwargs:
+        annotations (dict, None): Default None. The database annotations
+        dtype (str): Default 'float64'. The type of the values arrays. Suppressed (missing) values are saved as NaN.
+
+    Returns:
+        dict: The cube metadata, see read_cube_metadata
+    '''
+    os.makedirs(cube_directory, exist_ok = True)
+    previous_metadata = read_cube_metadata(cube_directory)
+
+    data_directory = tempfile.mkdtemp(prefix = data_directory_prefix, dir = cube_directory)
+    try:
+        measures_metadata = []
+        shape = None
+        for measure_index, (measure, cubes_array) in enumerate(zip(measures, cubes_arrays)):
+            cubes_array = np.ascontiguousarray(np.asarray(cubes_array, dtype = dtype))
+            assert cubes_array.ndim == len(field_headers['uris'])
+            shape = cubes_array.shape if shape is None else shape
+            assert cubes_array.shape == shape
+
+            measure_filename = os.path.basename(data_directory) + '/' + get_measure_filename(measure_index)
+            np.save(os.path.join(cube_directory, measure_filename), cubes_array)
+
+            measures_metadata.append({'uri':measure['uri'], 'label':measure.get('label'), 'filename':measure_filename})
+
+        metadata = {'shape':list(shape) if shape is not None else [],
+                    'dtype':np.dtype(dtype).str,
+                    'fields':[{'uri':field_headers['uris'][i], 'label':field_headers['labels'][i],
+                               'item_uris':field_items['uris'][i], 'item_labels':field_items['labels'][i]} for i in range(len(field_headers['uris']))],
+                    'measures':measures_metadata,
+                    'annotations':annotations if annotations is not None else {}}
+        stat_xplore_schema.write_json(os.path.join(cube_directory, cube_metadata_filename), metadata)
+    except BaseException:
+        shutil.rmtree(data_directory, ignore_errors = True)
+        raise
+
+    # Remove the arrays of writes before the one just replaced
+    keep_filenames = set([cube_metadata_filename, os.path.basename(data_directory)])
+    if previous_metadata is not None:
+        keep_filenames.update(os.path.normpath(measure['filename']).split(os.sep)[0] for measure in previous_metadata['measures'])
+    for filename in os.listdir(cube_directory):
+        if filename in keep_filenames:
+            continue
+        if filename.startswith(data_directory_prefix) and os.path.isdir(os.path.join(cube_directory, filename)):
+            shutil.rmtree(os.path.join(cube_directory, filename), ignore_errors = True)
+        elif filename.startswith('measure_') and filename.endswith('.npy'):
+            os.remove(os.path.join(cube_directory, filename))
+
+    return metadata
+
+def read_cube_metadata(cube_directory):
+    '''Read the metadata of a cube written with write_cube.
+
+    Args:
+        cube_directory (str): The cube directory
+
+    Returns:
+        dict: Dictionary with the following items: 'shape'; 'dtype'; 'fields' - a dict per field of its 'uri', 'label', 'item_uris'
+            and 'item_labels'; 'measures' - a dict per measure of its 'uri', 'label' and the 'filename' of its values, within the
+            cube directory; 'annotations'.
+            None if there is no cube in the directory.
+    '''
+    metadata_path = os.path.join(cube_directory, cube_metadata_filename)
+    if os.path.isfile(metadata_path) == False:
+        return None
+    with open(metadata_path, 'r') as f:
+        return json.load(f)
+
+def read_cube(cube_directory, mmap_mode = 'r'):
+    '''Open a cube written with write_cube. The values arrays are memory mapped rather than read, so opening a cube
+    is quick whatever its size, and only the values that are used are read from disk.
+
+    Args:
+        cube_directory (str): The cube directory
+
+    Kwargs:
+        mmap_mode (str, None): Default 'r'. The numpy memory map mode of the values arrays. 'r' opens them read only, 'c'
+            opens them copy on write. If None the arrays are read into memory.
+
+    Returns:
+        dict: Dictionary with the following items: 'shape' - the shape of the cube; 'field_uris' and 'field_labels' - the fields
+            along each dimension; 'items' - dict of the 'uris' and 'labels' of the items of each field; 'values' - dict of the
+            numpy memmap of the values of each measure uri; 'measure_labels'; 'annotations'. Raises a FileNotFoundError if
+            there is no cube in the directory.
+    '''
+    metadata = read_cube_metadata(cube_directory)
+    if metadata is None:
+        raise FileNotFoundError('No cube in {}'.format(cube_directory))
+
+    values = {}
+    for measure in metadata['measures']:
+        values[measure['uri']] = np.load(os.path.join(cube_directory, measure['filename']), mmap_mode = mmap_mode)
+
+    return {'shape':tuple(metadata['shape']),
+            'field_uris':[field['uri'] for field in metadata['fields']],
+            'field_labels':[field['label'] for field in metadata['fields']],
+            'items':{'uris':[field['item_uris'] for field in metadata['fields']], 'labels':[field['item_labels'] for field in metadata['fields']]},
+            'values':values,
+            'measure_labels':{measure['uri']:measure['label'] for measure in metadata['measures']},
+            'annotations':metadata['annotations']}
+
+def get_item_positions(cube, field_id, items):
+    '''Get the positions along a field of some of its items.
+
+    Args:
+        cube (dict): The cube, as returned by read_cube
+        field_id (str): The field uri
+        items (str or list of str): The uris or labels of the items
+
+    Returns:
+        list of int: The position of each item. Raises a KeyError if the field or an item is not in the cube.
+    '''
+    if field_id not in cube['field_uris']:
+        raise KeyError('Field {} is not in the cube'.format(field_id))
+    axis = cube['field_uris'].index(field_id)
+
+    items = [items] if isinstance(items, str) else list(items)
+    item_uris = cube['items']['uris'][axis]
+    item_labels = cube['items']['labels'][axis]
+
+    positions = []
+    for item in items:
+        if item in item_uris:
+            positions.append(item_uris.index(item))
+        elif item in item_labels:
+            positions.append(item_labels.index(item))
+        else:
+            raise KeyError('{!r} is not an item of field {}'.format(item, field_id))
+    return positions
+
+def select_cube(cube, selections):
+    '''Select items of some fields of a cube, eg one geography or one period, and read their values into memory.
+    A selection of neighbouring items is taken as a slice of the memory mapped arrays, so only the bytes that hold the
+    selected values are read from disk.
+
+    Args:
+        cube (dict): The cube, as returned by read_cube
+        selections (dict): Field uris as keys and the uri or label, or a list of uris or labels, of the items to select as values
+
+    Returns:
+        dict: The selected cube, in the same form as read_cube but with the values arrays in memory. Raises a ValueError if
+            no items of a field are selected.
+    '''
+    slices = [slice(None)]*len(cube['field_uris'])
+    takes = {}
+    items = {'uris':list(cube['items']['uris']), 'labels':list(cube['items']['labels'])}
+
+    for field_id, field_items in selections.items():
+        positions = get_item_positions(cube, field_id, field_items)
+        if len(positions) == 0:
+            raise ValueError('No items of field {} are selected.'.format(field_id))
+        axis = cube['field_uris'].index(field_id)
+
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            slices[axis] = slice(positions[0], positions[0] + len(positions))
+        else:
+            takes[axis] = positions
+
+        items['uris'][axis] = [items['uris'][axis][position] for position in positions]
+        items['labels'][axis] = [items['labels'][axis][position] for position in positions]
+
+    # Slice first, which only creates a view of the memory mapped array, then take the other selections from the view
+    values = {}
+    for measure_uri, cubes_array in cube['values'].items():
+        selected_array = cubes_array[tuple(slices)]
+        for axis, positions in takes.items():
+            selected_array = np.take(selected_array, positions, axis = axis)
+        values[measure_uri] = np.array(selected_array)
+
+    shape = tuple(len(field_items) for field_items in items['uris'])
+
+    return dict(cube, shape = shape, items = items, values = values)
@@ -0,0 +1,150 @@
+# Incremental fetch of time series data from the Stat-Xplore API
+#
+# Rather than requesting the whole time series on every run, the dates (or other periods) already in the stored output
+# are compared with the values of the date field listed in the schema, and data is only requested for the missing
+# periods, using recodes on the date field. The new data is then appended to the stored output.
+import os
+import pandas as pd
+import stat_xplore_schema
+import stat_xplore_table
+import stat_xplore_output
+
+
+def get_field_value_ids(schema_headers, field_id, df_schema = None, check_cache = False, schema_filename = 'schema.csv'):
+    '''Get the IDs of the values of a field, such as all dates of a date field, from the field's valueset. The values
+    are always requested from the API, since new periods are added to the valueset as data is published.
+
+    Args:
+        schema_headers (dict): The headers of the request.
+        field_id (str): The field ID
+
+    Kwargs:
+        df_schema (pandas DataFrame, SchemaTree, None): Default to None. The Stat-Xplore schema
+        check_cache (bool): Default False. Set whether to use the cached schema to find the valueset of the field
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
+
+    Returns:
+        list of str: The value IDs, in the order of the valueset. Raises a ValueError if they could not all be requested.
+    '''
+    schema_tree = stat_xplore_schema.get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename, lazy = True)
+
+    valuesets = schema_tree.children(field_id, type = 'VALUESET')
+    if len(valuesets) == 0:
+        raise ValueError('No valueset found for field {} in the schema.'.format(field_id))
+
+    value_ids = stat_xplore_schema.get_valueset_recodes(schema_headers, valuesets[0].location, check_cache = False)
+    if value_ids is None:
+        raise ValueError('Unable to get the values of field {}.'.format(field_id))
+    return value_ids
+
+def read_stored_field_value_ids(data_filename, field_id, output_format = None):
+    '''Read the distinct values of a field column from stored data, such as the dates already downloaded.
+    Only the field column is read.
+
+    Args:
+        data_filename (str): The stored data, a csv or a file or directory written by stat_xplore_output.write_table
+        field_id (str): The field ID. This is the header of the column of field value IDs.
+
+    Kwargs:
+        output_format (str, None): Default None. The format of Parquet or Arrow data, 'parquet' or 'ipc'. If None it is taken
+            from the file extension, and data with other extensions is read as csv.
+
+    Returns:
+        set of str: The field value IDs. Empty if there is no stored data.
+    '''
+    if os.path.exists(data_filename) == False:
+        return set()
+
+    if is_columnar_output(data_filename, output_format):
+        df_stored = stat_xplore_output.read_table(data_filename, output_format = output_format, columns = [field_id])['data']
+    else:
+        df_stored = pd.read_csv(data_filename, usecols = [field_id])
+
+    return set(df_stored[field_id].dropna().astype(str).unique())
+
+def is_columnar_output(data_filename, output_format = None):
+    '''Check whether an output is Parquet or Arrow data, rather than csv.'''
+    return (output_format is not None) or (os.path.splitext(data_filename)[1].lower() in stat_xplore_output.output_formats)
+
+def get_incremental_measure_data(table_headers, schema_headers, measure_id, date_field_id, data_filename, output_format = None, df_schema = None, check_cache = False, schema_filename = 'schema.csv', **measure_data_kwargs):
+    '''Get the data of the periods of a time series missing from the stored data. The periods in the stored data are
+    compared with the values of the date field and only the missing periods are requested, by recoding the date field.
+
+    Args:
+        table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
+        schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
+        measure_id (str or list of str): The id of the measure, or a list of ids of measures from the same database, to request data for
+        date_field_id (str): The field ID of the date field. This must be one of the field_ids.
+        data_filename (str): The stored data
+
+    Kwargs:
+        output_format (str, None): Default None. The format of Parquet or Arrow stored data. See read_stored_field_value_ids.
+        df_schema (pandas DataFrame, SchemaTree, None): Default to None. The Stat-Xplore schema. If None and there is no complete
+            cached schema, only the schema items needed are requested, see stat_xplore_schema.get_lazy_schema_tree.
+        check_cache (bool): Default False. Set whether to use the cached schema and geography recodes
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
+        Other kwargs are passed on to stat_xplore_table.get_stat_xplore_measure_data
+
+    Returns:
+        dict: Dictionary with the following items: 'data' - a pandas DataFrame of the data of the new periods, None if there
+            are no new periods or the request was unsuccessful; 'annotations'; 'new_periods' - the value IDs of the new periods
+    '''
+    if date_field_id not in (measure_data_kwargs.get('field_ids') or []):
+        raise ValueError('The date field {} must be one of the field_ids.'.format(date_field_id))
+
+    # Index the schema once for the lookups of the date field valueset and the request body
+    df_schema = stat_xplore_schema.get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename, lazy = True)
+
+    period_ids = get_field_value_ids(schema_headers, date_field_id, df_schema = df_schema)
+    stored_period_ids = read_stored_field_value_ids(data_filename, date_field_id, output_format = output_format)
+    new_period_ids = [period_id for period_id in period_ids if period_id not in stored_period_ids]
+
+    if len(new_period_ids) == 0:
+        print('No new periods of {} to request.'.format(date_field_id))
+        return {'data':None, 'annotations':None, 'new_periods':[]}
+
+    print('Requesting {} new periods of {}.'.format(len(new_period_ids), date_field_id))
+    field_recodes = dict(measure_data_kwargs.pop('field_recodes', None) or {})
+    field_recodes[date_field_id] = new_period_ids
+
+    result = stat_xplore_table.get_stat_xplore_measure_data(table_headers, schema_headers, measure_id, df_schema = df_schema, check_cache = check_cache,
+                                                            schema_filename = schema_filename, field_recodes = field_recodes, **measure_data_kwargs)
+    result['new_periods'] = new_period_ids
+
+    return result
+
+def append_measure_data(df_new_data, data_filename, annotations = None, output_format = None, partition_cols = None):
+    '''Append the data of new periods to the stored data. Rows are appended to a csv if it has the same columns as the new
+    data, and partitioned Parquet or Arrow data is appended by writing new files to its partitions. Otherwise the stored data is
+    read, combined with the new data and written again.
+
+    Args:
+        df_new_data (pandas DataFrame): The data of the new periods
+        data_filename (str): The stored data. Created if it doesn't exist.
+
+    Kwargs:
+        annotations (dict, None): Default None. The database annotations returned with the data, saved in Parquet or Arrow files
+        output_format (str, None): Default None. The format of Parquet or Arrow stored data. See read_stored_field_value_ids.
+        partition_cols (list of str, None): Default None. The partition columns of partitioned Parquet or Arrow data. The new
+            data is written as new files in its partitions, so the data already stored in the same partitions, eg of the same
+            geography, is kept.
+    '''
+    if is_columnar_output(data_filename, output_format):
+        if (partition_cols is None) and os.path.exists(data_filename):
+            df_stored = stat_xplore_output.read_table(data_filename, output_format = output_format)['data']
+            df_new_data = pd.concat([df_stored, df_new_data], ignore_index = True)
+        stat_xplore_output.write_table(df_new_data, data_filename, annotations = annotations, output_format = output_format, partition_cols = partition_cols,
+                                       append = partition_cols is not None)
+        return
+
+    if os.path.exists(data_filename) == False:
+        df_new_data.to_csv(data_filename, index=False)
+        return
+
+    stored_columns = list(pd.read_csv(data_filename, nrows = 0).columns)
+    if stored_columns == [str(column) for column in df_new_data.columns]:
+        df_new_data.to_csv(data_filename, mode = 'a', header = False, index=False)
+    else:
+        print('The columns of {} do not match the new data. Combining and writing the whole file.'.format(data_filename))
+        df_stored = pd.read_csv(data_filename)
+        pd.concat([df_stored, df_new_data], ignore_index = True).to_csv(data_filename, index=False)
@@ -0,0 +1,314 @@
+# Run a batch of Stat-Xplore table requests described by a manifest file
+#
+# Usage:
+#   python stat_xplore_jobs.py manifest.json [--max-workers N] [--jobs name1 name2 ...] [--refresh-recodes] [--trace trace.json]
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import stat_xplore_schema
+import stat_xplore_table
+import stat_xplore_cache
+import stat_xplore_output
+import stat_xplore_incremental
+import stat_xplore_metrics
+
+# Job keys that are passed on to stat_xplore_table.get_stat_xplore_measure_data
+measure_data_keys = ['measure_id', 'field_ids', 'fields_include_total', 'geog_folder_label', 'geog_field_label', 'geog_level_label',
+                     'categorical', 'max_cells', 'split_field_id', 'stream', 'field_recodes', 'drop_zeros']
+
+
+def load_manifest(manifest_filename):
+    '''Load a job manifest. The manifest is a json file with the settings shared by all jobs and a list of jobs, eg
+
+    {
+        "api_key_env": "STAT_XPLORE_API_KEY",
+        "schema_filename": "stat_xplore_scraper/schema.csv",
+        "output_directory": "../../Data",
+        "max_workers": 4,
+        "jobs": [
+            {
+                "name": "carers_allowance",
+                "measure_id": "str:count:CA_In_Payment:V_F_CA_In_Payment",
+                "field_ids": ["str:field:CA_In_Payment:F_CA_QTR:DATE_NAME", "str:field:CA_In_Payment:V_F_CA_In_Payment:CCSEX"],
+                "fields_include_total": "str:field:CA_In_Payment:V_F_CA_In_Payment:CCSEX",
+                "geog_folder_label": "Geography (residence-based)",
+                "geog_field_label": "National - Regional - LA - OAs",
+                "geog_level_label": "Local Authority",
+                "data_filename": "carers_allowance_data.csv",
+                "annotations_filename": "carers_allowance_annotations.txt"
+            }
+        ]
+    }
+
+    Relative paths in the manifest are relative to the directory of the manifest file. The API key is read from the
+    environment variable named by 'api_key_env', or from 'api_key' if it is set in the manifest. Optional settings are
+    'check_cache' (default true), 'lazy_schema' (default true, only request the schema items the jobs need unless the full
+    schema is cached), 'table_cache_dir', 'table_cache_max_age', 'table_cache_max_bytes' and 'cube_store_dir' (a directory to
+    also save the data cube of each job to, in a directory named after the job, see stat_xplore_cube_store).
+
+    Args:
+        manifest_filename (str): The filename of the manifest
+
+    Returns:
+        dict: The manifest, with paths made relative to the current directory
+    '''
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_filename))
+    for key in ['schema_filename', 'output_directory', 'table_cache_dir', 'cube_store_dir']:
+        if manifest.get(key) is not None:
+            manifest[key] = os.path.join(manifest_directory, manifest[key])
+
+    manifest.setdefault('schema_filename', os.path.join(manifest_directory, 'schema.csv'))
+    manifest.setdefault('output_directory', manifest_directory)
+    manifest.setdefault('check_cache', True)
+    manifest.setdefault('lazy_schema', True)
+    manifest.setdefault('max_workers', 4)
+
+    return manifest
+
+def get_api_headers(manifest):
+    '''Get the headers for requests to the schema and table end points from the API key set in the manifest.
+
+    Args:
+        manifest (dict): The job manifest
+
+    Returns:
+        tuple of dict: The table headers and the schema headers
+    '''
+    api_key = manifest.get('api_key')
+    if api_key is None:
+        api_key_env = manifest.get('api_key_env', 'STAT_XPLORE_API_KEY')
+        api_key = os.environ.get(api_key_env)
+        if api_key is None:
+            raise KeyError('No API key. Set the {} environment variable or the api_key manifest setting.'.format(api_key_env))
+
+    table_headers = {'APIKey':api_key,
+                     'Content-Type':'application/json'}
+    schema_headers = {'APIKey':api_key}
+    return table_headers, schema_headers
+
+def resolve_geography_recodes(schema_headers, jobs, df_schema, schema_filename, refresh_recodes = False, check_cache = True):
+    '''Get the geography recodes of each distinct database and geography used by the jobs, once each, so that they are
+    in the recode cache before the jobs run.
+
+    Args:
+        schema_headers (dict): The headers of the request.
+        jobs (list of dict): The jobs of the manifest
+        df_schema (SchemaTree): The stat-xplore schema
+        schema_filename (str): The filename of the cached schema. Geography recodes are cached alongside it
+
+    Kwargs:
+        refresh_recodes (bool): Default False. Set whether to request the recodes from the API even if they are cached
+        check_cache (bool): Default True. Set whether to use the recode cache. If False nothing is done, since each job
+            requests its own recodes.
+    '''
+    if check_cache == False:
+        return
+
+    recode_cache_filename = stat_xplore_schema.get_recode_cache_filename(schema_filename)
+
+    resolved = set()
+    for job in jobs:
+        geography = (stat_xplore_table.get_database_id(job['measure_id']),
+                     job.get('geog_folder_label', 'Geography (residence-based)'),
+                     job.get('geog_field_label', 'National - Regional - LA - OAs'),
+                     job.get('geog_level_label', 'Local Authority'))
+        if geography in resolved:
+            continue
+        resolved.add(geography)
+
+        if refresh_recodes:
+            geog_field_valueset_loc = stat_xplore_schema.get_geography_valueset_location(df_schema, *geography)[1]
+            stat_xplore_schema.invalidate_recode_cache(recode_cache_filename, geog_field_valueset_loc)
+
+        stat_xplore_schema.geography_recodes_for_geog_folder_geog_level(schema_headers, *geography, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename)
+
+def run_job(job, manifest, table_headers, schema_headers, df_schema, table_cache = None):
+    '''Get the data of a single job and write the data and annotations to the job's output files.
+
+    If the job sets 'incremental_field_id', the field ID of its date field, only the periods missing from the job's stored
+    output are requested and appended to it. See stat_xplore_incremental.
+
+    Args:
+        job (dict): The job
+        manifest (dict): The job manifest
+        table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
+        schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
+        df_schema (SchemaTree): The stat-xplore schema
+
+    Kwargs:
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache
+
+    Returns:
+        bool: True if the data was retrieved and written, or there was no new data
+    '''
+    measure_data_kwargs = {key:job[key] for key in measure_data_keys if key in job}
+
+    if job.get('incremental_field_id') is not None:
+        return run_incremental_job(job, manifest, table_headers, schema_headers, df_schema, measure_data_kwargs, table_cache = table_cache)
+
+    # Only whole cubes are stored, not the new periods of incremental jobs
+    if manifest.get('cube_store_dir') is not None:
+        measure_data_kwargs['cube_directory'] = os.path.join(manifest['cube_store_dir'], job['name'])
+
+    result = stat_xplore_table.get_stat_xplore_measure_data(table_headers, schema_headers, df_schema = df_schema, check_cache = manifest['check_cache'],
+                                                            schema_filename = manifest['schema_filename'], table_cache = table_cache, **measure_data_kwargs)
+    if result['data'] is None:
+        return False
+
+    write_job_output(job, manifest, result)
+    return True
+
+def run_incremental_job(job, manifest, table_headers, schema_headers, df_schema, measure_data_kwargs, table_cache = None):
+    '''Get the data of the periods missing from a job's stored output and append it. See run_job.'''
+    output_format, data_filename, annotations_filename = get_job_output_filenames(job, manifest)
+
+    result = stat_xplore_incremental.get_incremental_measure_data(table_headers, schema_headers, date_field_id = job['incremental_field_id'], data_filename = data_filename,
+                                                                  output_format = output_format, df_schema = df_schema, check_cache = manifest['check_cache'], schema_filename = manifest['schema_filename'],
+                                                                  table_cache = table_cache, **measure_data_kwargs)
+    if len(result['new_periods']) == 0:
+        return True
+    if result['data'] is None:
+        return False
+
+    stat_xplore_incremental.append_measure_data(result['data'], data_filename, annotations = result['annotations'], output_format = output_format, partition_cols = job.get('partition_cols'))
+    if output_format is None:
+        write_annotations(result['annotations'], annotations_filename)
+    return True
+
+def get_job_output_filenames(job, manifest):
+    '''Get the output format and output filenames of a job. The filenames are set by the job's 'data_filename' and
+    'annotations_filename', or named after the job if not set.
+
+    Args:
+        job (dict): The job
+        manifest (dict): The job manifest
+
+    Returns:
+        tuple: The output format, 'parquet' or 'ipc', or None for csv; the data filename; the annotations filename, None unless
+            the output format is csv
+    '''
+    output_format = job.get('output_format')
+    if (output_format is None) and ('data_filename' in job):
+        output_format = stat_xplore_output.output_formats.get(os.path.splitext(job['data_filename'])[1].lower())
+
+    if output_format is not None:
+        data_filename = os.path.join(manifest['output_directory'], job.get('data_filename', job['name'] + ('.parquet' if output_format == 'parquet' else '.arrow')))
+        return output_format, data_filename, None
+
+    data_filename = os.path.join(manifest['output_directory'], job.get('data_filename', job['name'] + '_data.csv'))
+    annotations_filename = os.path.join(manifest['output_directory'], job.get('annotations_filename', job['name'] + '_annotations.txt'))
+    return output_format, data_filename, annotations_filename
+
+def write_job_output(job, manifest, result):
+    '''Write the data and annotations returned for a job. The data is saved as a csv and the annotations as a text file.
+    Outputs whose content is unchanged, found by comparing hashes, are not written again.
+
+    If the job's 'output_format' is 'parquet' or 'ipc', or the data filename has a Parquet or Arrow extension, the data is
+    instead saved with stat_xplore_output.write_table, with the annotations in the file metadata. The job's 'partition_cols'
+    set the columns to partition the data by.
+
+    Args:
+        job (dict): The job
+        manifest (dict): The job manifest
+        result (dict): The data and annotations returned by stat_xplore_table.get_stat_xplore_measure_data
+    '''
+    os.makedirs(manifest['output_directory'], exist_ok = True)
+
+    output_format, data_filename, annotations_filename = get_job_output_filenames(job, manifest)
+
+    if output_format is not None:
+        written = stat_xplore_output.write_table(result['data'], data_filename, annotations = result['annotations'], output_format = output_format,
+                                                 partition_cols = job.get('partition_cols'), skip_unchanged = True)
+    else:
+        written = stat_xplore_output.write_csv(result['data'], data_filename, skip_unchanged = True)
+        write_annotations(result['annotations'], annotations_filename)
+
+    if written == False:
+        print('Output of job {} is unchanged.'.format(job['name']))
+
+def write_annotations(annotations, annotations_filename):
+    '''Write the database annotations returned with the data to a text file.'''
+    with open(annotations_filename, 'w') as f:
+        for annotation in annotations.values():
+            f.write(annotation+'\n\n')
+
+def run_jobs(manifest, job_names = None, max_workers = None, refresh_recodes = False):
+    '''Run the jobs of a manifest. The schema and the geography recodes are resolved once and shared by all jobs,
+    then the jobs are run concurrently.
+
+    Args:
+        manifest (dict): The job manifest, as returned by load_manifest
+
+    Kwargs:
+        job_names (list of str, None): Default None. The names of the jobs to run. If None all jobs are run.
+        max_workers (int, None): Default None. The number of jobs to run concurrently. If None the manifest 'max_workers' is used.
+        refresh_recodes (bool): Default False. Set whether to request the geography recodes from the API even if they are cached
+
+    Returns:
+        dict: The job names as keys and True or False as values, for whether each job succeeded
+    '''
+    table_headers, schema_headers = get_api_headers(manifest)
+    max_workers = manifest['max_workers'] if max_workers is None else max_workers
+
+    jobs = manifest['jobs']
+    if job_names is not None:
+        jobs = [job for job in jobs if job['name'] in job_names]
+
+    table_cache = None
+    if manifest.get('table_cache_dir') is not None:
+        table_cache = stat_xplore_cache.create_table_cache(manifest['table_cache_dir'], max_age = manifest.get('table_cache_max_age'), max_bytes = manifest.get('table_cache_max_bytes'))
+
+    # Resolve the schema and recodes shared by the jobs once
+    df_schema = stat_xplore_schema.get_schema_tree(schema_headers, check_cache = manifest['check_cache'], schema_filename = manifest['schema_filename'], lazy = manifest['lazy_schema'])
+    resolve_geography_recodes(schema_headers, jobs, df_schema, manifest['schema_filename'], refresh_recodes = refresh_recodes, check_cache = manifest['check_cache'])
+
+    def run(job):
+        try:
+            return run_job(job, manifest, table_headers, schema_headers, df_schema, table_cache = table_cache)
+        except Exception as err:
+            print('Job {} failed: {}'.format(job['name'], err))
+            return False
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        job_results = dict(zip([job['name'] for job in jobs], executor.map(run, jobs)))
+
+    for name, success in job_results.items():
+        print('{}: {}'.format(name, 'done' if success else 'FAILED'))
+    if table_cache is not None:
+        print('Table cache: {}'.format(table_cache['stats']))
+
+    return job_results
+
+def main(args = None):
+    '''Command line entry point. Run the jobs of a manifest file.'''
+    parser = argparse.ArgumentParser(description = 'Get Stat-Xplore data for the jobs in a manifest file.')
+    parser.add_argument('manifest', help = 'The job manifest json file')
+    parser.add_argument('--max-workers', type = int, default = None, help = 'The number of jobs to run concurrently')
+    parser.add_argument('--jobs', nargs = '+', default = None, help = 'The names of the jobs to run. Runs all jobs if not set')
+    parser.add_argument('--refresh-recodes', action = 'store_true', help = 'Request geography recodes from the API even if they are cached')
+    parser.add_argument('--trace', default = None, help = 'Write a JSON trace of the requests and stages of the run to this file')
+    parser.add_argument('--progress', action = 'store_true', help = 'Print the progress of schema crawls and failed requests')
+    parsed_args = parser.parse_args(args)
+
+    manifest = load_manifest(parsed_args.manifest)
+    if parsed_args.progress:
+        stat_xplore_metrics.add_callback(stat_xplore_metrics.print_progress)
+
+    trace = stat_xplore_metrics.start_trace() if parsed_args.trace is not None else None
+    try:
+        job_results = run_jobs(manifest, job_names = parsed_args.jobs, max_workers = parsed_args.max_workers, refresh_recodes = parsed_args.refresh_recodes)
+    finally:
+        if trace is not None:
+            stat_xplore_metrics.stop_trace(trace)
+            stat_xplore_metrics.write_trace(trace, parsed_args.trace)
+
+    return 0 if all(job_results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# Instrumentation of requests to the Stat-Xplore API and the stages of getting table data
+#
+# Every HTTP request, and each stage of getting data (building the request body, requesting, decoding the response,
+# unpacking it into a DataFrame and mapping field items to labels), records an event. Events are passed to the
+# callbacks added with add_callback, eg to send them to a metrics system, or collected into a trace that can be
+# summarised and written to a JSON file:
+#
+#   with stat_xplore_metrics.record_trace('trace.json') as trace:
+#       result = stat_xplore_table.get_stat_xplore_measure_data(table_headers, schema_headers, measure_id)
+#   print(stat_xplore_metrics.summarise_trace(trace))
+#
+# Each event is a dict with the items 'kind' - 'request', 'stage', 'cache' or 'progress'; 'name'; 'start' - the time
+# the event started, in seconds since the epoch; 'seconds' - how long it took; 'thread'; 'parent' - the name of the
+# stage it happened in, or None. Request events also have 'method', 'url', 'status', 'bytes', 'retries' and 'cache'
+# items, and events of anything that failed have an 'error' item.
+#
+# When no callbacks are added recording an event does nothing, so the instrumentation costs next to nothing.
+import json
+import time
+import threading
+import contextlib
+import contextvars
+
+# Functions called with each event
+callbacks = []
+callbacks_lock = threading.Lock()
+
+# The name of the stage being run, so that events can record the stage they happened in. A context variable
+# rather than a thread local, so that concurrent asyncio tasks each have their own.
+current_stage = contextvars.ContextVar('stat_xplore_stage', default = None)
+
+
+def add_callback(callback):
+    '''Add a function to call with each event. Callbacks may be called from several threads at once.
+
+    Args:
+        callback (callable): Function taking a single argument, the event dict
+    '''
+    with callbacks_lock:
+        callbacks.append(callback)
+
+def remove_callback(callback):
+    '''Remove a function added with add_callback. Does nothing if it was not added.'''
+    with callbacks_lock:
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+def record_event(event):
+    '''Pass an event to each callback. Errors raised by callbacks are printed rather than raised, so that a failing
+    callback doesn't stop a run.
+
+    Args:
+        event (dict): The event. The 'thread' and 'parent' items are set if the event doesn't have them.
+    '''
+    if len(callbacks) == 0:
+        return
+
+    event.setdefault('thread', threading.current_thread().name)
+    event.setdefault('parent', current_stage.get())
+
+    with callbacks_lock:
+        event_callbacks = list(callbacks)
+    for callback in event_callbacks:
+        try:
+            callback(event)
+        except Exception as err:
+            print('Metrics callback {} failed: {!r}'.format(callback, err))
+
+@contextlib.contextmanager
+def time_event(kind, name, **fields):
+    '''Time a block of code and record it as an event. The event dict is yielded so that the block can add items to it,
+    eg the number of bytes read. If the block raises an exception the event records it as an 'error' item.
+
+    Args:
+        kind (str): The kind of event, eg 'stage'
+        name (str): The name of the event
+
+    Kwargs:
+        Other kwargs are added to the event
+
+    Yields:
+        dict: The event
+    '''
+    event = {'kind':kind, 'name':name, 'start':time.time(), 'seconds':None}
+    event.update(fields)
+    event['parent'] = current_stage.get()
+
+    start = time.perf_counter()
+    try:
+        yield event
+    except BaseException as err:
+        event['error'] = repr(err)
+        raise
+    finally:
+        event['seconds'] = time.perf_counter() - start
+        record_event(event)
+
+@contextlib.contextmanager
+def time_stage(name, **fields):
+    '''Time a stage of getting data, such as 'build_body' or 'unpack'. Events recorded during the stage have it as their parent.
+    See time_event.'''
+    with time_event('stage', name, **fields) as event:
+        token = current_stage.set(name)
+        try:
+            yield event
+        finally:
+            current_stage.reset(token)
+
+def in_current_stage(function):
+    '''Wrap a function to run in the current stage, so that events it records in a worker thread have the stage as their parent.
+
+    Args:
+        function (callable): The function, eg to pass to ThreadPoolExecutor.map
+
+    Returns:
+        callable: The wrapped function
+    '''
+    stage = current_stage.get()
+
+    def run_in_stage(*args, **kwargs):
+        token = current_stage.set(stage)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current_stage.reset(token)
+
+    return run_in_stage
+
+def time_request(method, url):
+    '''Time an HTTP request. The event has 'status', 'bytes', 'retries' and 'cache' items, set by the block from the response.
+    See time_event.
+
+    Args:
+        method (str): The request method, 'GET' or 'POST'
+        url (str): The url of the request
+    '''
+    return time_event('request', 'http_' + method.lower(), method = method, url = url, status = None, bytes = None, retries = 0, cache = None)
+
+def record_cache(name, hit, **fields):
+    '''Record a look up in a cache, eg the table response cache.
+
+    Args:
+        name (str): The name of the cache, eg 'table_cache'
+        hit (bool): True if the cache had the item
+
+    Kwargs:
+        Other kwargs are added to the event
+    '''
+    if len(callbacks) == 0:
+        return
+    event = {'kind':'cache', 'name':name, 'start':time.time(), 'seconds':0, 'hit':hit}
+    event.update(fields)
+    record_event(event)
+
+def record_progress(name, **fields):
+    '''Record the progress of a long running task, eg the number of schema locations crawled and still to crawl.
+
+    Args:
+        name (str): The name of the task, eg 'schema_crawl'
+
+    Kwargs:
+        Other kwargs are added to the event
+    '''
+    if len(callbacks) == 0:
+        return
+    event = {'kind':'progress', 'name':name, 'start':time.time(), 'seconds':0}
+    event.update(fields)
+    record_event(event)
+
+def print_progress(event):
+    '''A callback that prints progress events and failed requests, eg add_callback(print_progress) to follow a schema crawl.'''
+    if event['kind'] == 'progress':
+        print('{}: {}'.format(event['name'], ', '.join('{} {}'.format(key, value) for key, value in event.items() if key not in ['kind', 'name', 'start', 'seconds', 'thread', 'parent'])))
+    elif (event['kind'] == 'request') and ('error' in event):
+        print('{} {} failed after {:.2f}s: {}'.format(event['method'], event['url'], event['seconds'], event['error']))
+
+
+def create_trace():
+    '''Create an empty trace to collect events in. See start_trace.
+
+    Returns:
+        dict: Dictionary with the following items: 'events' - the list of events; 'lock' - lock used to add events;
+            'callback' - the callback that adds events to the trace
+    '''
+    trace = {'events':[], 'lock':threading.Lock(), 'callback':None}
+
+    def add_event(event):
+        with trace['lock']:
+            trace['events'].append(event)
+
+    trace['callback'] = add_event
+    return trace
+
+def start_trace():
+    '''Start collecting all events into a new trace. Stop collecting with stop_trace.
+
+    Returns:
+        dict: The trace, see create_trace
+    '''
+    trace = create_trace()
+    add_callback(trace['callback'])
+    return trace
+
+def stop_trace(trace):
+    '''Stop collecting events into a trace started with start_trace.'''
+    remove_callback(trace['callback'])
+
+@contextlib.contextmanager
+def record_trace(trace_filename = None):
+    '''Collect the events of a with block into a trace, and optionally write it to a JSON file at the end of the block.
+
+    Kwargs:
+        trace_filename (str, None): Default None. The file to write the trace to. If None the trace is not written.
+
+    Yields:
+        dict: The trace, see create_trace
+    '''
+    trace = start_trace()
+    try:
+        yield trace
+    finally:
+        stop_trace(trace)
+        if trace_filename is not None:
+            write_trace(trace, trace_filename)
+
+def summarise_trace(trace):
+    '''Summarise the events of a trace by kind and name.
+
+    Args:
+        trace (dict): The trace, see create_trace
+
+    Returns:
+        dict: Keys of the form 'kind:name', eg 'stage:unpack', with dict values of: 'count'; 'seconds' - the total time;
+            'max_seconds'; 'errors' - the number of failed events; 'bytes' and 'retries' - the totals, for requests;
+            'hits' and 'misses', for caches
+    '''
+    with trace['lock']:
+        events = list(trace['events'])
+
+    summary = {}
+    for event in events:
+        key = '{}:{}'.format(event['kind'], event['name'])
+        if key not in summary:
+            summary[key] = {'count':0, 'seconds':0.0, 'max_seconds':0.0, 'errors':0}
+            if event['kind'] == 'request':
+                summary[key].update({'bytes':0, 'retries':0, 'cache_hits':0})
+            elif event['kind'] == 'cache':
+                summary[key].update({'hits':0, 'misses':0})
+        name_summary = summary[key]
+
+        name_summary['count'] += 1
+        name_summary['seconds'] += event['seconds'] or 0
+        name_summary['max_seconds'] = max(name_summary['max_seconds'], event['seconds'] or 0)
+        name_summary['errors'] += int('error' in event)
+        if event['kind'] == 'request':
+            name_summary['bytes'] += event['bytes'] or 0
+            name_summary['retries'] += event['retries'] or 0
+            name_summary['cache_hits'] += int(event['cache'] is not None)
+        elif event['kind'] == 'cache':
+            name_summary['hits' if event['hit'] else 'misses'] += 1
+
+    return summary
+
+def write_trace(trace, trace_filename):
+    '''Write the events of a trace and their summary to a JSON file.
+
+    Args:
+        trace (dict): The trace, see create_trace
+        trace_filename (str): The file to write to
+    '''
+    with trace['lock']:
+        events = list(trace['events'])
+
+    with open(trace_filename, 'w') as f:
+        json.dump({'summary':summarise_trace(trace), 'events':events}, f, indent = 1, default = str)
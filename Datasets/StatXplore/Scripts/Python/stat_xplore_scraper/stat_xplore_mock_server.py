@@ -0,0 +1,397 @@
+# Local stand-in for the Stat-Xplore API, serving a synthetic schema and table data
+#
+# The server implements the parts of the API used by the scraper: the 'schema' end point, with the children of
+# valuesets paged and linked with a 'link' header, and the 'table' end point. The size of the schema and the latency
+# of each end point are configurable, so that the schema crawl, recode paging and table requests can be run and timed
+# without the live API.
+#
+# Usage:
+#   python stat_xplore_mock_server.py [--port N] [--latency SECONDS] [--table-latency SECONDS]
+#
+# Or from python, pointing the scraper at the server for the duration of a with block:
+#   with stat_xplore_mock_server.mock_stat_xplore_api(n_folders = 10) as mock_server:
+#       df_schema = stat_xplore_schema.get_full_schema({})
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import stat_xplore_client
+import stat_xplore_schema
+import stat_xplore_table
+
+# Number of children of a valueset returned per page, as for the live API
+default_page_size = 100
+
+
+def build_mock_schema(n_folders = 3, n_databases = 2, n_fields = 3, n_values = 10, n_geography_values = 400):
+    '''Build a synthetic Stat-Xplore schema. Each database has a count measure, n_fields fields with a valueset of
+    n_values values, and a 'Geography (residence-based)' folder with a 'National - Regional - LA - OAs' field and a
+    'Local Authority' valueset of n_geography_values values, matching the default geography labels of the table functions.
+
+    Kwargs:
+        n_folders (int): Default 3. The number of folders in the root folder
+        n_databases (int): Default 2. The number of databases in each folder
+        n_fields (int): Default 3. The number of fields of each database, not including the geography field
+        n_values (int): Default 10. The number of values of each field
+        n_geography_values (int): Default 400. The number of values of the geography valueset
+
+    Returns:
+        dict: Dictionary with the following items: 'root_id' - the id of the root folder; 'items' - dict of schema item id
+            to a dict of the item's 'id', 'type', 'label' and 'children' (a list of child ids)
+    '''
+    items = {}
+
+    def add_item(id, type, label, parent_id = None):
+        items[id] = {'id':id, 'type':type, 'label':label, 'children':[]}
+        if parent_id is not None:
+            items[parent_id]['children'].append(id)
+        return id
+
+    def add_valueset(field_id, valueset_id, label, n):
+        add_item(valueset_id, 'VALUESET', label, field_id)
+        for i in range(n):
+            add_item('{}:{}'.format(valueset_id, i), 'VALUE', '{} {}'.format(label, i), valueset_id)
+
+    root_id = add_item('str:folder:root', 'FOLDER', 'Stat-Xplore')
+    for f in range(n_folders):
+        folder_id = add_item('str:folder:fmock{}'.format(f), 'FOLDER', 'Benefit {}'.format(f), root_id)
+        for d in range(n_databases):
+            database = 'MOCK{}_{}'.format(f, d)
+            view = 'V_F_{}'.format(database)
+            database_id = add_item('str:database:{}'.format(database), 'DATABASE', 'Database {}'.format(database), folder_id)
+            add_item('str:count:{}:{}'.format(database, view), 'COUNT', 'Number of claimants', database_id)
+
+            for x in range(n_fields):
+                field_id = add_item('str:field:{}:{}:F{}'.format(database, view, x), 'FIELD', 'Field {}'.format(x), database_id)
+                add_valueset(field_id, 'str:valueset:{}:{}:F{}:C_F{}'.format(database, view, x, x), 'Field {} values'.format(x), n_values)
+
+            geog_folder_id = add_item('str:folder:{}:geography'.format(database), 'FOLDER', 'Geography (residence-based)', database_id)
+            geog_field_id = add_item('str:field:{}:{}:COA_CODE'.format(database, view), 'FIELD', 'National - Regional - LA - OAs', geog_folder_id)
+            add_valueset(geog_field_id, 'str:valueset:{}:{}:COA_CODE:V_C_LA'.format(database, view), 'Local Authority', n_geography_values)
+
+    return {'root_id':root_id, 'items':items}
+
+def get_item_location(base_url, item_id, root_id):
+    '''Get the location (url) of a schema item of the mock server. The root folder is at the schema end point itself.'''
+    if item_id == root_id:
+        return base_url + '/schema'
+    return base_url + '/schema/' + item_id
+
+def get_item_json(mock_schema, base_url, item_id, page_number = 1, page_size = default_page_size):
+    '''Get the schema response of a mock schema item, and the link header if its children are paged.
+
+    Args:
+        mock_schema (dict): The mock schema, as returned by build_mock_schema
+        base_url (str): The url of the mock server
+        item_id (str): The schema item id
+
+    Kwargs:
+        page_number (int): Default 1. The page of the children of a valueset to return, starting at 1
+        page_size (int): Default 100. The number of children of a valueset per page
+
+    Returns:
+        tuple: The schema JSON data, dict; the link header, str or None if the children are not paged
+    '''
+    root_id = mock_schema['root_id']
+    item = mock_schema['items'][item_id]
+    location = get_item_location(base_url, item_id, root_id)
+
+    children = item['children']
+    link = None
+    if item['type'] == 'VALUESET':
+        n_pages = max(1, -(-len(children) // page_size))
+        children = children[(page_number - 1)*page_size:page_number*page_size]
+        links = []
+        if page_number < n_pages:
+            links.append('<{}?pageNumber={}>; rel="next"'.format(location, page_number + 1))
+        if n_pages > 1:
+            links.append('<{}?pageNumber={}>; rel="last"'.format(location, n_pages))
+        link = ', '.join(links) if len(links) > 0 else None
+
+    item_json = {'id':item_id, 'type':item['type'], 'label':item['label'], 'location':location,
+                 'children':[{'id':child_id,
+                              'type':mock_schema['items'][child_id]['type'],
+                              'label':mock_schema['items'][child_id]['label'],
+                              'location':get_item_location(base_url, child_id, root_id)} for child_id in children]}
+    return item_json, link
+
+def get_table_json(mock_schema, body, seed = 0):
+    '''Build the response of the table end point for a request body. Each dimension has the recoded values of the
+    field if the body recodes it, otherwise all values of the field's first valueset, plus a total item if requested.
+    Recoded values that aren't in the mock schema are labelled with their id, so bodies of any size can be requested.
+
+    Args:
+        mock_schema (dict): The mock schema, as returned by build_mock_schema
+        body (dict): The request body, as built by stat_xplore_table.build_request_body
+
+    Kwargs:
+        seed (int): Default 0. The seed of the random counts
+
+    Returns:
+        dict: The table JSON data, in the format returned by the Stat-Xplore API
+    '''
+    items = mock_schema['items']
+
+    def get_label(id):
+        return items[id]['label'] if id in items else id
+
+    fields = []
+    for dimension in body['dimensions']:
+        field_id = dimension[0]
+        recode = body.get('recodes', {}).get(field_id, {})
+        if 'map' in recode:
+            value_ids = [value[0] for value in recode['map']]
+        else:
+            valuesets = [child_id for child_id in items.get(field_id, {'children':[]})['children'] if items[child_id]['type'] == 'VALUESET']
+            if len(valuesets) == 0:
+                raise ValueError('Field {} is not in the mock schema and is not recoded.'.format(field_id))
+            value_ids = items[valuesets[0]]['children']
+        include_total = recode.get('total', False)
+
+        field_items = [{'type':'RecodeItem', 'uris':[value_id], 'labels':[get_label(value_id)]} for value_id in value_ids]
+        if include_total:
+            field_items.append({'type':'Total', 'labels':['Total']})
+        fields.append({'uri':field_id, 'label':get_label(field_id), 'items':field_items})
+
+    cube_shape = tuple(len(field['items']) for field in fields)
+    rng = np.random.default_rng(seed)
+    cubes = {measure_id:{'values':rng.integers(0, 1000, size = cube_shape).astype('float64').tolist()} for measure_id in body['measures']}
+
+    database_id = body['database']
+    return {'query':body,
+            'database':{'uri':database_id, 'label':get_label(database_id), 'annotationKeys':['mock']},
+            'measures':[{'uri':measure_id, 'label':get_label(measure_id)} for measure_id in body['measures']],
+            'fields':fields,
+            'cubes':cubes,
+            'annotationMap':{'mock':'Synthetic data served by the mock Stat-Xplore API.'}}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    '''Handles requests to the mock Stat-Xplore API. The mock settings and request counts are in the server's 'mock' dict.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Don't log each request, a crawl makes thousands of them
+        pass
+
+    def send_json(self, status, data, extra_headers = None):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def count_request(self, end_point):
+        mock = self.server.mock
+        with mock['lock']:
+            mock['counts'][end_point] += 1
+
+    def do_GET(self):
+        mock = self.server.mock
+        parsed_url = urlparse(self.path)
+        path = unquote(parsed_url.path).rstrip('/')
+
+        if (path != '/schema') and (path.startswith('/schema/') == False):
+            self.send_json(404, {'message':'Not found'})
+            return
+
+        self.count_request('schema')
+        time.sleep(mock['latency'])
+
+        failure_status = None
+        with mock['lock']:
+            failure = mock['failures'].get(unquote(self.path))
+            if failure is not None:
+                failure_status = failure['status']
+                if failure['times'] is not None:
+                    failure['times'] -= 1
+                    if failure['times'] == 0:
+                        mock['failures'].pop(unquote(self.path))
+        if failure_status is not None:
+            self.send_json(failure_status, {'message':'Mock failure'})
+            return
+
+        item_id = mock['schema']['root_id'] if path == '/schema' else path[len('/schema/'):]
+        if item_id not in mock['schema']['items']:
+            self.send_json(404, {'message':'Schema item {} not found'.format(item_id)})
+            return
+
+        page_number = int(parse_qs(parsed_url.query).get('pageNumber', ['1'])[0])
+        item_json, link = get_item_json(mock['schema'], mock['url'], item_id, page_number = page_number, page_size = mock['page_size'])
+        self.send_json(200, item_json, extra_headers = {'link':link} if link is not None else None)
+
+    def do_POST(self):
+        mock = self.server.mock
+        content_length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(content_length)
+
+        if urlparse(self.path).path.rstrip('/') != '/table':
+            self.send_json(404, {'message':'Not found'})
+            return
+
+        self.count_request('table')
+        time.sleep(mock['table_latency'])
+
+        # Responses are kept by request body, so that repeated requests time the transfer rather than building the data
+        with mock['lock']:
+            content = mock['table_responses'].get(data)
+        if content is None:
+            try:
+                content = json.dumps(get_table_json(mock['schema'], json.loads(data))).encode('utf-8')
+            except (ValueError, KeyError) as err:
+                self.send_json(400, {'message':str(err)})
+                return
+            with mock['lock']:
+                mock['table_responses'][data] = content
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def start_mock_server(mock_schema = None, host = '127.0.0.1', port = 0, latency = 0, table_latency = 0, page_size = default_page_size):
+    '''Start a mock Stat-Xplore API server in a background thread.
+
+    Kwargs:
+        mock_schema (dict, None): Default None. The mock schema, as returned by build_mock_schema. If None the default mock schema is used.
+        host (str): Default '127.0.0.1'. The host to serve on
+        port (int): Default 0. The port to serve on. If 0 a free port is used.
+        latency (float): Default 0. The time to wait before responding to each schema request, in seconds
+        table_latency (float): Default 0. The time to wait before responding to each table request, in seconds
+        page_size (int): Default 100. The number of children of a valueset per page
+
+    Returns:
+        dict: Dictionary with the following items: 'url' - the url of the server; 'schema_url', 'table_url' - the urls of
+            the end points; 'counts' - dict of the number of 'schema' and 'table' requests made; 'server', 'thread'
+    '''
+    if mock_schema is None:
+        mock_schema = build_mock_schema()
+
+    server = ThreadingHTTPServer((host, port), MockRequestHandler)
+    server.daemon_threads = True
+    url = 'http://{}:{}'.format(host, server.server_address[1])
+
+    server.mock = {'schema':mock_schema,
+                   'url':url,
+                   'latency':latency,
+                   'table_latency':table_latency,
+                   'page_size':page_size,
+                   'counts':{'schema':0, 'table':0},
+                   'table_responses':{},
+                   'failures':{},
+                   'lock':threading.Lock()}
+
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    return {'url':url,
+            'schema_url':url + '/schema',
+            'table_url':url + '/table',
+            'counts':server.mock['counts'],
+            'server':server,
+            'thread':thread}
+
+def stop_mock_server(mock_server):
+    '''Stop a mock server started with start_mock_server.'''
+    mock_server['server'].shutdown()
+    mock_server['server'].server_close()
+    mock_server['thread'].join()
+
+def reset_request_counts(mock_server):
+    '''Set the request counts of a mock server back to zero.'''
+    with mock_server['server'].mock['lock']:
+        for end_point in mock_server['counts']:
+            mock_server['counts'][end_point] = 0
+
+def fail_requests(mock_server, urls, status = 500, times = None):
+    '''Make schema requests to some urls of a mock server fail, eg to check that a failed page of a valueset isn't skipped.
+
+    Args:
+        mock_server (dict): The mock server, as returned by start_mock_server
+        urls (list of str): The urls to fail, including any query, eg the location of a valueset with '?pageNumber=3'
+
+    Kwargs:
+        status (int): Default 500. The status of the failed responses. Set to None to stop failing the urls.
+        times (int, None): Default None. The number of requests to each url that fail before it responds as normal, 
+            eg to check that transient failures are retried. If None every request fails.
+    '''
+    with mock_server['server'].mock['lock']:
+        for url in urls:
+            parsed_url = urlparse(url)
+            path = unquote(parsed_url.path + ('?' + parsed_url.query if parsed_url.query != '' else ''))
+            if status is None:
+                mock_server['server'].mock['failures'].pop(path, None)
+            else:
+                mock_server['server'].mock['failures'][path] = {'status':status, 'times':times}
+
+@contextlib.contextmanager
+def mock_stat_xplore_api(**kwargs):
+    '''Start a mock server and point the scraper's schema and table urls at it for the duration of a with block.
+    The cached GET responses of the shared client are cleared on entry and exit. Kwargs are passed on to
+    build_mock_schema and start_mock_server.
+
+    Yields:
+        dict: The mock server, as returned by start_mock_server
+    '''
+    schema_kwargs = {key:kwargs.pop(key) for key in ['n_folders', 'n_databases', 'n_fields', 'n_values', 'n_geography_values'] if key in kwargs}
+    if 'mock_schema' not in kwargs:
+        kwargs['mock_schema'] = build_mock_schema(**schema_kwargs)
+
+    mock_server = start_mock_server(**kwargs)
+    urls = (stat_xplore_schema.schema_url, stat_xplore_table.table_url)
+    stat_xplore_schema.schema_url = mock_server['schema_url']
+    stat_xplore_table.table_url = mock_server['table_url']
+    stat_xplore_client.clear_cache()
+    try:
+        yield mock_server
+    finally:
+        stat_xplore_schema.schema_url, stat_xplore_table.table_url = urls
+        stat_xplore_client.clear_cache()
+        stop_mock_server(mock_server)
+
+
+def main(args = None):
+    '''Command line entry point. Serve the mock API until interrupted.'''
+    parser = argparse.ArgumentParser(description = 'Serve a mock Stat-Xplore API with a synthetic schema.')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'The host to serve on')
+    parser.add_argument('--port', type = int, default = 8080, help = 'The port to serve on')
+    parser.add_argument('--latency', type = float, default = 0, help = 'Seconds to wait before responding to each schema request')
+    parser.add_argument('--table-latency', type = float, default = 0, help = 'Seconds to wait before responding to each table request')
+    parser.add_argument('--page-size', type = int, default = default_page_size, help = 'The number of valueset values per page')
+    parser.add_argument('--n-folders', type = int, default = 3, help = 'The number of folders in the root folder')
+    parser.add_argument('--n-databases', type = int, default = 2, help = 'The number of databases per folder')
+    parser.add_argument('--n-fields', type = int, default = 3, help = 'The number of fields per database')
+    parser.add_argument('--n-values', type = int, default = 10, help = 'The number of values per field')
+    parser.add_argument('--n-geography-values', type = int, default = 400, help = 'The number of values of the geography valueset')
+    parsed_args = parser.parse_args(args)
+
+    mock_schema = build_mock_schema(n_folders = parsed_args.n_folders, n_databases = parsed_args.n_databases, n_fields = parsed_args.n_fields,
+                                    n_values = parsed_args.n_values, n_geography_values = parsed_args.n_geography_values)
+    mock_server = start_mock_server(mock_schema, host = parsed_args.host, port = parsed_args.port, latency = parsed_args.latency,
+                                    table_latency = parsed_args.table_latency, page_size = parsed_args.page_size)
+    print('Serving the mock Stat-Xplore API at {} ({} schema items). Press Ctrl+C to stop.'.format(mock_server['schema_url'], len(mock_schema['items'])))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_mock_server(mock_server)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
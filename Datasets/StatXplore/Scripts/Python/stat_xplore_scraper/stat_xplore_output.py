@@ -0,0 +1,255 @@
+# Write Stat-Xplore data to columnar Parquet or Arrow IPC files, and read it back
+#
+# Field (dimension) columns are dictionary encoded, so each field item is stored once, and the database annotations
+# are saved in the file metadata rather than a separate text file. Data can be partitioned into a directory of files,
+# one per value of the partition columns, eg per date, so that downstream jobs only read the partitions they need.
+#
+# A hash of the data is saved with it, so that writing data that hasn't changed can be skipped, leaving the file
+# untouched for downstream jobs that check it for changes.
+#
+# pyarrow is an optional dependency, only needed to write Parquet and Arrow files. Install it with 'pip install pyarrow'.
+import os
+import json
+import uuid
+import hashlib
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+# The file metadata key the annotations are saved under
+annotations_metadata_key = b'stat_xplore_annotations'
+
+# The file metadata key the hash of the data is saved under
+data_hash_metadata_key = b'stat_xplore_data_hash'
+
+# File formats, by file extension
+output_formats = {'.parquet':'parquet',
+                  '.arrow':'ipc',
+                  '.ipc':'ipc',
+                  '.feather':'ipc'}
+
+
+def check_pyarrow():
+    '''Raise an ImportError if pyarrow is not installed.'''
+    if pa is None:
+        raise ImportError('Writing Parquet and Arrow files requires pyarrow. Install it with pip install pyarrow')
+
+def get_output_format(filename, output_format = None):
+    '''Get the format to write a file in, 'parquet' or 'ipc'.
+
+    Args:
+        filename (str): The filename or directory to write to
+
+    Kwargs:
+        output_format (str, None): Default None. The format. If None it is taken from the file extension.
+
+    Returns:
+        str: The format
+    '''
+    if output_format is None:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in output_formats:
+            raise ValueError('Unable to tell the output format of {}. Use one of the extensions {} or set output_format.'.format(filename, list(output_formats.keys())))
+        output_format = output_formats[extension]
+
+    if output_format not in ['parquet', 'ipc']:
+        raise ValueError("Unrecognised output format {}. Must be either 'parquet' or 'ipc'".format(output_format))
+
+    return output_format
+
+def get_data_hash(df_data):
+    '''Get a hash of Stat-Xplore data, from the column names and the values of each row.
+
+    Args:
+        df_data (pandas DataFrame): The data
+
+    Returns:
+        str: The SHA-256 hash of the data
+    '''
+    data_hash = hashlib.sha256(json.dumps([str(column) for column in df_data.columns]).encode('utf-8'))
+    data_hash.update(pd.util.hash_pandas_object(df_data, index = False).values.tobytes())
+    return data_hash.hexdigest()
+
+def get_file_hash(filename, chunk_size = 1024*1024):
+    '''Get the SHA-256 hash of the content of a file, reading it in chunks.'''
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def write_csv(df_data, filename, skip_unchanged = False):
+    '''Write Stat-Xplore data to a csv file.
+
+    Args:
+        df_data (pandas DataFrame): The data
+        filename (str): The filename to write to
+
+    Kwargs:
+        skip_unchanged (bool): Default False. Set whether to leave the file untouched if it already has exactly the csv content
+            of the data, which is checked by comparing hashes of the content.
+
+    Returns:
+        bool: True if the file was written, False if it was unchanged
+    '''
+    csv_content = df_data.to_csv(index=False).encode('utf-8')
+
+    if (skip_unchanged == True) and os.path.isfile(filename):
+        if hashlib.sha256(csv_content).hexdigest() == get_file_hash(filename):
+            return False
+
+    with open(filename, 'wb') as f:
+        f.write(csv_content)
+    return True
+
+def dataframe_to_arrow_table(df_data, annotations = None):
+    '''Convert Stat-Xplore data to an Arrow table. Field columns (all columns that aren't numeric) are dictionary
+    encoded, and the annotations and a hash of the data are saved in the table metadata.
+
+    Args:
+        df_data (pandas DataFrame): The data, as returned by stat_xplore_table.get_stat_xplore_measure_data
+
+    Kwargs:
+        annotations (dict, None): Default None. The database annotations returned with the data
+
+    Returns:
+        pyarrow Table: The data
+    '''
+    check_pyarrow()
+
+    # Categoricals are converted to dictionary encoded arrays
+    dict_data = {}
+    for column in df_data.columns:
+        if pd.api.types.is_numeric_dtype(df_data[column]) or isinstance(df_data[column].dtype, pd.CategoricalDtype):
+            dict_data[column] = df_data[column]
+        else:
+            dict_data[column] = df_data[column].astype('category')
+
+    table = pa.Table.from_pandas(pd.DataFrame(dict_data), preserve_index = False)
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[data_hash_metadata_key] = get_data_hash(df_data).encode('utf-8')
+    if annotations is not None:
+        metadata[annotations_metadata_key] = json.dumps(annotations).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+
+    return table
+
+def write_table(df_data, filename, annotations = None, output_format = None, partition_cols = None, compression = None, skip_unchanged = False, append = False):
+    '''Write Stat-Xplore data to a Parquet or Arrow IPC file, with the annotations in the file metadata.
+
+    Args:
+        df_data (pandas DataFrame): The data, as returned by stat_xplore_table.get_stat_xplore_measure_data
+        filename (str): The filename to write to. If partition_cols is set, the directory to write the partitions to.
+
+    Kwargs:
+        annotations (dict, None): Default None. The database annotations returned with the data
+        output_format (str, None): Default None. The format, 'parquet' or 'ipc'. If None it is taken from the file extension,
+            '.parquet' for Parquet and '.arrow', '.ipc' or '.feather' for Arrow IPC.
+        partition_cols (list of str, None): Default None. The columns to partition the data by, such as the date label column.
+            A file is written for each combination of values of these columns, in hive style directories of the form
+            'column=value', with the values url encoded. Partition columns are read back as the last columns of the data.
+        compression (str, None): Default None. The compression codec, eg 'snappy' or 'zstd'. If None Parquet files are
+            compressed with snappy and Arrow files are not compressed.
+        skip_unchanged (bool): Default False. Set whether to leave the file untouched if the hash of the data saved in it
+            matches the hash of the data. Partitioned data is always written.
+        append (bool): Default False. Set whether to add the data to partitioned data as new files, keeping the files already
+            in the partitions. Otherwise the files of each partition written to are replaced.
+
+    Returns:
+        bool: True if the data was written, False if it was unchanged
+    '''
+    output_format = get_output_format(filename, output_format)
+    table = dataframe_to_arrow_table(df_data, annotations = annotations)
+
+    if (skip_unchanged == True) and (partition_cols is None) and os.path.isfile(filename):
+        if read_data_hash(filename, output_format = output_format) == table.schema.metadata[data_hash_metadata_key].decode('utf-8'):
+            return False
+
+    if partition_cols is not None:
+        file_options = None
+        if compression is not None:
+            file_options = ds.ParquetFileFormat().make_write_options(compression = compression) if output_format == 'parquet' else ds.IpcFileFormat().make_write_options(compression = compression)
+
+        partitioning = ds.partitioning(table.select(partition_cols).schema, flavor = 'hive')
+        if append == True:
+            # A unique file name per write, so the files already in a partition are kept
+            basename_template = 'part-{}-{{i}}.{}'.format(uuid.uuid4().hex, 'parquet' if output_format == 'parquet' else 'arrow')
+            ds.write_dataset(table, filename, format = output_format, partitioning = partitioning, file_options = file_options,
+                             basename_template = basename_template, existing_data_behavior = 'overwrite_or_ignore')
+        else:
+            ds.write_dataset(table, filename, format = output_format, partitioning = partitioning, file_options = file_options,
+                             existing_data_behavior = 'delete_matching')
+    elif output_format == 'parquet':
+        pq.write_table(table, filename, compression = 'snappy' if compression is None else compression)
+    else:
+        with pa.ipc.new_file(filename, table.schema, options = pa.ipc.IpcWriteOptions(compression = compression)) as writer:
+            writer.write_table(table)
+
+    return True
+
+def read_data_hash(filename, output_format = None):
+    '''Read the hash of the data saved in a Parquet or Arrow file by write_table, without reading the data.
+
+    Args:
+        filename (str): The file to read
+
+    Kwargs:
+        output_format (str, None): Default None. The format, 'parquet' or 'ipc'. If None it is taken from the file extension.
+
+    Returns:
+        str: The hash of the data. None if the file has no hash or can't be read.
+    '''
+    check_pyarrow()
+    output_format = get_output_format(filename, output_format)
+
+    try:
+        if output_format == 'parquet':
+            metadata = pq.read_schema(filename).metadata
+        else:
+            with pa.memory_map(filename) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+    if (metadata is None) or (data_hash_metadata_key not in metadata):
+        return None
+    return metadata[data_hash_metadata_key].decode('utf-8')
+
+def read_table(filename, output_format = None, columns = None, filters = None):
+    '''Read Stat-Xplore data written with write_table.
+
+    Args:
+        filename (str): The file, or directory of partitions, to read
+
+    Kwargs:
+        output_format (str, None): Default None. The format, 'parquet' or 'ipc'. If None it is taken from the file extension.
+        columns (list of str, None): Default None. The columns to read. If None all columns are read.
+        filters (pyarrow Expression, None): Default None. A filter of the rows to read, eg pyarrow.dataset.field('Quarter') == 'Mar-20'.
+            Only the partitions that match the filter are read.
+
+    Returns:
+        dict: Dictionary with the following items: 'data' - a pandas DataFrame of the data, with the field columns as Categoricals;
+            'annotations' - the database annotations saved with the data, or None if there are none
+    '''
+    check_pyarrow()
+    output_format = get_output_format(filename, output_format)
+
+    if os.path.isdir(filename):
+        dataset = ds.dataset(filename, format = output_format, partitioning = ds.HivePartitioning.discover(infer_dictionary = True))
+    else:
+        dataset = ds.dataset(filename, format = output_format)
+    table = dataset.to_table(columns = columns, filter = filters)
+
+    # The annotations are in the metadata of each file. The schema of a dataset is the schema of its first file.
+    metadata = dataset.schema.metadata or {}
+    annotations = None
+    if annotations_metadata_key in metadata:
+        annotations = json.loads(metadata[annotations_metadata_key].decode('utf-8'))
+
+    return {'data':table.to_pandas(), 'annotations':annotations}
@@ -0,0 +1,306 @@
+# Roll up Stat-Xplore data from the finest geography requested to coarser geographies locally
+#
+# Rather than a table request per geography level, eg for LSOAs, MSOAs and local authorities, the data is requested once
+# at the finest level and summed up to each coarser level using a lookup table of the parent of each geography, such as
+# the ONS lookups used in Boundaries/Lookups (eg columns LSOA11CD, MSOA11CD, MSOA11NM, LAD11CD, LAD11NM).
+#
+# Geographies are matched to the lookup by their ONS code, the last part of the Stat-Xplore geography value ID, eg
+# E01000001 of 'str:value:...:V_C_MASTERGEOG11_LSOA_TO_MSOA:E01000001'. The schema doesn't link geography values to
+# their parents, so a lookup table is needed.
+#
+# Stat-Xplore applies disclosure control, rounding each cell, so sums of rounded values can differ from the values the
+# server returns for the coarser geography. The geography total returned with the data is compared with the local sum,
+# and locally rolled up data can be compared with data requested at the coarser level, to flag the cells that differ.
+import numpy as np
+import pandas as pd
+import stat_xplore_schema
+import stat_xplore_table
+
+# The geography item ID of the total across all geographies. The total item has no uri so its label is used, see
+# stat_xplore_table.unpack_field_items
+total_item_id = 'Total'
+
+
+def read_geography_lookup(lookup_filename, columns = None):
+    '''Read a lookup table of geography codes, eg the ONS LSOA to MSOA to local authority lookup. Zipped csvs are read
+    without extracting them. Codes are read as strings and duplicate rows are dropped.
+
+    Args:
+        lookup_filename (str): The lookup csv
+
+    Kwargs:
+        columns (list of str, None): Default None. The columns to read. If None all columns are read.
+
+    Returns:
+        pandas DataFrame: The lookup table
+    '''
+    df_lookup = pd.read_csv(lookup_filename, usecols = columns, dtype = str)
+    return df_lookup.drop_duplicates(ignore_index = True)
+
+def get_geography_codes(geog_item_ids):
+    '''Get the ONS codes of Stat-Xplore geography item IDs, the part of each ID after the last ':'. IDs without a ':',
+    such as codes or the total item, are returned unchanged. Each distinct ID is only split once.
+
+    Args:
+        geog_item_ids (pandas Series or array of str): The geography item IDs, eg the geography field column of the data
+
+    Returns:
+        numpy array of str: The code of each ID
+    '''
+    item_codes, item_ids = pd.factorize(np.asarray(geog_item_ids, dtype = object))
+    codes = pd.Index(item_ids).astype(str).str.rsplit(':', n = 1).str[-1]
+    return np.asarray(codes, dtype = object)[item_codes]
+
+def get_value_columns(df_data):
+    '''Get the value columns of long format data. Data of a single measure has a 'value' column, and data of several
+    measures a column per measure, headed by the measure uri, see stat_xplore_table.json_response_to_dataframe. The
+    columns are found by name rather than type, since a column with missing (suppressed) values can be of object type.
+
+    Args:
+        df_data (pandas DataFrame): The data, as returned by stat_xplore_table.get_stat_xplore_measure_data
+
+    Returns:
+        list of str: The value columns
+    '''
+    if 'value' in df_data.columns:
+        return ['value']
+    return [column for column in df_data.columns if str(column).startswith('str:') and (str(column).startswith('str:field:') == False)]
+
+def get_rollup_columns(df_data, geog_field_id, value_columns = None):
+    '''Get the columns of long format data that are rolled up. Each field has an ID column followed by a label column,
+    see stat_xplore_table.json_response_to_dataframe, and the values are the 'value' or measure uri columns.
+
+    Args:
+        df_data (pandas DataFrame): The data, as returned by stat_xplore_table.get_stat_xplore_measure_data
+        geog_field_id (str): The field ID of the geography field
+
+    Kwargs:
+        value_columns (list of str, None): Default None. The value columns. If None they are found with get_value_columns.
+
+    Returns:
+        tuple: The geography label column; the list of the ID and label columns of the other fields; the list of value columns
+    '''
+    if geog_field_id not in df_data.columns:
+        raise ValueError('The geography field {} is not a column of the data.'.format(geog_field_id))
+    geog_label_column = df_data.columns[df_data.columns.get_loc(geog_field_id) + 1]
+
+    value_columns = get_value_columns(df_data) if value_columns is None else list(value_columns)
+    missing_columns = [column for column in value_columns if column not in df_data.columns]
+    if (len(value_columns) == 0) or (len(missing_columns) > 0):
+        raise ValueError('The value columns {} are not columns of the data.'.format(missing_columns if len(missing_columns) > 0 else value_columns))
+    key_columns = [column for column in df_data.columns if column not in value_columns + [geog_field_id, geog_label_column]]
+
+    return geog_label_column, key_columns, value_columns
+
+def get_numeric_values(df_data, value_columns):
+    '''Convert the value columns of data to numbers, with missing (suppressed) values as NaN, so that they can be summed.'''
+    return df_data.assign(**{column:pd.to_numeric(df_data[column]) for column in value_columns})
+
+def get_unmatched_geographies(df_data, geog_field_id, df_lookup, child_code_column):
+    '''Get the codes of the geographies of data that are not in a lookup table. The geography total is not included.
+
+    Args:
+        df_data (pandas DataFrame): The data in long format
+        geog_field_id (str): The field ID of the geography field
+        df_lookup (pandas DataFrame): The lookup table
+        child_code_column (str): The lookup column of the codes of the data's geographies, eg 'LSOA11CD'
+
+    Returns:
+        list of str: The codes of the unmatched geographies, sorted
+    '''
+    is_total = (df_data[geog_field_id] == total_item_id).to_numpy()
+    geog_codes = pd.unique(get_geography_codes(df_data.loc[~is_total, geog_field_id]))
+    return sorted(set(geog_codes[pd.Index(df_lookup[child_code_column]).get_indexer(geog_codes) < 0]))
+
+def rollup_geography(df_data, geog_field_id, df_lookup, child_code_column, parent_code_column, parent_label_column = None, value_columns = None, drop_unmatched = False):
+    '''Sum data at one geography level up to a coarser level, eg LSOAs to local authorities, by looking up the parent of
+    each geography. Values are summed with a single group by of the parent and the other fields. Missing (suppressed)
+    values are skipped, and a sum is only missing if all of its values are.
+
+    The rows of the geography total are kept unchanged, as returned by the server, so the result has the same rows as a
+    request at the coarser level.
+
+    Args:
+        df_data (pandas DataFrame): The data in long format, as returned by stat_xplore_table.get_stat_xplore_measure_data
+        geog_field_id (str): The field ID of the geography field
+        df_lookup (pandas DataFrame): The lookup table, with a row per geography of the data's level
+        child_code_column (str): The lookup column of the codes of the data's geographies, eg 'LSOA11CD'
+        parent_code_column (str): The lookup column of the codes of the coarser geographies, eg 'LAD11CD'
+
+    Kwargs:
+        parent_label_column (str, None): Default None. The lookup column of the names of the coarser geographies, eg 'LAD11NM'.
+            If None the codes are used as labels.
+        value_columns (list of str, None): Default None. The value columns to sum. If None they are found with get_value_columns.
+        drop_unmatched (bool): Default False. Set whether to leave out geographies that are not in the lookup. If False
+            a ValueError is raised if any geographies are not in the lookup. See get_unmatched_geographies.
+
+    Returns:
+        pandas DataFrame: The data at the coarser level, with the same columns as df_data. The geography ID column has the
+            codes of the coarser geographies.
+    '''
+    geog_label_column, key_columns, value_columns = get_rollup_columns(df_data, geog_field_id, value_columns = value_columns)
+
+    lookup_columns = [child_code_column, parent_code_column] + ([parent_label_column] if parent_label_column is not None else [])
+    df_lookup = df_lookup[lookup_columns].drop_duplicates()
+    if df_lookup[child_code_column].duplicated().any():
+        raise ValueError('Some {} geographies have more than one {} in the lookup.'.format(child_code_column, parent_code_column))
+
+    is_total = (df_data[geog_field_id] == total_item_id).to_numpy()
+    df_children = get_numeric_values(df_data.loc[~is_total, key_columns + value_columns], value_columns)
+
+    # Find the position in the lookup of each geography
+    lookup_positions = pd.Index(df_lookup[child_code_column]).get_indexer(get_geography_codes(df_data.loc[~is_total, geog_field_id]))
+    is_matched = lookup_positions >= 0
+    if is_matched.all() == False:
+        unmatched_codes = sorted(set(get_geography_codes(df_data.loc[~is_total, geog_field_id])[~is_matched]))
+        if drop_unmatched == False:
+            raise ValueError('{} geographies are not in the {} column of the lookup, eg {}. Set drop_unmatched to leave them out.'.format(len(unmatched_codes), child_code_column, unmatched_codes[:5]))
+        df_children = df_children.loc[is_matched]
+        lookup_positions = lookup_positions[is_matched]
+
+    parent_codes = df_lookup[parent_code_column].to_numpy()[lookup_positions]
+    df_children = df_children.assign(**{geog_field_id:parent_codes})
+
+    df_rollup = df_children.groupby(key_columns + [geog_field_id], sort = False, observed = True)[value_columns].sum(min_count = 1).reset_index()
+
+    if parent_label_column is not None:
+        parent_labels = df_lookup.drop_duplicates(parent_code_column).set_index(parent_code_column)[parent_label_column]
+        df_rollup[geog_label_column] = df_rollup[geog_field_id].map(parent_labels)
+    else:
+        df_rollup[geog_label_column] = df_rollup[geog_field_id]
+
+    df_rollup = pd.concat([df_rollup, get_numeric_values(df_data.loc[is_total], value_columns)], ignore_index = True)
+    return df_rollup[list(df_data.columns)]
+
+def flag_disclosure_differences(df_local, df_server, geog_field_id, tolerance = 0, value_columns = None):
+    '''Compare data summed locally with data returned by the server for the same geographies and field items, eg local
+    authority data rolled up from LSOAs with data requested at the local authority level. Differences are expected where
+    the server's disclosure control rounds the cells of the summed geographies.
+
+    Geographies are matched by code, see get_geography_codes, and other fields by item ID.
+
+    Args:
+        df_local (pandas DataFrame): The locally summed data
+        df_server (pandas DataFrame): The data returned by the server, with the same fields and value columns
+        geog_field_id (str): The field ID of the geography field
+
+    Kwargs:
+        tolerance (float): Default 0. The largest difference between a local and a server value that isn't flagged
+        value_columns (list of str, None): Default None. The value columns to compare. If None they are found with get_value_columns.
+
+    Returns:
+        pandas DataFrame: df_local with, for each value column, a '<column>_server' column of the server value and a
+            '<column>_difference' column of the local value less the server value, and a 'disclosure_difference' column
+            that is True where any value differs by more than the tolerance. Rows the server has no value for are not flagged.
+    '''
+    geog_label_column, key_columns, value_columns = get_rollup_columns(df_local, geog_field_id, value_columns = value_columns)
+    df_local = get_numeric_values(df_local, value_columns)
+    df_server = get_numeric_values(df_server, value_columns)
+
+    # Match on the ID columns of the other fields, the first column of each ID and label pair
+    match_columns = key_columns[::2] + ['geography_code']
+
+    df_server = df_server[key_columns + [geog_field_id] + value_columns].assign(geography_code = get_geography_codes(df_server[geog_field_id]))
+    df_server = df_server[match_columns + value_columns].rename(columns = {column:'{}_server'.format(column) for column in value_columns})
+    df_server[match_columns] = df_server[match_columns].astype(str)
+
+    df_match = df_local[[column for column in match_columns if column != 'geography_code']].astype(str).assign(geography_code = get_geography_codes(df_local[geog_field_id]))
+    df_match = df_match.merge(df_server, how = 'left', on = match_columns, validate = 'many_to_one')
+
+    df_flagged = df_local.copy()
+    is_different = np.zeros(len(df_local), dtype = bool)
+    for column in value_columns:
+        server_values = df_match['{}_server'.format(column)].to_numpy()
+        df_flagged['{}_server'.format(column)] = server_values
+        df_flagged['{}_difference'.format(column)] = df_local[column].to_numpy() - server_values
+        is_different |= (np.abs(df_flagged['{}_difference'.format(column)]) > tolerance).to_numpy()
+
+    df_flagged['disclosure_difference'] = is_different
+    return df_flagged
+
+def check_geography_totals(df_data, geog_field_id, tolerance = 0, value_columns = None):
+    '''Compare the geography total returned by the server with the sum of the data across all geographies, for each
+    combination of the other fields' items. See flag_disclosure_differences.
+
+    Args:
+        df_data (pandas DataFrame): The data in long format, including the geography total
+        geog_field_id (str): The field ID of the geography field
+
+    Kwargs:
+        tolerance (float): Default 0. The largest difference between the local sum and the server total that isn't flagged
+        value_columns (list of str, None): Default None. The value columns to sum. If None they are found with get_value_columns.
+
+    Returns:
+        pandas DataFrame: The local sums across all geographies, flagged as returned by flag_disclosure_differences
+    '''
+    geog_label_column, key_columns, value_columns = get_rollup_columns(df_data, geog_field_id, value_columns = value_columns)
+    df_data = get_numeric_values(df_data, value_columns)
+
+    is_total = (df_data[geog_field_id] == total_item_id).to_numpy()
+    df_sum = df_data.loc[~is_total].groupby(key_columns, sort = False, observed = True)[value_columns].sum(min_count = 1).reset_index()
+    df_sum[geog_field_id] = total_item_id
+    df_sum[geog_label_column] = total_item_id
+
+    return flag_disclosure_differences(df_sum[list(df_data.columns)], df_data.loc[is_total], geog_field_id, tolerance = tolerance, value_columns = value_columns)
+
+def get_rollup_measure_data(table_headers, schema_headers, measure_id, df_lookup, child_code_column, parent_levels, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label = 'National - Regional - LA - OAs', geog_level_label = 'Lower Layer Super Output Area', check_cache = False, schema_filename = 'schema.csv', tolerance = 0, drop_unmatched = False, **measure_data_kwargs):
+    '''Get the data of a measure at several geography levels with a single table request. The data is requested at the
+    finest level, geog_level_label, and rolled up locally to each coarser level with rollup_geography. The sums of all
+    geographies are checked against the geography total returned by the server, see check_geography_totals.
+
+    Args:
+        table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
+        schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
+        measure_id (str or list of str): The id of the measure, or a list of ids of measures from the same database, to request data for
+        df_lookup (pandas DataFrame): The lookup table of the parents of the finest geographies, see read_geography_lookup
+        child_code_column (str): The lookup column of the codes of the finest geographies, eg 'LSOA11CD'
+        parent_levels (dict): The coarser levels to roll up to. Level names as keys, eg 'Local Authority', and the lookup
+            column of the level's codes, eg 'LAD11CD', or a tuple of the code and name columns, eg ('LAD11CD', 'LAD11NM'), as values
+
+    Kwargs:
+        df_schema (pandas DataFrame, SchemaTree, None): Default to None. The Stat-Xplore schema
+        geog_folder_label (str): Defaults to 'Geography (residence-based)'. The label of the geography folder
+        geog_field_label (str): Defaults to 'National - Regional - LA - OAs'. The label of the geography field
+        geog_level_label (str): Defaults to 'Lower Layer Super Output Area'. The label of the finest level, the level requested
+        check_cache (bool): Default False. Set whether to use the cached schema and geography recodes
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
+        tolerance (float): Default 0. The largest difference between the local sum and the server total that isn't flagged
+        drop_unmatched (bool): Default False. Set whether to leave geographies that are not in the lookup out of the rolled up
+            levels. If False a ValueError is raised if any geographies are not in the lookup.
+        Other kwargs are passed on to stat_xplore_table.get_stat_xplore_measure_data. The data must be in long format.
+
+    Returns:
+        dict: Dictionary with the following items: 'data' - dict of a pandas DataFrame of the data at each level, with
+            geog_level_label and the keys of parent_levels as keys, or None if the request was unsuccessful; 'annotations';
+            'total_differences' - the check of the geography totals, see check_geography_totals; 'unmatched_geographies' -
+            the codes of the geographies left out of the rolled up levels because they are not in the lookup
+    '''
+    if measure_data_kwargs.get('row_field_ids') is not None:
+        raise ValueError('Data can only be rolled up in long format. Leave row_field_ids unset.')
+
+    # Index the schema once for the geography field lookup and the request body
+    df_schema = stat_xplore_schema.get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename, lazy = True)
+    geog_field_id = stat_xplore_schema.get_geography_valueset_location(df_schema, stat_xplore_table.get_database_id(measure_id), geog_folder_label, geog_field_label, geog_level_label)[0]
+
+    result = stat_xplore_table.get_stat_xplore_measure_data(table_headers, schema_headers, measure_id, df_schema = df_schema, geog_folder_label = geog_folder_label, geog_field_label = geog_field_label,
+                                                            geog_level_label = geog_level_label, check_cache = check_cache, schema_filename = schema_filename, **measure_data_kwargs)
+    if result['data'] is None:
+        return {'data':None, 'annotations':None, 'total_differences':None, 'unmatched_geographies':None}
+
+    # A single measure has a 'value' column, several measures a column per measure uri
+    measure_ids = [measure_id] if isinstance(measure_id, str) else list(measure_id)
+    value_columns = ['value'] if len(measure_ids) == 1 else measure_ids
+
+    level_data = {geog_level_label:result['data']}
+    for level_label, level_columns in parent_levels.items():
+        parent_code_column, parent_label_column = (level_columns, None) if isinstance(level_columns, str) else level_columns
+        level_data[level_label] = rollup_geography(result['data'], geog_field_id, df_lookup, child_code_column, parent_code_column, parent_label_column = parent_label_column,
+                                                   value_columns = value_columns, drop_unmatched = drop_unmatched)
+
+    df_total_differences = check_geography_totals(result['data'], geog_field_id, tolerance = tolerance, value_columns = value_columns)
+    n_different = int(df_total_differences['disclosure_difference'].sum())
+    if n_different > 0:
+        print('The sum of all geographies differs from the total returned by the server in {} of {} cells, due to disclosure control.'.format(n_different, len(df_total_differences)))
+
+    return {'data':level_data, 'annotations':result['annotations'], 'total_differences':df_total_differences,
+            'unmatched_geographies':get_unmatched_geographies(result['data'], geog_field_id, df_lookup, child_code_column)}
@@ -1,14 +1,51 @@
 import requests
 import pandas as pd 
+import stat_xplore_client
+import stat_xplore_schema_tree
+import stat_xplore_metrics
 import os
-import re
+import json
+import time
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 schema_url = 'https://stat-xplore.dwp.gov.uk/webapi/rest/v1/schema'
 
-def get_full_schema(schema_headers, types_to_include = ["FOLDER","DATABASE","MEASURE","FIELD"], check_cache = False, schema_filename = 'schema.csv'):
+# Indexed cached schemas, keyed by cache filename. Each cached schema csv is only read once per process
+# (or again if the file is modified) rather than once per schema url looked up.
+schema_stores = {}
+schema_stores_lock = threading.Lock()
+
+# Schema trees built from schema DataFrames, keyed by the id of the DataFrame. Each DataFrame is only indexed once,
+# however many table functions it is passed to, and its tree is dropped when the DataFrame is garbage collected.
+schema_trees = {}
+schema_trees_lock = threading.Lock()
+
+# Locks held while crawling the schema, keyed by schema filename
+schema_crawl_locks = {}
+schema_crawl_locks_lock = threading.Lock()
+
+# Cached recodes, keyed by recode cache filename. Each recode cache is read once per process.
+recode_caches = {}
+recode_caches_lock = threading.Lock()
+
+# Default time after which cached recodes are requested again, in seconds. Read when recodes are looked up, so it can be changed at any time.
+default_recode_cache_ttl = 30*24*60*60
+
+# Default time after which schema items cached by a LazySchemaTree are requested again, in seconds. Read when the tree is created.
+default_lazy_schema_cache_ttl = 7*24*60*60
+
+def get_full_schema(schema_headers, types_to_include = ["FOLDER","DATABASE","MEASURE","FIELD"], check_cache = False, schema_filename = 'schema.csv', max_workers = 8, resume = True, checkpoint_batch_size = 100):
     '''Get the schema information of all elements of the Stat-Xplore schema but sratting at the root 
     folder and iterating through the schema tree.
 
+    The schema is crawled breadth first from a queue of schema locations still to map. Locations are requested in 
+    batches and the schema of each batch is appended to a partial schema csv as it goes, together with a checkpoint 
+    file recording the locations still to map. If the crawl is interrupted, running it again resumes from the 
+    checkpoint. When the crawl finishes the partial schema csv replaces the schema csv.
+
     Args:
         schema_headers (dict): The headers to use in the html request to the stat-xplore API.
 
@@ -17,42 +54,217 @@ def get_full_schema(schema_headers, types_to_include = ["FOLDER","DATABASE","MEA
             The schema element types to include in the schema dataframe
         check_cache (bool): Default False. Set whether to check the cached schema csv for schema information
         cache_filename (str): Default 'schema.csv'. The filename of the chached schema
+        max_workers (int): Default 8. The number of schema requests to send to the API concurrently. 
+            Set to 1 to request each schema item one after another.
+        resume (bool): Default True. Set whether to resume from the checkpoint of an interrupted crawl, if there is one
+        checkpoint_batch_size (int): Default 100. The number of schema locations to request between checkpoints
     '''
+    # Only one crawl of a schema file runs at a time, since the crawl writes the partial schema and checkpoint files
+    with get_schema_crawl_lock(schema_filename), stat_xplore_metrics.time_stage('schema_crawl', schema_filename = schema_filename):
+        crawl = None
+        if resume == True:
+            crawl = resume_schema_crawl(schema_filename)
 
-    # Get chema info for the root folder
-    root_reponse = request_schema(schema_headers)
-    if root_reponse['success'] == False:
-        return
-    root_json = root_reponse['response'].json()
+        if crawl is None:
+            # Get chema info for the root folder. Use the cached schema if it has it so that a fully cached crawl makes no requests
+            df_root_schema = pd.DataFrame()
+            if check_cache == True:
+                df_root_schema = get_cached_root_schema(schema_filename)
+
+            if len(df_root_schema) == 0:
+                root_reponse = request_schema(schema_headers)
+                if root_reponse['success'] == False:
+                    return
+                df_root_schema = root_schema_to_dataframe(root_reponse['response'].json())
+
+            crawl = start_schema_crawl(df_root_schema, schema_filename)
+
+        # Start loop to interate over all parent schema items still to map
+        while len(crawl['still_to_map']) >0:
+
+            batch = crawl['still_to_map'][:checkpoint_batch_size]
+            crawl['still_to_map'] = crawl['still_to_map'][checkpoint_batch_size:]
+
+            children_schema_results = get_children_schemas(batch, schema_headers, check_cache, cache_filename = schema_filename, max_workers = max_workers)
+
+            record_schema_crawl_batch(crawl, batch, children_schema_results, types_to_include)
+
+        return finish_schema_crawl(crawl)
+
+def get_schema_crawl_lock(schema_filename):
+    '''Get the lock held while crawling the schema into a schema file. Concurrent calls to get_full_schema for the 
+    same file, such as when building several table requests at once, wait for each other rather than writing the same files.'''
+    with schema_crawl_locks_lock:
+        return schema_crawl_locks.setdefault(os.path.abspath(schema_filename), threading.Lock())
+
+def resume_schema_crawl(schema_filename):
+    '''Resume an interrupted schema crawl from its checkpoint. Rows of the partial schema csv written after the 
+    last checkpoint are dropped, since they will be requested again.
+
+    Args:
+        schema_filename (str): The filename of the schema csv
 
+    Returns:
+        dict: The state of the crawl, see start_schema_crawl. None if there is no crawl to resume.
+    '''
+    partial_filename, checkpoint_filename = get_checkpoint_filenames(schema_filename)
+    if (os.path.exists(checkpoint_filename) == False) | (os.path.exists(partial_filename) == False):
+        return None
+
+    with open(checkpoint_filename, 'r') as f:
+        checkpoint = json.load(f)
+    print('Resuming schema crawl from checkpoint. {} schema locations still to map.'.format(len(checkpoint['pending'])))
+
+    # Drop any rows written after the last checkpoint, they will be requested again
+    df_partial_schema = pd.read_csv(partial_filename, encoding = 'utf-8')
+    if len(df_partial_schema) > checkpoint['n_rows']:
+        df_partial_schema.head(checkpoint['n_rows']).to_csv(partial_filename, index=False, encoding = 'utf-8')
+
+    return {'schema_filename':schema_filename,
+            'schema_columns':list(df_partial_schema.columns),
+            'still_to_map':list(checkpoint['pending']),
+            'n_rows':checkpoint['n_rows'],
+            'failed':[]}
+
+def get_cached_root_schema(schema_filename):
+    '''Get the schema of the root folder from the cached schema csv.
+
+    Args:
+        schema_filename (str): The filename of the cached schema
+
+    Returns:
+        pandas DataFrame: The root folder schema, without a parent_id column. Empty if the schema is not cached.
+    '''
+    if os.path.exists(schema_filename) == False:
+        return pd.DataFrame()
+    df_cached_schema = load_schema_store(schema_filename)['schema']
+    return df_cached_schema.loc[ df_cached_schema['location'] == schema_url].drop(columns = 'parent_id')
+
+def root_schema_to_dataframe(root_json):
+    '''Convert the schema response of the root folder to a single row DataFrame.'''
     # Remove the 'children' key of the schema - we only want to record the 'id', 'type', 'label' and 'location' schema information
+    root_json = dict(root_json)
     del root_json['children']
+    return pd.DataFrame([root_json])
+
+def start_schema_crawl(df_root_schema, schema_filename):
+    '''Start a new schema crawl from the root folder. The partial schema csv is initialised with the root folder schema
+    and the checkpoint with the root folder location.
+
+    Args:
+        df_root_schema (pandas DataFrame): The schema of the root folder
+        schema_filename (str): The filename of the schema csv
+
+    Returns:
+        dict: The state of the crawl, with the following items: 'schema_filename'; 'schema_columns' - the columns of the 
+            partial schema csv; 'still_to_map' - the schema locations still to request; 'n_rows' - the number of rows of the 
+            partial schema csv; 'failed' - the locations that could not be requested
+    '''
+    partial_filename, checkpoint_filename = get_checkpoint_filenames(schema_filename)
 
-    # Initialise full schema dataframe with the schema infomation of the root folder
-    df_full_schema = pd.DataFrame([root_json])
+    # Initialise the partial schema csv with the schema infomation of the root folder
+    schema_columns = list(df_root_schema.columns) + ['parent_id']
+    df_root_schema.reindex(columns = schema_columns).to_csv(partial_filename, index=False, encoding = 'utf-8')
 
-    # Start loop to interate over all parent schema items
-    still_to_map = df_full_schema
-    while len(still_to_map) >0:
+    still_to_map = [df_root_schema['location'].values[0]]
+    write_json(checkpoint_filename, {'pending':still_to_map, 'n_rows':1})
 
-        new_schema = get_lower_tier_schema_from_upper_tier_schema(still_to_map, schema_headers, check_cache, cache_filename = schema_filename)
+    return {'schema_filename':schema_filename,
+            'schema_columns':schema_columns,
+            'still_to_map':list(still_to_map),
+            'n_rows':1,
+            'failed':[]}
+
+def record_schema_crawl_batch(crawl, batch, children_schema_results, types_to_include):
+    '''Append the children schemas of a batch of schema locations to the partial schema csv, add the children to 
+    map next to the crawl and update the checkpoint.
+
+    Args:
+        crawl (dict): The state of the crawl, see start_schema_crawl. Updated in place.
+        batch (list of str): The schema locations of the batch
+        children_schema_results (list of dict): The result of get_children_schema_of_url for each location of the batch
+        types_to_include (list of str): The schema element types whose children are mapped
+    '''
+    partial_filename, checkpoint_filename = get_checkpoint_filenames(crawl['schema_filename'])
+
+    new_schema = []
+    for location, children_schema_result in zip(batch, children_schema_results):
+        if children_schema_result['success'] == False:
+            print('Faield to get children schema for location {}'.format(location))
+            crawl['failed'].append(location)
+            continue
+        new_schema.append(children_schema_result['schema'])
+
+    if len(new_schema) > 0:
+        df_new_schema = pd.concat(new_schema, join = 'outer').reindex(columns = crawl['schema_columns'])
+
+        # Append the new schema to the partial schema csv
+        df_new_schema.to_csv(partial_filename, mode = 'a', header = False, index=False, encoding = 'utf-8')
+        crawl['n_rows'] += len(df_new_schema)
 
         # Only get children schemas desired types in the resulting schema. 
         # Eg exclude value sets such as all geographies (this can take a while to get)
-        still_to_map = new_schema.loc[new_schema['type'].isin(types_to_include)]
+        crawl['still_to_map'] += list(df_new_schema.loc[df_new_schema['type'].isin(types_to_include), 'location'].unique())
 
-        df_full_schema = pd.concat([df_full_schema, new_schema], join = 'outer')
+    # Record the locations still to map. Failed locations are kept so that they are retried when the crawl is resumed
+    write_json(checkpoint_filename, {'pending':crawl['failed'] + crawl['still_to_map'], 'n_rows':crawl['n_rows']})
+
+    stat_xplore_metrics.record_progress('schema_crawl', items = crawl['n_rows'], pending = len(crawl['still_to_map']), failed = len(crawl['failed']))
+
+def finish_schema_crawl(crawl):
+    '''Save the schema of a finished crawl. If all locations were mapped the partial schema csv replaces the 
+    schema csv and the checkpoint is removed. Otherwise the schema csv is left as it is, so that a complete cached
+    schema is never replaced by an incomplete one, and the partial schema csv and checkpoint are kept so the failed
+    locations can be resumed.
+
+    Args:
+        crawl (dict): The state of the crawl, see start_schema_crawl
+
+    Returns:
+        pandas DataFrame: The full schema, or the schema crawled so far if any locations failed
+    '''
+    schema_filename = crawl['schema_filename']
+    partial_filename, checkpoint_filename = get_checkpoint_filenames(schema_filename)
+
+    df_full_schema = pd.read_csv(partial_filename, encoding = 'utf-8')
 
     # Save the schema at the end
-    df_full_schema.to_csv(schema_filename, index=False, encoding = 'utf-8')
+    if len(crawl['failed']) > 0:
+        print('Failed to get the schema of {} locations. Run again to resume the crawl for these locations.'.format(len(crawl['failed'])))
+    else:
+        os.replace(partial_filename, schema_filename)
+        os.remove(checkpoint_filename)
 
     return df_full_schema
 
-        
+def get_checkpoint_filenames(schema_filename):
+    '''Get the filenames of the partial schema csv and the checkpoint json used while crawling the schema.
+
+    Args:
+        schema_filename (str): The filename of the schema csv
+
+    Returns:
+        tuple of str: The partial schema filename and the checkpoint filename, eg 'schema_partial.csv' and 'schema_checkpoint.json' for 'schema.csv'
+    '''
+    filename_root = os.path.splitext(schema_filename)[0]
+    return filename_root + '_partial.csv', filename_root + '_checkpoint.json'
+
+def write_json(filename, data):
+    '''Write data to a json file, such as the schema crawl checkpoint or the recode cache. The data is written to a 
+    temporary file first so that an interruption while writing does not leave a broken file.
+
+    Args:
+        filename (str): The filename of the json file
+        data (dict): The data to write
+    '''
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(filename + '.tmp', filename)
 
-def get_lower_tier_schema_from_upper_tier_schema(df_parent_schema, schema_headers, check_cache = False, cache_filename = 'schema.csv'):
+def get_lower_tier_schema_from_upper_tier_schema(df_parent_schema, schema_headers, check_cache = False, cache_filename = 'schema.csv', max_workers = 8):
     '''Function to loop through each of the parent elements of the upper tier schema and get the schema
-    of the children of each one. Children schemas are combined together and returned.
+    of the children of each one. Children schemas are requested concurrently, then combined together
+    in the order of the parent elements and returned.
 
     Args:
         df_parent_schema (pandas DataFrame): The parent schema of teh children schemas to return
@@ -62,25 +274,249 @@ def get_lower_tier_schema_from_upper_tier_schema(df_parent_schema, schema_header
         check_cache (bool): Default False. Check local directory for schema details.
         cache_filename (str): Default 'schema.csv'. The filename of the cached schema details 
                                 to check for.
+        max_workers (int): Default 8. The number of children schemas to request concurrently.
     '''
     # Get teh urls of each of the parent items
     parent_locations = df_parent_schema['location'].unique()
 
-    # initialise the lower tier schema
-    df_lower_tier_schema = pd.DataFrame()
+    children_schema_results = get_children_schemas(parent_locations, schema_headers, check_cache, cache_filename, max_workers = max_workers)
 
-    # Iterate over parent items and get children schema
-    for location in parent_locations:
-        children_schema_result = get_children_schema_of_url(location, schema_headers, check_cache, cache_filename)
+    # Combine the children schemas
+    children_schemas = []
+    for location, children_schema_result in zip(parent_locations, children_schema_results):
         if children_schema_result['success'] == False:
             print('Faield to get children schema for location {}'.format(location))
             continue
 
-        df_lower_tier_schema = pd.concat([df_lower_tier_schema, children_schema_result['schema']], join = 'outer')
+        children_schemas.append(children_schema_result['schema'])
+
+    if len(children_schemas) == 0:
+        return pd.DataFrame()
+
+    df_lower_tier_schema = pd.concat(children_schemas, join = 'outer')
 
 
     return df_lower_tier_schema
 
+def get_children_schemas(locations, schema_headers, check_cache = False, cache_filename = 'schema.csv', max_workers = 8):
+    '''Get the children schema of each of the input schema locations. Requests are sent concurrently and 
+    the results are returned in the order of the input locations, regardless of which request finishes first.
+
+    Args:
+        locations (list of str): The urls of the schema items to get the children schema of
+        schema_headers (dict): The headers to use in the html request to the stat-xplore API.
+
+    Kwargs:
+        check_cache (bool): Default False. Check local directory for schema details.
+        cache_filename (str): Default 'schema.csv'. The filename of the cached schema details to check for.
+        max_workers (int): Default 8. The number of children schemas to request concurrently.
+
+    Returns:
+        list of dict: The result of get_children_schema_of_url for each location
+    '''
+    def get_children(location):
+        return get_children_schema_of_url(location, schema_headers, check_cache, cache_filename)
+
+    if max_workers > 1 and len(locations) > 1:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            return list(executor.map(stat_xplore_metrics.in_current_stage(get_children), locations))
+    else:
+        return [get_children(location) for location in locations]
+
+def refresh_schema(schema_headers, types_to_include = ["FOLDER","DATABASE","MEASURE","FIELD"], schema_filename = 'schema.csv', trust_unchanged_types = [], max_workers = 8):
+    '''Update the cached schema, only re-crawling the parts of the schema tree that are new or have changed.
+
+    The schema tree is walked from the root folder as in get_full_schema. Each cached schema item is checked 
+    with a conditional request using the ETag and Last-Modified values saved from the previous refresh. 
+    If the API reports the item is not modified, or the ids, labels and types of its children match the cached children, 
+    the cached children are kept. New and changed items are crawled as normal and removed items are dropped.
+    Every item is checked by default. Items of the types in trust_unchanged_types that are unchanged instead keep their
+    whole cached sub tree without checking it, so fewer requests are made, but changes inside the sub tree are missed.
+
+    The refresh holds the same lock as get_full_schema, so a refresh and a crawl of the same schema file don't write it
+    at once. If there is no cached schema a full crawl is done with get_full_schema.
+
+    Args:
+        schema_headers (dict): The headers to use in the html request to the stat-xplore API.
+
+    Kwargs:
+        types_to_include (list of str): Defaults to ["FOLDER","DATABASE","MEASURE","FIELD"]. 
+            The schema element types to include in the schema dataframe
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema to refresh
+        trust_unchanged_types (list of str): Defaults to []. The schema element types whose sub tree is reused from the cache
+            without checking when the element itself is unchanged, eg ["DATABASE"]. By default every item is checked.
+        max_workers (int): Default 8. The number of schema requests to send to the API concurrently.
+
+    Returns:
+        pandas DataFrame: The refreshed schema
+    '''
+    with get_schema_crawl_lock(schema_filename):
+        if os.path.exists(schema_filename) == True:
+            return refresh_cached_schema(schema_headers, types_to_include, schema_filename, trust_unchanged_types, max_workers)
+
+    return get_full_schema(schema_headers, types_to_include = types_to_include, schema_filename = schema_filename, max_workers = max_workers)
+
+def refresh_cached_schema(schema_headers, types_to_include, schema_filename, trust_unchanged_types, max_workers):
+    '''Refresh a cached schema, see refresh_schema. Call with the schema crawl lock held.
+
+    Returns:
+        pandas DataFrame: The refreshed schema. None if the root folder could not be requested.
+    '''
+    schema_store = load_schema_store(schema_filename)
+    validators_filename = get_validators_filename(schema_filename)
+    validators = load_validators(validators_filename)
+
+    # Check the root folder
+    root_result = check_schema_location(schema_url, schema_headers, schema_store, validators)
+    if root_result['success'] == False:
+        return
+    if root_result['item'] is not None:
+        df_full_schema = pd.DataFrame([root_result['item']])
+    else:
+        df_full_schema = schema_store['schema'].loc[ schema_store['schema']['location'] == schema_url, ['id', 'type', 'label', 'location']]
+
+    schema_tiers = [df_full_schema, root_result['schema']]
+    n_requests = 1
+    n_changed = int(root_result['changed'])
+
+    # Each tier is a list of (schema item, trusted) pairs. Children of trusted items are taken from the cache without a request
+    still_to_check = [(child, False) for child in root_result['schema'].to_dict('records') if child['type'] in types_to_include]
+    while len(still_to_check) > 0:
+
+        def check_item(item_trusted):
+            item, trusted = item_trusted
+            if trusted:
+                return {'success':True, 'schema':schema_store['children_by_parent_id'].get(item['id'], pd.DataFrame()), 'changed':False, 'requested':False}
+            return check_schema_location(item['location'], schema_headers, schema_store, validators)
+
+        with ThreadPoolExecutor(max_workers = max(max_workers, 1)) as executor:
+            check_results = list(executor.map(stat_xplore_metrics.in_current_stage(check_item), still_to_check))
+
+        next_to_check = []
+        for (item, trusted), check_result in zip(still_to_check, check_results):
+            if check_result['success'] == False:
+                print('Faield to get children schema for location {}'.format(item['location']))
+                continue
+            n_requests += int(check_result['requested'])
+            n_changed += int(check_result['changed'])
+
+            df_children = check_result['schema']
+            schema_tiers.append(df_children)
+
+            # The sub tree of an unchanged item is trusted if it is one of the trusted types
+            children_trusted = trusted or ((check_result['changed'] == False) and (item['type'] in trust_unchanged_types))
+            if len(df_children) > 0:
+                next_to_check += [(child, children_trusted) for child in df_children.to_dict('records') if child['type'] in types_to_include]
+
+        still_to_check = next_to_check
+
+    schema_tiers = [df for df in schema_tiers if len(df) > 0]
+    df_full_schema = pd.concat(schema_tiers, join = 'outer')
+
+    print('Schema refresh made {} requests. {} schema items were new or changed.'.format(n_requests, n_changed))
+
+    # Save the refreshed schema and the validators to use in the next refresh
+    df_full_schema.to_csv(schema_filename, index=False, encoding = 'utf-8')
+    clear_schema_store(schema_filename)
+    write_json(validators_filename, validators)
+
+    return df_full_schema
+
+def check_schema_location(url, schema_headers, schema_store, validators):
+    '''Check whether the schema item at the input url has changed from its cached version. A conditional request is made 
+    using the ETag and Last-Modified values recorded for the url. The validators dictionary is updated with the values of the response.
+
+    Args:
+        url (str): The url of the schema item to check.
+        schema_headers (dict): The headers to use in the html request to the stat-xplore API.
+        schema_store (dict): The indexed cached schema, as returned by load_schema_store
+        validators (dict): The ETag and Last-Modified values of each url, as returned by load_validators
+
+    Returns:
+        dict: Dictionary with the following items: 'success' - bool; 'schema' - DataFrame of the schema of the children of the item; 
+            'changed' - bool, True if the item is new or its children have changed; 'item' - dict of the item's own schema, None if not modified;
+            'requested' - bool, True if a request was sent to the API
+    '''
+    output = {'success':False, 'schema':None, 'changed':True, 'item':None, 'requested':True}
+
+    # Look up the cached children of the url
+    parent_id = schema_store['id_by_location'].get(url)
+    df_cached_children = schema_store['children_by_parent_id'].get(parent_id)
+
+    request_headers = dict(schema_headers)
+    url_validators = validators.get(url, {})
+    if df_cached_children is not None:
+        if 'etag' in url_validators:
+            request_headers['If-None-Match'] = url_validators['etag']
+        if 'last_modified' in url_validators:
+            request_headers['If-Modified-Since'] = url_validators['last_modified']
+
+    schema_response = request_schema(request_headers, url = url)
+    if schema_response['success'] == False:
+        return output
+
+    response = schema_response['response']
+    if response.status_code == 304:
+        return {'success':True, 'schema':df_cached_children, 'changed':False, 'item':None, 'requested':True}
+
+    # Record validators to use in the next refresh
+    url_validators = {}
+    if 'ETag' in response.headers:
+        url_validators['etag'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        url_validators['last_modified'] = response.headers['Last-Modified']
+    validators[url] = url_validators
+
+    schema_response_json = response.json()
+    df_children = pd.DataFrame(schema_response_json['children'])
+    df_children['parent_id'] = schema_response_json['id']
+    del schema_response_json['children']
+
+    # Compare the children with the cached children. A child that is relabelled or changes type is a change, as well as added and removed children
+    if df_cached_children is not None:
+        if get_children_keys(df_cached_children) == get_children_keys(df_children):
+            return {'success':True, 'schema':df_cached_children, 'changed':False, 'item':schema_response_json, 'requested':True}
+
+    return {'success':True, 'schema':df_children, 'changed':True, 'item':schema_response_json, 'requested':True}
+
+def get_children_keys(df_children):
+    '''Get the id, label and type of each child of a schema item, to compare cached children with requested children.
+
+    Args:
+        df_children (pandas DataFrame): The schema of the children
+
+    Returns:
+        list of tuple: The (id, label, type) of each child, in order
+    '''
+    if len(df_children) == 0:
+        return []
+    return list(zip(df_children['id'], df_children['label'], df_children['type']))
+
+def get_validators_filename(schema_filename):
+    '''Get the filename of the ETag and Last-Modified values recorded for a cached schema file.
+
+    Args:
+        schema_filename (str): The filename of the cached schema
+
+    Returns:
+        str: The validators filename, eg 'schema_validators.json' for 'schema.csv'
+    '''
+    return os.path.splitext(schema_filename)[0] + '_validators.json'
+
+def load_validators(validators_filename):
+    '''Load the ETag and Last-Modified values recorded for each schema url. Returns an empty dictionary if there is no file.
+
+    Args:
+        validators_filename (str): The filename of the validators json
+
+    Returns:
+        dict: url as keys, dict of 'etag' and 'last_modified' values as values
+    '''
+    if os.path.exists(validators_filename) == False:
+        return {}
+    with open(validators_filename, 'r') as f:
+        return json.load(f)
+
 def get_children_schema_of_url(url, schema_headers, check_cache = False, cache_filename = 'schema.csv'):
     '''Given a url of a Stat-xplore schema item, get the schema details of the children (component) items. 
     The schema for each chils contains id, label, location(url) and type fields.The id of the parent element 
@@ -102,15 +538,16 @@ def get_children_schema_of_url(url, schema_headers, check_cache = False, cache_f
     if (check_cache == True) & (os.path.exists(cache_filename) == True):
 
         try:
-            df_full_schema = pd.read_csv(cache_filename, encoding = 'utf-8')
-            parent_id = df_full_schema.loc[ df_full_schema['location'] == url, 'id'].values[0]
-            df_schema = df_full_schema.loc[df_full_schema['parent_id'] == parent_id]
+            schema_store = load_schema_store(cache_filename)
+            parent_id = schema_store['id_by_location'][url]
+            df_schema = schema_store['children_by_parent_id'][parent_id]
             assert len(df_schema) != 0
 
+            stat_xplore_metrics.record_cache('schema_cache', True, url = url)
             return {'success':True,'schema':df_schema, 'from_cache':True}
-        except Exception as err:
-            print(err)
-            print('Unable to load cached schema. Requesting from API instead.')
+        except Exception:
+            print('Unable to load cached schema for url {}. Requesting from API instead.'.format(url))
+            stat_xplore_metrics.record_cache('schema_cache', False, url = url)
             df_schema = pd.DataFrame()
     else:
         df_schema = pd.DataFrame()
@@ -134,26 +571,77 @@ def get_children_schema_of_url(url, schema_headers, check_cache = False, cache_f
 
     return {'success':True,'schema':df_schema, 'from_cache':False}
 
-def request_schema(schema_headers, url = schema_url):
-    '''Send request for schema to API. Check request was successful.
+def load_schema_store(cache_filename = 'schema.csv'):
+    '''Load a cached schema csv and index it so that schema items can be looked up without scanning the 
+    whole schema. The indexed schema is kept in memory and reused by later calls with the same filename,
+    unless the file has been modified since it was loaded.
+
+    Kwargs:
+        cache_filename (str): Default 'schema.csv'. The filename of the cached schema
+
+    Returns:
+        dict: Dictionary with the following items: 'schema' - the cached schema DataFrame; 'id_by_location' - dict of 
+            schema item location to id; 'location_by_id' - dict of schema item id to location;
+            'children_by_parent_id' - dict of parent id to a DataFrame of the schema of its children;
+            'tree' - a stat_xplore_schema_tree.SchemaTree of the schema
+    '''
+    modified_time = os.path.getmtime(cache_filename)
+
+    with schema_stores_lock:
+        schema_store = schema_stores.get(cache_filename)
+        if (schema_store is not None) and (schema_store['modified_time'] == modified_time):
+            return schema_store
+
+        df_full_schema = pd.read_csv(cache_filename, encoding = 'utf-8')
+
+        schema_store = {'modified_time':modified_time,
+                        'schema':df_full_schema,
+                        'id_by_location':dict(zip(df_full_schema['location'], df_full_schema['id'])),
+                        'location_by_id':dict(zip(df_full_schema['id'], df_full_schema['location'])),
+                        'children_by_parent_id':{parent_id:df_children for parent_id, df_children in df_full_schema.groupby('parent_id', sort = False)},
+                        'tree':stat_xplore_schema_tree.SchemaTree.from_dataframe(df_full_schema)}
+
+        schema_stores[cache_filename] = schema_store
+
+    return schema_store
+
+def clear_schema_store(cache_filename = None):
+    '''Remove an indexed cached schema from memory so that it is read from file again when next used.
+
+    Kwargs:
+        cache_filename (str, None): Default None. The filename of the cached schema to remove. If None all cached schemas are removed.
+    '''
+    with schema_stores_lock:
+        if cache_filename is None:
+            schema_stores.clear()
+        else:
+            schema_stores.pop(cache_filename, None)
+
+def request_schema(schema_headers, url = None):
+    '''Send request for schema to API using the shared Stat-Xplore client. Check request was successful.
 
     Args:
-        url (str): The url of the request.
         schema_headers (dict): The headers of the request.
+
+    Kwargs:
+        url (str, None): Default None. The url of the request. If None the root folder of the schema, at schema_url, is requested.
     '''
-    schema_response = requests.get(url, headers = schema_headers)
+    url = schema_url if url is None else url
 
-    # Check that request was successful. If not print message and exit.
-    if schema_response.raise_for_status() is not None:
+    try:
+        schema_response = stat_xplore_client.get(url, headers = schema_headers)
+        schema_response.raise_for_status()
+    except requests.RequestException as err:
+        # Check that request was successful. If not print message and exit.
         print("Unsuccessful request to url:{}\nCheck url and API key.".format(url))
-        print("Response status:\n{}".format(schema_response.raise_for_status()))
+        print("Response status:\n{}".format(err))
         return {'success':False, 'response':None}
-    else:
-        return {'success':True, 'response':schema_response}
+
+    return {'success':True, 'response':schema_response}
 
 
 # Functions for getting recodes for a database item
-def geography_recodes_for_geog_folder_geog_level(schema_headers, database_id, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', df_schema = None, check_cache = False, schema_filename = 'schema.csv'):
+def geography_recodes_for_geog_folder_geog_level(schema_headers, database_id, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', df_schema = None, check_cache = False, schema_filename = 'schema.csv', recode_cache_ttl = None):
     '''Get the geography recodes (geographic codes with additional formatting specifying which databse they refer to)
     for a given database (for example 'CA_In_Payment' ). Recodes can be used to request data for specific geographies, eg 
     all local authorities.
@@ -163,38 +651,174 @@ def geography_recodes_for_geog_folder_geog_level(schema_headers, database_id, ge
         database_id (str): The database id to get recode for
 
     Kwargs:
-        df_schema (pandas DataFrame, None): Default None. The schema. If None, the required schema elements are erquested from the API
+        df_schema (pandas DataFrame, SchemaTree, None): Default None. The schema. If None, the required schema elements are erquested from the API
         geog_folder_label (str): Default 'Geography (residence-based)'. The geography folder label containing the geography recodes
         geog_field_label (str): Default 'National - Regional - LA - OAs'. The geography field label, eg 'National - Regional - LA - OAs'
         geog_level_label (str): Defaukt 'Local Authority'. The geographic level label to get recodes for (eg lcoal authority or LSOA)
-        df_schema (pandas DataFrame, None): Default None. The stat-xplore schema
-        check_cache (bool): Default 'schema.csv'. Default False. Set whether to check the cached schema csv for schema information
-        cache_filename (str): The filename of the chached schema
+        check_cache (bool): Default 'schema.csv'. Default False. Set whether to check the cached schema csv for schema information,
+            and the cached recodes for the geography recodes
+        cache_filename (str): The filename of the chached schema. Recodes are cached in a json file alongside it, see get_recode_cache_filename
+        recode_cache_ttl (int, None): Default None. The age in seconds after which cached recodes are requested from the API again.
+            If None default_recode_cache_ttl, 30 days, is used.
 
     Returns:
-        dict: key is str id of the geography field. Value is list of str geography field values
+        dict: key is str id of the geography field. Value is list of str geography field values, or None if they could not be requested
     '''
 
     # Check if schema was passed in. If not get schema
-    if df_schema is None:
-        df_schema = get_full_schema(schema_headers, check_cache = check_cache, schema_filename = schema_filename)
+    schema_tree = get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename)
+
+    geog_field_id, geog_field_valueset_loc = get_geography_valueset_location(schema_tree, database_id, geog_folder_label, geog_field_label, geog_level_label)
+
+    # Call function to get recodes given a valueset location
+    geog_recodes = get_valueset_recodes(schema_headers, geog_field_valueset_loc, check_cache = check_cache, recode_cache_filename = get_recode_cache_filename(schema_filename), recode_cache_ttl = recode_cache_ttl)
+
+    return {geog_field_id:geog_recodes}
+
+
+def get_geography_valueset_location(df_schema, database_id, geog_folder_label, geog_field_label, geog_level_label):
+    '''Use the schema to find the geography field of a database and the location of the valueset of a geography level.
 
-    # Get the id of the geog folder requested
-    geog_folder_id = df_schema.loc[(df_schema['parent_id'] == database_id) & (df_schema['label'] == geog_folder_label), 'id'].values[0]
+    Args:
+        df_schema (pandas DataFrame or SchemaTree): The stat-xplore schema
+        database_id (str): The database id to get the geography valueset for
+        geog_folder_label (str): The geography folder label containing the geography recodes
+        geog_field_label (str): The geography field label, eg 'National - Regional - LA - OAs'
+        geog_level_label (str): The geographic level label (eg lcoal authority or LSOA)
 
-    # Get id of the geography recodes folder
-    geog_field_id = df_schema.loc[ (df_schema['parent_id'] == geog_folder_id) & (df_schema['label'] == geog_field_label), 'id'].values[0]
+    Returns:
+        tuple of str: The geography field id and the location of the geography level valueset
+    '''
+    schema_tree = get_schema_tree(df_schema = df_schema)
+
+    # Walk from the database to the geog folder requested, then the geography field
+    geog_field = schema_tree.resolve(database_id, [geog_folder_label, geog_field_label])
 
     # Get location of the value set of geography recodes
     # here we sectect which geographic level we want (eg, OA, LA, LSOA, etc), and the according valueset location is returned.
-    geog_field_valueset_loc = df_schema.loc[ (df_schema['parent_id'] == geog_field_id) & (df_schema['label'] == geog_level_label), 'location'].values[0]
+    geog_field_valueset_loc = schema_tree.resolve(geog_field.id, [geog_level_label]).location
 
+    return geog_field.id, geog_field_valueset_loc
 
-    # Call function to get recodes given a valueset location
-    geog_recodes = get_recodes_from_valueset_location_all_pages(schema_headers, geog_field_valueset_loc)
+def get_valueset_recodes(schema_headers, valueset_url, check_cache = False, recode_cache_filename = 'schema_recodes.json', recode_cache_ttl = None):
+    '''Get the recodes of a valueset, from the recode cache if it has recodes for the valueset url that are newer than the
+    cache time to live. Otherwise the recodes are requested from the API and saved in the cache.
 
-    return {geog_field_id:geog_recodes}
+    Args:
+        schema_headers (dict): The headers of the request.
+        valueset_url (str): Location of the valueset to return recodes from
 
+    Kwargs:
+        check_cache (bool): Default False. Set whether to check and update the recode cache
+        recode_cache_filename (str): Default 'schema_recodes.json'. The filename of the recode cache
+        recode_cache_ttl (int, None): Default None. The age in seconds after which cached recodes are requested from the API again.
+            If None default_recode_cache_ttl, 30 days, is used.
+
+    Returns:
+        list of str: List of all recode IDs. None if the recodes could not be requested.
+    '''
+    if check_cache == True:
+        cached_recodes = get_cached_valueset_recodes(recode_cache_filename, valueset_url, recode_cache_ttl = recode_cache_ttl)
+        if cached_recodes is not None:
+            return cached_recodes
+
+    with stat_xplore_metrics.time_stage('valueset_recodes', url = valueset_url) as event:
+        recodes = get_recodes_from_valueset_location_all_pages(schema_headers, valueset_url)
+        if recodes is None:
+            event['error'] = 'Unable to get all pages of recodes'
+            return None
+        event['recodes'] = len(recodes)
+
+    # Only complete recodes reach here, a fetch that failed part way through returns None above
+    if check_cache == True:
+        cache_valueset_recodes(recode_cache_filename, valueset_url, recodes)
+
+    return recodes
+
+def get_cached_valueset_recodes(recode_cache_filename, valueset_url, recode_cache_ttl = None):
+    '''Get the cached recodes of a valueset, if they are newer than the cache time to live.
+
+    Args:
+        recode_cache_filename (str): The filename of the recode cache
+        valueset_url (str): Location of the valueset
+
+    Kwargs:
+        recode_cache_ttl (int, None): Default None. The age in seconds after which cached recodes are not used.
+            If None default_recode_cache_ttl, 30 days, is used.
+
+    Returns:
+        list of str: The recode IDs. None if the recodes are not cached or are too old.
+    '''
+    if recode_cache_ttl is None:
+        recode_cache_ttl = default_recode_cache_ttl
+
+    cached_recodes = load_recode_cache(recode_cache_filename).get(valueset_url)
+    is_fresh = (cached_recodes is not None) and (time.time() - cached_recodes['fetched'] < recode_cache_ttl)
+    stat_xplore_metrics.record_cache('recode_cache', is_fresh, url = valueset_url)
+    return cached_recodes['recodes'] if is_fresh else None
+
+def cache_valueset_recodes(recode_cache_filename, valueset_url, recodes):
+    '''Save the complete recodes of a valueset to the recode cache. Empty recodes are not cached.
+
+    Args:
+        recode_cache_filename (str): The filename of the recode cache
+        valueset_url (str): Location of the valueset
+        recodes (list of str): The recode IDs
+    '''
+    if len(recodes) == 0:
+        return
+
+    recode_cache = load_recode_cache(recode_cache_filename)
+    with recode_caches_lock:
+        recode_cache[valueset_url] = {'recodes':recodes, 'fetched':time.time()}
+        write_json(recode_cache_filename, recode_cache)
+
+def get_recode_cache_filename(schema_filename):
+    '''Get the filename of the recode cache kept alongside a cached schema file.
+
+    Args:
+        schema_filename (str): The filename of the cached schema
+
+    Returns:
+        str: The recode cache filename, eg 'schema_recodes.json' for 'schema.csv'
+    '''
+    return os.path.splitext(schema_filename)[0] + '_recodes.json'
+
+def load_recode_cache(recode_cache_filename):
+    '''Load the recode cache. The cache is a dictionary of valueset url to a dictionary with keys 'recodes' - the list 
+    of recode IDs, and 'fetched' - the time the recodes were requested. The cache is read from file once per process.
+
+    Args:
+        recode_cache_filename (str): The filename of the recode cache
+
+    Returns:
+        dict: The recode cache. Empty if there is no cache file
+    '''
+    with recode_caches_lock:
+        if recode_cache_filename not in recode_caches:
+            if os.path.exists(recode_cache_filename):
+                with open(recode_cache_filename, 'r') as f:
+                    recode_caches[recode_cache_filename] = json.load(f)
+            else:
+                recode_caches[recode_cache_filename] = {}
+        return recode_caches[recode_cache_filename]
+
+def invalidate_recode_cache(recode_cache_filename, valueset_url = None):
+    '''Remove cached recodes so that they are requested from the API when next used.
+
+    Args:
+        recode_cache_filename (str): The filename of the recode cache
+
+    Kwargs:
+        valueset_url (str, None): Default None. The valueset url to remove recodes for. If None all cached recodes are removed.
+    '''
+    recode_cache = load_recode_cache(recode_cache_filename)
+    with recode_caches_lock:
+        if valueset_url is None:
+            recode_cache.clear()
+        else:
+            recode_cache.pop(valueset_url, None)
+        write_json(recode_cache_filename, recode_cache)
 
 def get_recodes_from_valueset_location_single_page(schema_headers, valueset_url):
     '''Query the API schema to get the set of recodes that are located within the input valueset url.
@@ -205,9 +829,11 @@ def get_recodes_from_valueset_location_single_page(schema_headers, valueset_url)
 
     Returns:
         dict: Keys: 'recodes' - list of string recode IDs, 'next_page_url' - the url of the next page. None if there isn't one.
+            'last_page_url' - the url of the last page. None if the API does not give it.
     '''
-    # initialise next page url
+    # initialise next and last page urls
     next_page_url = None
+    last_page_url = None
 
     # request the valueset json
     dict_valueset_response = request_schema(schema_headers, url = valueset_url)
@@ -223,31 +849,179 @@ def get_recodes_from_valueset_location_single_page(schema_headers, valueset_url)
 
     # check for multiple pages of recodes. if there are multiple pages scrape each of these
     if 'link' in dict_valueset_response['response'].headers:
-        next_page_url = get_next_page_url(dict_valueset_response['response'].headers)
+        links = parse_link_header(dict_valueset_response['response'].headers)
+        next_page_url = links.get('next')
+        last_page_url = links.get('last')
 
-    return {'recodes':recodes, 'next_page_url':next_page_url}
+    return {'recodes':recodes, 'next_page_url':next_page_url, 'last_page_url':last_page_url}
 
-def get_recodes_from_valueset_location_all_pages(schema_headers, valueset_first_page_url):
+def get_recodes_from_valueset_location_all_pages(schema_headers, valueset_first_page_url, max_workers = 8):
     '''Scrape recodes from multiple pages of the API. Scrape the recode IDs from the first page of the valueset.
     Check for multiple pages and scrape the recode IDs from themas well.
 
+    Where the page urls contain a page number (or offset) query parameter, the remaining page urls are generated 
+    from the first pages and requested concurrently, up to max_workers at a time. Otherwise each page is requested 
+    in turn by following the link to the next page. Recodes are returned in page order either way.
+
     Args:
         schema_headers (dict): The headers of the request.
         valueset_first_page_url (str): Localtion of the valueset first page to return recodes from
 
+    Kwargs:
+        max_workers (int): Default 8. The maximum number of pages to request concurrently. Set to 1 to request pages one after another.
+
     Returns:
-        list of str: List of all recode IDs
+        list of str: List of all recode IDs. None if any page could not be requested, so that a partial list of recodes is never used.
 
     '''
 
-    all_recodes = []
-    next_page_url = valueset_first_page_url
+    dict_get_recodes = get_recodes_from_valueset_location_single_page(schema_headers, valueset_first_page_url)
+    if dict_get_recodes is None:
+        print('Failed to get recodes from valueset location {}'.format(valueset_first_page_url))
+        return None
+    all_recodes = list(dict_get_recodes['recodes'])
+    next_page_url = dict_get_recodes['next_page_url']
+    if next_page_url is None:
+        return all_recodes
+
+    # Find the query parameter that sets the page and how much it increases by from one page to the next
+    page_param = get_page_query_parameter(next_page_url)
+    if (max_workers > 1) and (page_param is not None):
+        first_page_number = get_query_parameter_value(valueset_first_page_url, page_param)
+        if first_page_number is None:
+            # The first page url doesn't include the page parameter, get the second page to find the step between pages
+            dict_get_recodes = get_recodes_from_valueset_location_single_page(schema_headers, next_page_url)
+            if dict_get_recodes is None:
+                print('Failed to get recodes from valueset location {}'.format(next_page_url))
+                return None
+            all_recodes += dict_get_recodes['recodes']
+            if dict_get_recodes['next_page_url'] is None:
+                return all_recodes
+            first_page_number = get_query_parameter_value(next_page_url, page_param)
+            next_page_url = dict_get_recodes['next_page_url']
+
+        next_page_number = get_query_parameter_value(next_page_url, page_param)
+        page_step = next_page_number - first_page_number
+        if page_step > 0:
+            last_page_number = None
+            if dict_get_recodes['last_page_url'] is not None:
+                last_page_number = get_query_parameter_value(dict_get_recodes['last_page_url'], page_param)
+
+            page_recodes = get_recodes_from_numbered_pages(schema_headers, next_page_url, page_param, next_page_number, page_step, last_page_number, max_workers)
+            if page_recodes is None:
+                return None
+            return all_recodes + page_recodes
+
+    # Request each page in turn
     while next_page_url is not None:
         dict_get_recodes = get_recodes_from_valueset_location_single_page(schema_headers, next_page_url)
+        if dict_get_recodes is None:
+            print('Failed to get recodes from valueset location {}'.format(next_page_url))
+            return None
         all_recodes += dict_get_recodes['recodes']
         next_page_url = dict_get_recodes['next_page_url']
     return all_recodes
 
+def get_recodes_from_numbered_pages(schema_headers, page_url, page_param, page_number, page_step, last_page_number = None, max_workers = 8):
+    '''Request pages of recodes concurrently by setting the page query parameter of the page url. If the last page number 
+    is known all remaining pages are requested, up to max_workers at a time. Otherwise pages are requested in batches 
+    of max_workers until a page without a link to a next page is reached.
+
+    Args:
+        schema_headers (dict): The headers of the request.
+        page_url (str): The url of the first page to request
+        page_param (str): The name of the query parameter that sets the page
+        page_number (int): The value of the page query parameter of the first page to request
+        page_step (int): The increase in the page query parameter from one page to the next
+
+    Kwargs:
+        last_page_number (int, None): Default None. The value of the page query parameter of the last page, if known
+        max_workers (int): Default 8. The maximum number of pages to request concurrently.
+
+    Returns:
+        list of str: List of the recode IDs of the requested pages, in page order. None if a page could not be requested,
+            even when retried on its own.
+    '''
+    def get_page(url):
+        try:
+            return get_recodes_from_valueset_location_single_page(schema_headers, url)
+        except requests.RequestException:
+            # Requests for pages past the last page may fail, these are not needed
+            return None
+
+    all_recodes = []
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        while True:
+            if last_page_number is not None:
+                page_numbers = range(page_number, last_page_number + 1, page_step)
+            else:
+                page_numbers = range(page_number, page_number + max_workers*page_step, page_step)
+            page_urls = [set_query_parameter_value(page_url, page_param, n) for n in page_numbers]
+
+            for url, dict_get_recodes in zip(page_urls, executor.map(stat_xplore_metrics.in_current_stage(get_page), page_urls)):
+                if dict_get_recodes is None:
+                    # Retry the page on its own so that a failed page is not skipped
+                    dict_get_recodes = get_recodes_from_valueset_location_single_page(schema_headers, url)
+                    if dict_get_recodes is None:
+                        print('Failed to get recodes from valueset location {}'.format(url))
+                        return None
+                all_recodes += dict_get_recodes['recodes']
+                if dict_get_recodes['next_page_url'] is None:
+                    return all_recodes
+
+            if last_page_number is not None:
+                return all_recodes
+            page_number += max_workers*page_step
+
+def get_page_query_parameter(page_url):
+    '''Find the name of the query parameter that sets the page in a page url, eg 'pageNumber' in 'https://...?pageNumber=2'.
+    The page parameter must have an integer value and its name must include 'page' or 'offset'.
+
+    Args:
+        page_url (str): A url of a page of schema items
+
+    Returns:
+        str: The name of the page query parameter. None if no single parameter could be found
+    '''
+    candidates = []
+    for name, value in parse_qsl(urlparse(page_url).query):
+        lower_name = name.lower()
+        if (('page' in lower_name) or ('offset' in lower_name)) and ('size' not in lower_name) and value.isdigit():
+            candidates.append(name)
+
+    if len(candidates) != 1:
+        return None
+    return candidates[0]
+
+def get_query_parameter_value(url, param):
+    '''Get the integer value of a query parameter of a url. Returns None if the url doesn't include the parameter.'''
+    for name, value in parse_qsl(urlparse(url).query):
+        if name == param:
+            return int(value)
+    return None
+
+def set_query_parameter_value(url, param, value):
+    '''Return the input url with a query parameter set to a new value, keeping the other query parameters in order.'''
+    url_parts = urlparse(url)
+    query = [(name, str(value) if name == param else old_value) for name, old_value in parse_qsl(url_parts.query)]
+    return urlunparse(url_parts._replace(query = urlencode(query)))
+
+def parse_link_header(dict_response_headers, link_key = 'link'):
+    '''Parse the link header of a schema response into a dictionary of link relation to url, 
+    eg {'next':'https://...', 'last':'https://...'}.
+
+    Args:
+        dict_response_headers (dict): The headers of the response
+
+    Kwargs:
+        link_key (str): The header key that the links are stored under.
+
+    Returns:
+        dict: The link relation ('next', 'last' etc) as keys and the link urls as values
+    '''
+    if link_key not in dict_response_headers:
+        return {}
+    return {link['rel']:link['url'] for link in requests.utils.parse_header_links(dict_response_headers[link_key]) if 'rel' in link}
 
 def get_next_page_url(dict_response_headers, link_key = 'link'):
     '''From the repsponse object of a schema requests, get the link to the next page of the schema
@@ -260,27 +1034,12 @@ def get_next_page_url(dict_response_headers, link_key = 'link'):
     Kwargs:
         link_key (str): The header key that the link to the next page is stored under.
     '''
-    # Define regexes to check that link goes to next page and to get the link
-    regex_check_next = re.compile(r'(; rel=")(next)(")')
-    regex_get_link = re.compile(r'(^<)(.*)(>)')
-    
-
-    # Get the link
-    try:
-        link_text = dict_response_headers[link_key]
-    except KeyError as err:
+    if link_key not in dict_response_headers:
         print("stat_xplore_schema.get_next_page_url(). Failed to get link text using header key: {}".format(str(link_key)))
         return
-    
-
-    # check that the link goes to the next page, if so return the url string
-    if regex_check_next.search(link_text) is None:
-        return
-    else:
-        return regex_get_link.search(link_text).groups()[1]
-
-
 
+    # Return the url of the link to the next page, if there is one
+    return parse_link_header(dict_response_headers, link_key).get('next')
 
 
 def get_database_fields(schema_headers, database_id, df_schema = None, check_cache = False, cache_filename = 'schema.csv'):
@@ -292,18 +1051,167 @@ def get_database_fields(schema_headers, database_id, df_schema = None, check_cac
         database_id (str): The ID of the database to get fields for
 
     Kwargs:
-        df_schema (pandas DataFrame, None): Default None. The stat-xplore schema
+        df_schema (pandas DataFrame, SchemaTree, None): Default None. The stat-xplore schema
         check_cache (bool): Default False. Set whether to check the cached schema csv for schema information
         cache_filename (str): Default 'schema.csv'. The filename of the chached schema
 
     Returns:
         dict: The field labels as keys, the field ids as values
     '''
+    schema_tree = get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = cache_filename)
+
+    # Get fields beloning to parent
+    return {field.label:field.id for field in schema_tree.children(database_id, type = 'FIELD')}
+
+def get_schema_tree(schema_headers = None, df_schema = None, check_cache = False, schema_filename = 'schema.csv', lazy = False):
+    '''Get the schema as a SchemaTree, so that schema items can be looked up by id and label without scanning the schema.
+
+    Kwargs:
+        schema_headers (dict, None): Default None. The headers of the request. Only needed if the schema is requested from the API.
+        df_schema (pandas DataFrame, SchemaTree, None): Default None. The stat-xplore schema. A SchemaTree is returned as it is, 
+            and a DataFrame is converted the first time it is passed, see get_dataframe_schema_tree.
+        check_cache (bool): Default False. Set whether to use the cached schema csv if df_schema is None. A complete cached schema
+            is indexed once per process and reused. Otherwise the schema is crawled with get_full_schema.
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
+        lazy (bool): Default False. Set whether to return a LazySchemaTree, see get_lazy_schema_tree, rather than crawl the
+            whole schema when df_schema is None and there is no complete cached schema to use.
+
+    Returns:
+        SchemaTree: The schema tree
+    '''
+    if isinstance(df_schema, stat_xplore_schema_tree.SchemaTree):
+        return df_schema
 
     if df_schema is None:
-        df_schema = get_full_schema(schema_headers,check_cache = check_cache, schema_filename = cache_filename)
+        checkpoint_filename = get_checkpoint_filenames(schema_filename)[1]
+        if (check_cache == True) & (os.path.exists(schema_filename) == True) & (os.path.exists(checkpoint_filename) == False):
+            return load_schema_store(schema_filename)['tree']
 
-    # Get fields beloning to parent
-    fields_dict = df_schema.loc[ (df_schema['parent_id'] == database_id) & (df_schema['type'] == 'FIELD'), ['id', 'label']].set_index('label').to_dict()
+        if lazy == True:
+            return get_lazy_schema_tree(schema_headers, check_cache = check_cache, schema_filename = schema_filename)
+
+        df_schema = get_full_schema(schema_headers, check_cache = check_cache, schema_filename = schema_filename)
+        if df_schema is None:
+            raise ValueError('Unable to get the Stat-Xplore schema.')
+
+    return get_dataframe_schema_tree(df_schema)
+
+def get_dataframe_schema_tree(df_schema):
+    '''Get the SchemaTree of a schema DataFrame, indexing the DataFrame the first time it is looked up and reusing the
+    tree after that. The DataFrame shouldn't be modified once it has been indexed.
+
+    Args:
+        df_schema (pandas DataFrame): The stat-xplore schema
+
+    Returns:
+        SchemaTree: The schema tree
+    '''
+    key = id(df_schema)
+    with schema_trees_lock:
+        schema_tree = schema_trees.get(key)
+    if schema_tree is not None:
+        return schema_tree
+
+    schema_tree = stat_xplore_schema_tree.SchemaTree.from_dataframe(df_schema)
+    with schema_trees_lock:
+        if key not in schema_trees:
+            schema_trees[key] = schema_tree
+            weakref.finalize(df_schema, remove_dataframe_schema_tree, key)
+        return schema_trees[key]
+
+def remove_dataframe_schema_tree(key):
+    '''Drop the SchemaTree of a schema DataFrame that has been garbage collected. See get_dataframe_schema_tree.'''
+    with schema_trees_lock:
+        schema_trees.pop(key, None)
+
+def get_lazy_schema_tree(schema_headers, check_cache = False, schema_filename = 'schema.csv', cache_ttl = None):
+    '''Get a schema tree that requests schema items from the API only as they are looked up, instead of crawling the
+    whole schema first. Building the request body for a table only needs the database, its geography folder and field,
+    so only a handful of items are requested. The tree can be passed as df_schema to the table functions.
+
+    The responses are cached in a json file alongside the schema csv, see get_lazy_schema_cache_filename, so that
+    later runs can look the same items up without requests. The file is written once per lookup of the tree, or once
+    per LazySchemaTree.batch of lookups, rather than once per item.
+
+    Args:
+        schema_headers (dict): The headers of the request.
+
+    Kwargs:
+        check_cache (bool): Default False. Set whether to use and update the cached schema responses
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema. The responses are cached alongside it.
+        cache_ttl (int, None): Default None. The age in seconds after which cached schema items are requested from the API again.
+            If None default_lazy_schema_cache_ttl, 7 days, is used.
 
-    return fields_dict['id']
\ No newline at end of file
+    Returns:
+        LazySchemaTree: The schema tree
+    '''
+    if cache_ttl is None:
+        cache_ttl = default_lazy_schema_cache_ttl
+
+    # Each cached item is stored with the time it was requested. Expired items are dropped when the cache is read.
+    lazy_cache_filename = get_lazy_schema_cache_filename(schema_filename)
+    cached_items = {}
+    if (check_cache == True) and (os.path.exists(lazy_cache_filename) == True):
+        with open(lazy_cache_filename, 'r') as f:
+            cached_items = {location:cached for location, cached in json.load(f).items() if time.time() - cached.get('fetched', 0) < cache_ttl}
+    cached_items_lock = threading.Lock()
+    cache_changed = False
+
+    def get_cached_item(location):
+        with cached_items_lock:
+            cached = cached_items.get(location)
+        if check_cache == True:
+            stat_xplore_metrics.record_cache('lazy_schema_cache', cached is not None, url = location)
+        return cached['item'] if cached is not None else None
+
+    def cache_item(location, item_json):
+        nonlocal cache_changed
+        with cached_items_lock:
+            cached_items[location] = {'item':item_json, 'fetched':time.time()}
+            cache_changed = True
+
+    def fetch_item(location):
+        item_json = get_cached_item(location)
+        if item_json is not None:
+            return item_json
+
+        schema_response = request_schema(schema_headers, url = location)
+        if schema_response['success'] == False:
+            return None
+
+        item_json = get_schema_item_json(schema_response['response'].json())
+        cache_item(location, item_json)
+        return item_json
+
+    def save_items():
+        nonlocal cache_changed
+        with cached_items_lock:
+            if (check_cache == True) and (cache_changed == True):
+                write_json(lazy_cache_filename, cached_items)
+            cache_changed = False
+
+    return stat_xplore_schema_tree.LazySchemaTree(fetch_item, schema_url, save_items = save_items, get_cached_item = get_cached_item, cache_item = cache_item)
+
+def get_schema_item_json(response_json):
+    '''Keep only the schema information of a schema item and its children from the JSON data of its schema response.
+
+    Args:
+        response_json (dict): The JSON data of the schema response
+
+    Returns:
+        dict: The 'id', 'type', 'label' and 'location' of the item, and its 'children' with the same keys
+    '''
+    item_json = {key:response_json[key] for key in ['id', 'type', 'label', 'location']}
+    item_json['children'] = [{key:child[key] for key in ['id', 'type', 'label', 'location']} for child in response_json['children']]
+    return item_json
+
+def get_lazy_schema_cache_filename(schema_filename):
+    '''Get the filename of the cache of schema responses of a LazySchemaTree, kept alongside a cached schema file.
+
+    Args:
+        schema_filename (str): The filename of the cached schema csv
+
+    Returns:
+        str: The filename of the lazy schema cache json
+    '''
+    return os.path.splitext(schema_filename)[0] + '_lazy.json'
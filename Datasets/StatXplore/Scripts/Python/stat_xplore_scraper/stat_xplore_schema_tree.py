@@ -0,0 +1,299 @@
+# Tree of the Stat-Xplore schema, indexed so that schema items can be looked up without scanning the schema DataFrame
+#
+# The tree is built once from the schema DataFrame returned by the schema crawl. Each node has its children indexed by
+# id and by label, so that a path of labels, eg database -> geography folder -> geography field -> geography level, is
+# resolved with one dictionary lookup per level. The tree can be exported back to the schema DataFrame.
+#
+# A LazySchemaTree has the same interface but starts empty, and requests each schema item from the API the first time
+# it or its children are looked up, so that only the items along the paths a request needs are requested.
+import threading
+import contextlib
+import pandas as pd
+
+# The schema DataFrame columns that are node attributes
+schema_columns = ['id', 'type', 'label', 'location', 'parent_id']
+
+
+class SchemaNode:
+    '''An item of the Stat-Xplore schema, such as a folder, database, field or valueset.
+
+    Attributes:
+        id (str): The schema item id
+        type (str): The schema item type, eg 'FOLDER', 'DATABASE', 'FIELD' or 'VALUESET'
+        label (str): The schema item label
+        location (str): The url of the schema item
+        parent (SchemaNode, None): The parent item. None for the root folder.
+        children_by_id (dict): The children of the item, keyed by id
+        children_by_label (dict): The children of the item, keyed by label. Where children share a label the first is kept.
+    '''
+    __slots__ = ('id', 'type', 'label', 'location', 'parent', 'children_by_id', 'children_by_label')
+
+    def __init__(self, id, type, label, location, parent = None):
+        self.id = id
+        self.type = type
+        self.label = label
+        self.location = location
+        self.parent = parent
+        self.children_by_id = {}
+        self.children_by_label = {}
+
+    def __repr__(self):
+        return 'SchemaNode({!r}, {!r}, {!r})'.format(self.id, self.type, self.label)
+
+    def add_child(self, child):
+        '''Add a child item to the node's indexes.'''
+        child.parent = self
+        self.children_by_id[child.id] = child
+        self.children_by_label.setdefault(child.label, child)
+
+    def children(self, type = None):
+        '''Get the children of the node, in the order they were added.
+
+        Kwargs:
+            type (str, None): Default None. Only return children of this type. If None all children are returned.
+
+        Returns:
+            list of SchemaNode: The children
+        '''
+        return [child for child in self.children_by_id.values() if (type is None) or (child.type == type)]
+
+
+class SchemaTree:
+    '''The Stat-Xplore schema as a tree of SchemaNodes, indexed by id and location.
+
+    Attributes:
+        root (SchemaNode, None): The root folder. None if the schema has no item without a parent.
+        nodes_by_id (dict): All nodes keyed by id, in the order of the schema DataFrame
+        nodes_by_location (dict): All nodes keyed by location
+    '''
+    __slots__ = ('root', 'nodes_by_id', 'nodes_by_location')
+
+    def __init__(self):
+        self.root = None
+        self.nodes_by_id = {}
+        self.nodes_by_location = {}
+
+    def __len__(self):
+        return len(self.nodes_by_id)
+
+    def __contains__(self, id):
+        return id in self.nodes_by_id
+
+    @classmethod
+    def from_dataframe(cls, df_schema):
+        '''Build a schema tree from a schema DataFrame, as returned by stat_xplore_schema.get_full_schema.
+
+        Args:
+            df_schema (pandas DataFrame): The schema, with 'id', 'type', 'label', 'location' and 'parent_id' columns
+
+        Returns:
+            SchemaTree: The schema tree
+        '''
+        tree = cls()
+
+        parent_ids = df_schema['parent_id'].where(df_schema['parent_id'].notna(), None) if 'parent_id' in df_schema.columns else [None]*len(df_schema)
+        rows = zip(df_schema['id'], df_schema['type'], df_schema['label'], df_schema['location'], parent_ids)
+
+        # Nodes are created first, then linked, since a child can come before its parent in the DataFrame
+        links = []
+        for id, type, label, location, parent_id in rows:
+            if id in tree.nodes_by_id:
+                continue
+            node = SchemaNode(id, type, label, location)
+            tree.nodes_by_id[id] = node
+            tree.nodes_by_location[location] = node
+            links.append((node, parent_id))
+
+        for node, parent_id in links:
+            parent = tree.nodes_by_id.get(parent_id) if parent_id is not None else None
+            if parent is not None:
+                parent.add_child(node)
+            elif tree.root is None:
+                tree.root = node
+
+        return tree
+
+    def get(self, id):
+        '''Get a node by id. Raises a KeyError if the id is not in the schema.'''
+        return self.nodes_by_id[id]
+
+    def load_children(self, node):
+        '''Make sure the children of a node are in the tree. All children are added when the tree is built, see LazySchemaTree.'''
+        pass
+
+    def get_by_location(self, location):
+        '''Get a node by location (url). Raises a KeyError if the location is not in the schema.'''
+        return self.nodes_by_location[location]
+
+    def resolve(self, id, labels):
+        '''Follow a path of child labels from a node, eg from a database to its geography folder, geography field and
+        geography level. Each step is a single lookup, so the cost depends only on the length of the path.
+
+        Args:
+            id (str): The id of the node to start from
+            labels (list of str): The label of the child to follow at each step
+
+        Returns:
+            SchemaNode: The node at the end of the path. Raises a KeyError naming the missing label if the path does not exist.
+        '''
+        node = self.get(id)
+        for label in labels:
+            self.load_children(node)
+            if label not in node.children_by_label:
+                raise KeyError('{} has no child labelled {!r}'.format(node.id, label))
+            node = node.children_by_label[label]
+        return node
+
+    def children(self, id, type = None):
+        '''Get the children of a node by id, optionally only those of one type. See SchemaNode.children.'''
+        node = self.get(id)
+        self.load_children(node)
+        return node.children(type = type)
+
+    def to_dataframe(self):
+        '''Export the tree to a schema DataFrame, in the same shape as returned by stat_xplore_schema.get_full_schema.
+
+        Returns:
+            pandas DataFrame: The schema, with 'id', 'type', 'label', 'location' and 'parent_id' columns
+        '''
+        rows = [(node.id, node.type, node.label, node.location, node.parent.id if node.parent is not None else None) for node in self.nodes_by_id.values()]
+        return pd.DataFrame(rows, columns = schema_columns)
+
+
+class LazySchemaTree(SchemaTree):
+    '''A schema tree that requests schema items as they are looked up, rather than being built from a full crawl of the schema.
+    An item is requested the first time it is looked up by id, or the first time its children are looked up, and the
+    response adds the item and its children to the tree. Items that are never looked up are never requested.
+    Look children up with the tree's children and resolve methods, since SchemaNode.children only returns the children
+    already in the tree.
+
+    Each lookup holds the tree's lock, so an item looked up from several threads at once is only requested once.
+    save_items is called at the end of each lookup, or at the end of a batch of lookups, see batch.
+
+    Attributes:
+        fetch_item (callable): Function taking the location (url) of a schema item and returning the JSON schema data of
+            the item, with its 'children', or None if it could not be requested
+        root_location (str): The location of the root folder. Items looked up by id are requested from root_location/id.
+        save_items (callable, None): Function called with no arguments after a lookup or batch of lookups, eg to write the
+            requested items to a cache file. None if the items aren't saved.
+        get_cached_item (callable, None): Function taking the location of a schema item and returning its cached JSON schema
+            data without requesting it, or None if it is not cached. None if the items aren't cached.
+        cache_item (callable, None): Function taking the location and JSON schema data of an item requested outside of
+            fetch_item, eg with an async client, to add it to the cache. None if the items aren't cached.
+        loaded_ids (set): The ids of the items whose children have been added to the tree
+        lock (threading.RLock): Lock held while looking items up and adding them to the tree
+        batch_depth (int): The number of batches open in the thread holding the lock
+    '''
+    __slots__ = ('fetch_item', 'root_location', 'save_items', 'get_cached_item', 'cache_item', 'loaded_ids', 'lock', 'batch_depth')
+
+    def __init__(self, fetch_item, root_location, save_items = None, get_cached_item = None, cache_item = None):
+        super().__init__()
+        self.fetch_item = fetch_item
+        self.root_location = root_location
+        self.save_items = save_items
+        self.get_cached_item = get_cached_item
+        self.cache_item = cache_item
+        self.loaded_ids = set()
+        self.lock = threading.RLock()
+        self.batch_depth = 0
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Context manager holding the tree's lock for a batch of lookups, so that save_items is only called once at the end.'''
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if (self.batch_depth == 0) and (self.save_items is not None):
+                    self.save_items()
+
+    def get(self, id):
+        '''Get a node by id, requesting the item if it is not in the tree yet. Raises a KeyError if the item could not be requested.'''
+        with self.batch():
+            node = self.nodes_by_id.get(id)
+            if node is None:
+                node = self.load_item(self.root_location + '/' + id)
+            return node
+
+    def get_by_location(self, location):
+        '''Get a node by location (url), requesting the item if it is not in the tree yet. Raises a KeyError if the item could not be requested.'''
+        with self.batch():
+            node = self.nodes_by_location.get(location)
+            if node is None:
+                node = self.load_item(location)
+            return node
+
+    def get_root(self):
+        '''Get the root folder, requesting it if it is not in the tree yet.'''
+        with self.batch():
+            if self.root is None:
+                self.load_item(self.root_location)
+            return self.root
+
+    def load_children(self, node):
+        '''Request the item of a node if its children are not in the tree yet.'''
+        with self.batch():
+            if node.id not in self.loaded_ids:
+                self.load_item(node.location)
+
+    def resolve(self, id, labels):
+        '''Follow a path of child labels from a node, requesting items as needed, as a single batch. See SchemaTree.resolve.'''
+        with self.batch():
+            return super().resolve(id, labels)
+
+    def children(self, id, type = None):
+        '''Get the children of a node by id, requesting them if needed, as a single batch. See SchemaTree.children.'''
+        with self.batch():
+            return super().children(id, type = type)
+
+    def load_item(self, location):
+        '''Request a schema item and add it and its children to the tree.
+
+        Args:
+            location (str): The location (url) of the item
+
+        Returns:
+            SchemaNode: The node of the item. Raises a KeyError if the item could not be requested.
+        '''
+        with self.lock:
+            item_json = self.fetch_item(location)
+            if item_json is None:
+                raise KeyError('Unable to get the schema item at {}'.format(location))
+            return self.add_loaded_item(location, item_json)
+
+    def is_loaded(self, location):
+        '''Check whether the children of the item at a location are in the tree, so looking them up makes no request.'''
+        node = self.nodes_by_location.get(location)
+        return (node is not None) and (node.id in self.loaded_ids)
+
+    def add_loaded_item(self, location, item_json):
+        '''Add a requested schema item and its children to the tree.
+
+        Args:
+            location (str): The location (url) the item was requested from
+            item_json (dict): The JSON schema data of the item, with its 'children'
+
+        Returns:
+            SchemaNode: The node of the item
+        '''
+        with self.lock:
+            node = self.add_item(item_json)
+            if location == self.root_location:
+                self.root = node
+            if node.id not in self.loaded_ids:
+                for child_json in item_json['children']:
+                    node.add_child(self.add_item(child_json))
+                self.loaded_ids.add(node.id)
+
+        return node
+
+    def add_item(self, item_json):
+        '''Add a node for a schema item to the indexes, unless the item is already in the tree.'''
+        node = self.nodes_by_id.get(item_json['id'])
+        if node is None:
+            node = SchemaNode(item_json['id'], item_json['type'], item_json['label'], item_json['location'])
+            self.nodes_by_id[node.id] = node
+            self.nodes_by_location[node.location] = node
+        return node
@@ -0,0 +1,127 @@
+# Streaming decode of responses from the 'table' end point of the Stat-Xplore API
+#
+# Large table responses are spooled to a temporary file rather than held in memory. The field metadata is parsed
+# from the file first, which gives the shape of the cubes, then the values of each cube are parsed straight into a
+# numpy array of that shape. The nested lists of values are never built, so peak memory is about the size of the arrays.
+#
+# ijson is an optional dependency used to parse the response incrementally. Install it with 'pip install ijson'.
+# Without it the spooled response is decoded with the json module, which saves holding the raw response in memory
+# but still builds the nested lists of values.
+import json
+import tempfile
+import numpy as np
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Size of the chunks read from the response while spooling it to file, in bytes
+spool_chunk_size = 1024*1024
+
+
+def spool_response(response, chunk_size = spool_chunk_size):
+    '''Write the content of a streamed response to a temporary file, reading it in chunks.
+
+    Args:
+        response (requests Response): The response, requested with stream = True
+
+    Kwargs:
+        chunk_size (int): Default 1MB. The size of the chunks read from the response
+
+    Returns:
+        file: The temporary file, positioned at the start. The file is removed when it is closed.
+    '''
+    response_file = tempfile.TemporaryFile()
+    try:
+        for chunk in response.iter_content(chunk_size = chunk_size):
+            response_file.write(chunk)
+    except BaseException:
+        response_file.close()
+        raise
+    finally:
+        response.close()
+
+    response_file.seek(0)
+    return response_file
+
+def decode_table_response(response_file, dtype = 'float64'):
+    '''Decode a response from the Stat-Xplore API table end point from a file. The result is the same as the JSON
+    data of the response, except that the 'values' of each cube is a numpy array rather than nested lists.
+
+    Args:
+        response_file (file): A binary file of the response content
+
+    Kwargs:
+        dtype (str): Default 'float64'. The type of the cube value arrays
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point
+    '''
+    response_file.seek(0)
+    if ijson is None:
+        dict_response = json.load(response_file)
+        for cube in dict_response['cubes'].values():
+            cube['values'] = np.asarray(cube['values'], dtype = dtype)
+        return dict_response
+
+    dict_response = parse_table_metadata(response_file)
+
+    # The cubes have a dimension per field, with a position for each field item
+    cube_shape = tuple(len(field['items']) for field in dict_response['fields'])
+
+    dict_response['cubes'] = {}
+    for measure in dict_response['measures']:
+        response_file.seek(0)
+        dict_response['cubes'][measure['uri']] = {'values':read_cube_values(response_file, measure['uri'], cube_shape, dtype = dtype)}
+
+    return dict_response
+
+def parse_table_metadata(response_file):
+    '''Parse everything but the cubes from a table response file, such as the fields, measures and annotations.
+
+    Args:
+        response_file (file): A binary file of the response content, positioned at the start
+
+    Returns:
+        dict: The top level items of the response, except for 'cubes'
+    '''
+    dict_response = {}
+    key = None
+    builder = None
+    for prefix, event, value in ijson.parse(response_file):
+        if prefix == '':
+            # A new top level key, or the end of the response, finishes the value of the previous key
+            if builder is not None:
+                dict_response[key] = builder.value
+                builder = None
+            if event == 'map_key':
+                key = value
+                if key != 'cubes':
+                    builder = ijson.ObjectBuilder()
+        elif builder is not None:
+            builder.event(event, value)
+
+    return dict_response
+
+def read_cube_values(response_file, measure_uri, cube_shape, dtype = 'float64'):
+    '''Parse the values of the cube of a measure from a table response file straight into an array.
+
+    Args:
+        response_file (file): A binary file of the response content, positioned at the start
+        measure_uri (str): The uri of the measure of the cube
+        cube_shape (tuple of int): The shape of the cube, the number of items of each field
+
+    Kwargs:
+        dtype (str): Default 'float64'. The type of the array
+
+    Returns:
+        numpy array: The cube values
+    '''
+    n_values = int(np.prod(cube_shape))
+
+    # Each value is nested in a list for each dimension of the cube
+    values_prefix = 'cubes.{}.values'.format(measure_uri) + '.item' * len(cube_shape)
+    values = ijson.items(response_file, values_prefix, use_float = True)
+
+    return np.fromiter(values, dtype = dtype, count = n_values).reshape(cube_shape)
@@ -4,24 +4,207 @@ import pandas as pd
 import numpy as np 
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 import stat_xplore_schema
+import stat_xplore_client
+import stat_xplore_cache
+import stat_xplore_stream
+import stat_xplore_metrics
+import stat_xplore_cube_store
 
 table_url = 'https://stat-xplore.dwp.gov.uk/webapi/rest/v1/table'
 
 
-def json_response_to_dataframe(dict_response):
+def json_response_to_dataframe(dict_response, categorical = False, drop_zeros = False):
     '''Take input sting of JSON formatted data returned by the Stat-Xplore API table end point and 
     unpack it into a pandas dataframe. The returned dataframe is in a 'long' format with a column for each field (uri and label)
-    and a column for the data value.
+    and a column for the data value. If the data has more than one measure there is a value column for each measure, 
+    with the measure uri as the header, in place of the single 'value' column.
 
     Args:
         json_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
 
+    Kwargs:
+        categorical (bool): Default False. Set whether to return the field uri and label columns as pandas Categoricals. 
+            Categorical columns store each field item once plus an integer code per row, which is much faster to build 
+            and uses much less memory for large tables.
+        drop_zeros (bool): Default False. Set whether to drop the rows of cells that are zero or suppressed (missing) for every
+            measure, so that the size of the DataFrame depends on the number of non-zero cells. See get_sparse_cube_positions.
+
     Returns:
         pandas DataFrame: The Stat-Xplore API data formatted as a DataFrame.
     '''
 
     # Unpack field labels and uris (IDs) plus the labels and uris (IDs) of items within each field.
+    field_items, field_headers = unpack_response_fields(dict_response)
+
+    measure_uris = [measure['uri'] for measure in dict_response['measures']]
+    cubes_arrays = [np.asarray(dict_response['cubes'][measure_uri]['values']) for measure_uri in measure_uris]
+
+    return cube_to_dataframe(field_items, field_headers, measure_uris, cubes_arrays, categorical = categorical, drop_zeros = drop_zeros)
+
+def cube_to_dataframe(field_items, field_headers, measure_uris, cubes_arrays, categorical = False, drop_zeros = False):
+    '''Unpack the data arrays of each measure into a pandas dataframe in 'long' format. See json_response_to_dataframe.
+
+    Args:
+        field_items (dict): The 'uris' and 'labels' of the items of each field, as returned by unpack_response_fields
+        field_headers (dict): The 'uris' and 'labels' of the fields, as returned by unpack_response_fields
+        measure_uris (list of str): The uri of each measure
+        cubes_arrays (list of multi-dim numpy array): The data values of each measure, with a dimension per field
+
+    Kwargs:
+        categorical (bool): Default False. Set whether to return the field uri and label columns as pandas Categoricals
+        drop_zeros (bool): Default False. Set whether to drop the rows of cells that are zero or suppressed for every measure
+
+    Returns:
+        pandas DataFrame: The data formatted as a DataFrame.
+    '''
+    # Get the position of each data value along each field. All measures share the same fields, so this is only done once
+    cube_shape = cubes_arrays[0].shape
+    assert len(cube_shape) == len(field_headers['uris'])
+    if drop_zeros:
+        positions = get_sparse_cube_positions(cubes_arrays)
+        index_codes = get_sparse_index_codes(positions, cube_shape)
+    else:
+        positions = None
+        index_codes = get_cube_index_codes(cube_shape)
+
+    # Build the uri and label columns of each field from the field items, using the position of each value to index the items
+    dict_data = {}
+    with stat_xplore_metrics.time_stage('map_labels', fields = len(field_headers['uris'])):
+        for i in range(len(field_headers['uris'])):
+            assert len(field_items['uris'][i]) == cube_shape[i]
+            dict_data[field_headers['uris'][i]] = build_field_column(field_items['uris'][i], index_codes[i], categorical = categorical)
+            dict_data[field_headers['labels'][i]] = build_field_column(field_items['labels'][i], index_codes[i], categorical = categorical)
+
+    # Add the values
+    if len(measure_uris) > 1:
+        for measure_uri, cubes_array in zip(measure_uris, cubes_arrays):
+            assert cubes_array.shape == cube_shape
+            dict_data[measure_uri] = get_cube_values(cubes_array, positions)
+    else:
+        dict_data['value'] = get_cube_values(cubes_arrays[0], positions)
+
+    return pd.DataFrame(dict_data)
+
+def json_response_to_sparse(dict_response):
+    '''Take the data returned by the Stat-Xplore API table end point and convert it to a sparse, COO style, representation,
+    keeping only the cells that are not zero or suppressed (missing) for every measure. Each kept cell has its position along
+    each field and its values, so the size depends on the number of non-zero cells, not the product of the field lengths.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
+
+    Returns:
+        dict: Dictionary with the following items: 'shape' - the shape of the full cube; 'field_uris' and 'field_labels' - the
+            fields along each dimension; 'items' - dict of the 'uris' and 'labels' of the items of each field; 'coords' - a 2d
+            numpy array of integer positions with a row per field and a column per kept cell, indexing the field items;
+            'values' - dict of a numpy array of the values of the kept cells for each measure uri
+    '''
+    field_items, field_headers = unpack_response_fields(dict_response)
+
+    measure_uris = [measure['uri'] for measure in dict_response['measures']]
+    cubes_arrays = [np.asarray(dict_response['cubes'][measure_uri]['values']) for measure_uri in measure_uris]
+
+    cube_shape = cubes_arrays[0].shape
+    assert len(cube_shape) == len(field_headers['uris'])
+
+    positions = get_sparse_cube_positions(cubes_arrays)
+    coords = np.vstack(get_sparse_index_codes(positions, cube_shape)) if len(cube_shape) > 0 else np.empty((0, len(positions)), dtype = np.intp)
+
+    return {'shape':cube_shape, 'field_uris':field_headers['uris'], 'field_labels':field_headers['labels'], 'items':field_items,
+            'coords':coords, 'values':{measure_uri:get_cube_values(cubes_array, positions) for measure_uri, cubes_array in zip(measure_uris, cubes_arrays)}}
+
+def json_response_to_wide_dataframe(dict_response, row_field_ids, column_field_ids = None, item_values_to_return = 'labels'):
+    '''Take the data returned by the Stat-Xplore API table end point and reshape it into a pandas dataframe in 'wide' format,
+    eg with a row for each geography and a column for each date. The cube of values is reordered and reshaped directly
+    into the rows and columns, so the long format, with a value per row, is never built.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
+        row_field_ids (str or list of str): The field IDs of the fields to use as rows, eg the geography field. With more than
+            one row field the rows have a MultiIndex with a level for each field.
+
+    Kwargs:
+        column_field_ids (str or list of str, None): Default None. The field IDs of the fields to use as columns, in the order of
+            the column index levels. If None all fields that aren't rows are used, in the order of the data.
+        item_values_to_return (str): Default 'labels'. Set whether to index the rows and columns with the field item 'labels' or 'uris'.
+            The levels of the indexes are named with the field labels or uris to match.
+
+    Returns:
+        pandas DataFrame: The Stat-Xplore API data in wide format. If the data has more than one measure the columns have
+            an outer level of measure uris. If there are no column fields the columns are 'value', or the measure uris.
+    '''
+    if item_values_to_return not in ['labels','uris']:
+        raise ValueError("Unrecognised value type to return {}. Must be either 'labels' or 'uris'".format(item_values_to_return))
+
+    field_items, field_headers = unpack_response_fields(dict_response)
+    field_uris = field_headers['uris']
+
+    row_field_ids = [row_field_ids] if isinstance(row_field_ids, str) else list(row_field_ids)
+    if column_field_ids is None:
+        column_field_ids = [field_uri for field_uri in field_uris if field_uri not in row_field_ids]
+    column_field_ids = [column_field_ids] if isinstance(column_field_ids, str) else list(column_field_ids)
+
+    if len(row_field_ids) == 0:
+        raise ValueError('At least one row field is needed.')
+    missing_field_ids = [field_id for field_id in row_field_ids + column_field_ids if field_id not in field_uris]
+    if len(missing_field_ids) > 0:
+        raise ValueError('Fields {} are not in the data.'.format(missing_field_ids))
+    if sorted(row_field_ids + column_field_ids) != sorted(field_uris):
+        raise ValueError('Each field of the data must be either a row or a column field, once. The fields are {}'.format(field_uris))
+
+    row_axes = [field_uris.index(field_id) for field_id in row_field_ids]
+    column_axes = [field_uris.index(field_id) for field_id in column_field_ids]
+
+    measure_uris = [measure['uri'] for measure in dict_response['measures']]
+
+    # Move the row fields to the front of each cube, so that the cube flattens to a row per combination of row field items
+    values = []
+    for measure_uri in measure_uris:
+        cubes_array = np.asarray(dict_response['cubes'][measure_uri]['values'])
+        assert cubes_array.ndim == len(field_uris)
+        n_rows = int(np.prod([cubes_array.shape[axis] for axis in row_axes]))
+        values.append(cubes_array.transpose(row_axes + column_axes).reshape(n_rows, -1))
+    values = values[0] if len(values) == 1 else np.hstack(values)
+
+    index = get_wide_index([field_items[item_values_to_return][axis] for axis in row_axes], [field_headers[item_values_to_return][axis] for axis in row_axes])
+
+    column_levels = [field_items[item_values_to_return][axis] for axis in column_axes]
+    column_names = [field_headers[item_values_to_return][axis] for axis in column_axes]
+    if len(measure_uris) > 1:
+        column_levels = [measure_uris] + column_levels
+        column_names = ['measure'] + column_names
+    columns = get_wide_index(column_levels, column_names) if len(column_levels) > 0 else pd.Index(['value'])
+
+    return pd.DataFrame(values, index = index, columns = columns)
+
+def get_wide_index(levels, names):
+    '''Build the row or column index of wide data from the items of each field, with an entry for every combination of
+    items, in the order the cube is flattened. A single field gives a flat Index, like pandas pivot, otherwise a MultiIndex.
+
+    Args:
+        levels (list of list of str): The items of each field
+        names (list of str): The name of each level
+
+    Returns:
+        pandas Index or MultiIndex: The index
+    '''
+    if len(levels) == 1:
+        return pd.Index(levels[0], name = names[0])
+    return pd.MultiIndex.from_product(levels, names = names)
+
+def unpack_response_fields(dict_response):
+    '''Unpack the field labels and uris (IDs) plus the labels and uris (IDs) of the items within each field from the 
+    data returned by the Stat-Xplore API table end point.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
+
+    Returns:
+        tuple of dict: field_items - dict with keys 'labels' and 'uris', each a list with the item values of each field; 
+            field_headers - dict with keys 'labels' and 'uris', each a list with the label or uri of each field
+    '''
     field_items = { 'labels':[],
                     'uris':[]}
     field_headers = {   'labels':[],
@@ -35,80 +218,132 @@ def json_response_to_dataframe(dict_response):
         field_items['uris'].append(unpack_field_items(field['items'], item_values_to_return = 'uris'))
         field_headers['uris'].append(field['uri'])
 
-    measure_uri = dict_response['measures'][0]['uri'] 
-    cubes_array = np.array(dict_response['cubes'][ measure_uri]['values'])
+    return field_items, field_headers
 
-    # unpack the data, using the field item values' IDs to index values
-    dict_data = unpack_cube_data(field_items['uris'],field_headers['uris'], cubes_array)
-    
-    df = pd.DataFrame(dict_data)
+def build_field_column(field_values, field_codes, categorical = False):
+    '''Build a data column for a field by indexing the field item values with the position of each data value along the field.
 
-    # Add in the labels
-    final_headers = []
-    for i in range(len(field_headers['uris'])):
-        # Form lookup dictionary from uri to label
-        dict_field_lookup = dict(zip(field_items['uris'][i], field_items['labels'][i]))
+    Args:
+        field_values (list of str): The item values (uris or labels) of the field
+        field_codes (numpy array of int): The position along the field of each data value
 
-        # Create a new labels column by replacing the uris with their labels
-        df[field_headers['labels'][i]] = df[field_headers['uris'][i]].replace(dict_field_lookup)
+    Kwargs:
+        categorical (bool): Default False. Set whether to return a pandas Categorical, using the field items as categories
+            and the positions as codes, rather than an array of strings.
 
-        # Add each header to list so that they are ordered by field type
-        final_headers.append(field_headers['uris'][i])
-        final_headers.append(field_headers['labels'][i])
-    
-    # Add the value header
-    final_headers.append('value')
+    Returns:
+        numpy array or pandas Categorical: The field column
+    '''
+    if categorical == False:
+        return np.asarray(field_values, dtype = object)[field_codes]
 
-    return df.reindex(columns = final_headers)
+    # Categories must be unique. Where field items share a value (eg two items with the same label) map their codes to a single category
+    value_codes, categories = pd.factorize(np.asarray(field_values, dtype = object))
+    if len(categories) < len(field_values):
+        field_codes = value_codes[field_codes]
 
-def unpack_cube_data(labels, headers, cubes_array):
+    return pd.Categorical.from_codes(field_codes, categories = categories)
+
+def unpack_cube_data(labels, headers, cubes_array, drop_zeros = False):
     '''For input lists of the field labels and the array of data, unpak the data assigning the coorect labels to each value.
-    Function can unpack 1d,2d and 3d data arrays. THis covers all possible dimensions returned by the stat-xplore API.
-    Data is unpacked into a dictionary of tuples.
+    Function can unpack data arrays with any number of dimensions. The label columns are built by repeating and tiling
+    the labels of each field to match the order of the flattened data array, rather than looping over each value.
+    Data is unpacked into a dictionary of arrays.
 
     Args:
         labels (array of str): A 2d array containing lists of the labels to index data values with
         headers (list of str): A list of the headers for the fields data is indexed by
         cubes_array (multi-dim numpy array): The data values to unpack
 
+    Kwargs:
+        drop_zeros (bool): Default False. Set whether to drop zero and suppressed (missing) values. See get_sparse_cube_positions.
+
     Returns: 
         dict: Dictionary of the labels and the data values.
     '''
+    cube_shape = cubes_array.shape
+
+    assert len(labels) == len(cube_shape)
+    assert len(headers) == len(cube_shape)
+
+    for field_labels, dimension_length in zip(labels, cube_shape):
+        assert len(field_labels) == dimension_length
+
+    if drop_zeros:
+        positions = get_sparse_cube_positions([cubes_array])
+        index_codes = get_sparse_index_codes(positions, cube_shape)
+    else:
+        positions = None
+        index_codes = get_cube_index_codes(cube_shape)
+
     dict_data = {}
-    for header in headers:
-        dict_data[header] = []
-    dict_data['value'] = []
-
-    cube_shape = cubes_array.shape  
-
-    # Unpacking 1d
-    if len(cube_shape) == 1:
-        assert len(labels[0] == len(cubes_array[:]))
-        dict_data[headers[0]] += (labels[0])
-        dict_data['value'] += (list(cubes_array[:]))
-    # Unpacking 2d data
-    elif len(cube_shape) == 2:
-        assert len(labels[0]) == cube_shape[0]
-        assert len(labels[1]) == cube_shape[1]
-        for x in range(cube_shape[0]):
-            assert len(labels[1][:]) == len(cubes_array[x,:])
-            dict_data[headers[0]] += ([labels[0][x]]*cube_shape[1])
-            dict_data[headers[1]] += (labels[1][:])
-            dict_data['value'] += (list(cubes_array[x,:]))
-    # Unpacking 3d data
-    elif len(cube_shape) == 3:
-        assert len(labels[0]) == cube_shape[0]
-        assert len(labels[1]) == cube_shape[1]
-        assert len(labels[2]) == cube_shape[2]
-        for x in range(cube_shape[0]):
-            for y in range(cube_shape[1]):
-                assert len(labels[2][:]) == len(cubes_array[x,y,:])
-                dict_data[headers[0]] += ([labels[0][x]]*cube_shape[2])
-                dict_data[headers[1]] += ([labels[1][y]]*cube_shape[2])
-                dict_data[headers[2]] += (labels[2][:])
-                dict_data['value'] += list(cubes_array[x,y,:])
+    for header, field_labels, field_codes in zip(headers, labels, index_codes):
+        dict_data[header] = build_field_column(field_labels, field_codes)
+
+    # Flattening the data array in C order matches the order of the index codes
+    dict_data['value'] = get_cube_values(cubes_array, positions)
+
     return dict_data
 
+def get_cube_index_codes(cube_shape):
+    '''For the shape of a data array, get the position along each dimension of every value in the flattened array.
+    The position along the last dimension changes fastest, matching numpy's default (C order) flattening.
+
+    Args:
+        cube_shape (tuple of int): The shape of the data array
+
+    Returns:
+        list of numpy array: One array of integer positions per dimension, each with length equal to the size of the data array
+    '''
+    n_values = int(np.prod(cube_shape))
+    index_dtype = np.min_scalar_type(max(cube_shape, default = 0))
+
+    index_codes = []
+    for i, dimension_length in enumerate(cube_shape):
+        # Each position is repeated for every combination of the following dimensions,
+        # and the whole pattern is tiled for every combination of the preceeding dimensions
+        n_repeat = int(np.prod(cube_shape[i+1:]))
+        n_tile = n_values // (dimension_length * n_repeat) if n_values > 0 else 0
+        index_codes.append(np.tile(np.repeat(np.arange(dimension_length, dtype = index_dtype), n_repeat), n_tile))
+
+    return index_codes
+
+def get_sparse_cube_positions(cubes_arrays):
+    '''Get the positions in the flattened data arrays of the cells to keep in a sparse representation, the cells that are
+    not zero or suppressed (missing) for at least one measure. Only a boolean mask the size of the cube is built, not
+    the index codes of every cell.
+
+    Args:
+        cubes_arrays (list of multi-dim numpy array): The data values of each measure, all the same shape
+
+    Returns:
+        numpy array of int: The positions of the kept cells, in increasing (C) order
+    '''
+    keep = np.zeros(cubes_arrays[0].shape, dtype = bool)
+    for cubes_array in cubes_arrays:
+        keep |= (cubes_array != 0) & pd.notna(cubes_array)
+    return np.flatnonzero(keep)
+
+def get_sparse_index_codes(positions, cube_shape):
+    '''For positions in a flattened data array, get the position along each dimension. The sparse equivalent of
+    get_cube_index_codes.
+
+    Args:
+        positions (numpy array of int): Positions in the flattened data array, as returned by get_sparse_cube_positions
+        cube_shape (tuple of int): The shape of the data array
+
+    Returns:
+        list of numpy array: One array of integer positions per dimension, each with the same length as positions
+    '''
+    index_dtype = np.min_scalar_type(max(cube_shape, default = 0))
+    return [codes.astype(index_dtype) for codes in np.unravel_index(positions, cube_shape)]
+
+def get_cube_values(cubes_array, positions = None):
+    '''Get the values of a data array flattened in C order, only at the given positions if there are any.'''
+    if positions is None:
+        return cubes_array.ravel()
+    return cubes_array.ravel()[positions]
+
 # Could change this function to unpack both ids and labels, return multidimensional array
 def unpack_field_items(field_items, item_values_to_return = 'labels'):
     '''The Stat-Xplore API returns fie;d values as an array of arrays, ie [ [value1], [value2], ...].
@@ -138,24 +373,49 @@ def unpack_field_items(field_items, item_values_to_return = 'labels'):
     return item_values
 
 
-def get_stat_xplore_measure_data(table_headers, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority'):
+def get_stat_xplore_measure_data(table_headers, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', categorical = False, check_cache = False, schema_filename = 'schema.csv', max_cells = None, split_field_id = None, max_workers = 4, table_cache = None, stream = False, field_recodes = None, row_field_ids = None, column_field_ids = None, drop_zeros = False, cube_directory = None):
     '''For an input measure ID and field IDs as well as the labels for the geography folder, field and level to get data for 
     build that dictionary of data to send to the Stat-Xplore table end point to request data.
 
     Args:
         table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
         schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
-        measure_id (str): The id of the measure to request data for. This is the dataset, such as Attendence Allowance claimants, 
-            that data is returned for
+        measure_id (str or list of str): The id of the measure to request data for. This is the dataset, such as Attendence Allowance claimants, 
+            that data is returned for. A list of measure ids from the same database can be given to get data for all of them 
+            in a single request, in which case the data has a value column for each measure.
 
     Kwargs:
         field_ids (list of str, None): Default None. The field IDs of the fields to in intersect they data by
         fields_include_total (str or list of str): The field IDs of the fields which will include the total across all field values in the returned data.
             This cannot be the date field.
-        df_schema (pandas DataFrame, None): Default to None. A DataFrame of the Stat-Xplore schema
+        df_schema (pandas DataFrame, SchemaTree, None): Default to None. The Stat-Xplore schema, as a DataFrame or a SchemaTree.
+            Pass a SchemaTree when requesting several tables so that the schema is only indexed once. If None, only the schema
+            items needed are requested, unless there is a complete cached schema to use. See build_request_body.
         geog_folder_label (str): Defaults to 'Geography (residence-based)'. The label of the geography folder to get geography recodes from
         geog_field_label (str): Defaults tp 'National - Regional - LA - OAs'. The label of the geography field to get geography recodes from.
         geog_level_label (str): Defaults to 'Local Authority'. The label of the level (ie LAs, LSOAs etc) to get recodes for
+        categorical (bool): Default False. Set whether to return the field uri and label columns as pandas Categoricals
+        check_cache (bool): Default False. Set whether to use the cached schema and geography recodes
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema. Geography recodes are cached alongside it
+        max_cells (int, None): Default None. The maximum number of cells to request in a single table request. If the table is larger 
+            than this, the geography recodes are split into chunks that are requested concurrently and combined. See request_table_in_chunks.
+        split_field_id (str, None): Default None. The field ID of a second field, such as the date field, to split into chunks if 
+            a single geography is larger than max_cells.
+        max_workers (int): Default 4. The number of chunks to request concurrently.
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache. 
+            If given, responses to identical request bodies are read from the cache instead of requested from the API.
+        stream (bool): Default False. Set whether to stream large responses to a temporary file and decode the cube values 
+            straight into arrays, rather than decoding the whole response in memory. See request_table_stream.
+        field_recodes (dict, None): Default None. Field IDs as keys and lists of field value IDs as values, to only request data 
+            for those values of the fields, eg only some dates. The fields must also be in field_ids. See build_request_body.
+        row_field_ids (str or list of str, None): Default None. If given, the data is returned in wide format with these fields as
+            rows, eg the geography field, and the other fields as columns, reshaped straight from the cube. See json_response_to_wide_dataframe.
+        column_field_ids (str or list of str, None): Default None. The fields to use as columns of wide data, in order. If None
+            all fields that aren't rows are used. Ignored unless row_field_ids is given.
+        drop_zeros (bool): Default False. Set whether to drop the rows of cells that are zero or suppressed in long format data.
+            Ignored for wide data. See json_response_to_dataframe.
+        cube_directory (str, None): Default None. A directory to also save the data cube to, so that it can be reopened memory
+            mapped without requesting or parsing it again. See write_response_cube.
 
     Returns:
         dict: Dictionary with the following items: 'data' - a pandas Data Frame of the request data, or None if request was unsucessfull; 
@@ -164,69 +424,542 @@ def get_stat_xplore_measure_data(table_headers, schema_headers, measure_id, fiel
     '''
 
     # Build request body
-    body = build_request_body(table_headers, schema_headers, measure_id, field_ids = field_ids, fields_include_total = fields_include_total, df_schema = df_schema, geog_folder_label = geog_folder_label, geog_field_label = geog_field_label, geog_level_label = geog_level_label)
+    with stat_xplore_metrics.time_stage('build_body', measure_id = measure_id):
+        body = build_request_body(table_headers, schema_headers, measure_id, field_ids = field_ids, fields_include_total = fields_include_total, df_schema = df_schema, geog_folder_label = geog_folder_label, geog_field_label = geog_field_label, geog_level_label = geog_level_label, check_cache = check_cache, schema_filename = schema_filename, field_recodes = field_recodes)
 
     # Request data
-    response_dict = request_table(table_headers, json.dumps(body))
+    with stat_xplore_metrics.time_stage('request', measure_id = measure_id, chunked = max_cells is not None):
+        if max_cells is None:
+            json_data = request_table_json(table_headers, body, table_cache = table_cache, stream = stream)
+        else:
+            json_data = request_table_in_chunks(table_headers, body, get_geography_field_id(body), max_cells, split_field_id = split_field_id, max_workers = max_workers, table_cache = table_cache, stream = stream)
 
-    if response_dict['success'] == True:
-        json_data = response_dict['response'].json()
+    if json_data is not None:
 
         # Format data into dataframe
-        df_data = json_response_to_dataframe(json_data)
+        with stat_xplore_metrics.time_stage('unpack', measure_id = measure_id) as event:
+            if row_field_ids is None:
+                df_data = json_response_to_dataframe(json_data, categorical = categorical, drop_zeros = drop_zeros)
+            else:
+                df_data = json_response_to_wide_dataframe(json_data, row_field_ids, column_field_ids = column_field_ids)
+            event['rows'] = len(df_data)
+
+        if cube_directory is not None:
+            with stat_xplore_metrics.time_stage('store_cube', measure_id = measure_id):
+                write_response_cube(json_data, cube_directory)
 
         # Get database annotations (footnaotes)
-        database_annotation_keys = json_data['database']['annotationKeys']
-        database_annotations = {}
-        for key in database_annotation_keys:
-            database_annotations[key] = json_data['annotationMap'][key]
+        database_annotations = get_database_annotations(json_data)
 
         return {'data': df_data, 'annotations':database_annotations}
     else:
         return {'data':None, 'annotations':None}
 
+def write_response_cube(dict_response, cube_directory, dtype = 'float64'):
+    '''Write the data cube returned by the Stat-Xplore API table end point to a cube directory, so that it can be reopened
+    memory mapped with stat_xplore_cube_store.read_cube. See stat_xplore_cube_store.write_cube.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
+        cube_directory (str): The directory to write the cube to. Created if it doesn't exist. A cube already in the
+            directory is replaced.
+
+    Kwargs:
+        dtype (str): Default 'float64'. The type of the values arrays. Suppressed (missing) values are saved as NaN.
+
+    Returns:
+        dict: The cube metadata, see stat_xplore_cube_store.read_cube_metadata
+    '''
+    field_items, field_headers = unpack_response_fields(dict_response)
+    cubes_arrays = [dict_response['cubes'][measure['uri']]['values'] for measure in dict_response['measures']]
+    return stat_xplore_cube_store.write_cube(cube_directory, field_items, field_headers, dict_response['measures'], cubes_arrays,
+                                             annotations = get_database_annotations(dict_response), dtype = dtype)
+
+def stored_cube_to_dataframe(cube, categorical = False, drop_zeros = False):
+    '''Unpack a cube opened with stat_xplore_cube_store.read_cube into a pandas dataframe in 'long' format, the same as
+    json_response_to_dataframe. Select the items needed with stat_xplore_cube_store.select_cube first, to avoid reading
+    the whole of a large cube.
+
+    Args:
+        cube (dict): The cube, as returned by stat_xplore_cube_store.read_cube or select_cube
+
+    Kwargs:
+        categorical (bool): Default False. Set whether to return the field uri and label columns as pandas Categoricals
+        drop_zeros (bool): Default False. Set whether to drop the rows of cells that are zero or suppressed for every measure
+
+    Returns:
+        pandas DataFrame: The data of the cube
+    '''
+    field_headers = {'uris':cube['field_uris'], 'labels':cube['field_labels']}
+    measure_uris = list(cube['values'].keys())
+    return cube_to_dataframe(cube['items'], field_headers, measure_uris, [cube['values'][measure_uri] for measure_uri in measure_uris],
+                             categorical = categorical, drop_zeros = drop_zeros)
+
+def get_database_annotations(dict_response):
+    '''Get the database annotations (footnotes) from the data returned by the Stat-Xplore API table end point.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point
+
+    Returns:
+        dict: The annotation keys as keys and the annotation text as values
+    '''
+    database_annotation_keys = dict_response['database']['annotationKeys']
+    database_annotations = {}
+    for key in database_annotation_keys:
+        database_annotations[key] = dict_response['annotationMap'][key]
+    return database_annotations
+
+def request_table_json(table_headers, body, table_cache = None, stream = False):
+    '''Send a request body to the table end point and return the JSON data of the response.
+
+    Args:
+        table_headers (dict): The headers of the request.
+        body (dict): The request body, as returned by build_request_body
 
-def build_request_body(table_headers, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority'):
+    Kwargs:
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache.
+            If the cache has a response for the body it is used instead of sending the request. Otherwise the response is cached.
+        stream (bool): Default False. Set whether to decode the response with request_table_stream
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point. None if the request was unsuccessful.
+    '''
+    if stream == True:
+        return request_table_stream(table_headers, body, table_cache = table_cache)
+
+    if table_cache is not None:
+        content = stat_xplore_cache.get_cached_response(table_cache, body)
+        if content is not None:
+            with stat_xplore_metrics.time_stage('decode', bytes = len(content)):
+                return json.loads(content)
+
+    response_dict = request_table(table_headers, json.dumps(body))
+    if response_dict['success'] == False:
+        return None
+
+    if table_cache is not None:
+        stat_xplore_cache.cache_response(table_cache, body, response_dict['response'].content)
+
+    with stat_xplore_metrics.time_stage('decode', bytes = len(response_dict['response'].content)):
+        return response_dict['response'].json()
+
+def request_table_stream(table_headers, body, table_cache = None):
+    '''Send a request body to the table end point, streaming the response to a temporary file, and decode it from file.
+    The values of each cube are decoded straight into a numpy array rather than nested lists, so that peak memory
+    is about the size of the arrays rather than several times the size of the response. See stat_xplore_stream.
+
+    Args:
+        table_headers (dict): The headers of the request.
+        body (dict): The request body, as returned by build_request_body
+
+    Kwargs:
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache.
+            Cached responses are decoded from the cache file.
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point, with cube values as numpy arrays. 
+            None if the request was unsuccessful.
+    '''
+    if table_cache is not None:
+        cached_file = stat_xplore_cache.open_cached_response(table_cache, body)
+        if cached_file is not None:
+            with cached_file, stat_xplore_metrics.time_stage('decode', stream = True):
+                return stat_xplore_stream.decode_table_response(cached_file)
+
+    response_dict = request_table(table_headers, json.dumps(body), stream = True)
+    if response_dict['success'] == False:
+        return None
+
+    try:
+        with stat_xplore_metrics.time_stage('spool') as event:
+            response_file = stat_xplore_stream.spool_response(response_dict['response'])
+            event['bytes'] = response_file.seek(0, os.SEEK_END)
+            response_file.seek(0)
+    except requests.RequestException as err:
+        print("Unsuccessful request to url:{}\nFailed to read the response.".format(table_url))
+        print("Response status:\n{}".format(err))
+        return None
+
+    with response_file:
+        if table_cache is not None:
+            stat_xplore_cache.cache_response_file(table_cache, body, response_file)
+        with stat_xplore_metrics.time_stage('decode', stream = True, bytes = event['bytes']):
+            return stat_xplore_stream.decode_table_response(response_file)
+
+def request_table_in_chunks(table_headers, body, geog_field_id, max_cells, split_field_id = None, max_workers = 4, table_cache = None, stream = False):
+    '''Request table data in chunks so that no single request is larger than max_cells. The geography recodes are 
+    split into chunks, and if a single geography is still larger than max_cells, so is the field split_field_id 
+    (for example the date field). Chunks are requested concurrently and the returned cubes are combined into the 
+    data that would have been returned by a single request.
+
+    A first request for a single geography is used to find the number of cells per geography and the items of the 
+    other fields. This probe is skipped if the recodes of the body show that the whole table is no larger than max_cells,
+    and its response is reused if it is the whole table or one of the chunks. The geography total is not requested with each chunk, since each chunk would return the total of 
+    its own geographies. Instead it is requested separately by recoding all geographies into a single group, 
+    so that the total is still the one calculated by the API.
+
+    Args:
+        table_headers (dict): The headers of the request.
+        body (dict): The request body, as returned by build_request_body
+        geog_field_id (str): The field ID of the geography field, whose recodes are split into chunks
+        max_cells (int): The maximum number of cells to request in a single request
+
+    Kwargs:
+        split_field_id (str, None): Default None. The field ID of a second field to split into chunks if a single geography is 
+            larger than max_cells. If the field includes a total, the total is requested as its own chunk.
+        max_workers (int): Default 4. The number of chunks to request concurrently.
+        table_cache (dict, None): Default None. A table response cache created with stat_xplore_cache.create_table_cache. Each chunk is cached separately.
+        stream (bool): Default False. Set whether to decode the response of each chunk with request_table_stream
+
+    Returns:
+        dict: Dictionary of data returned by the Stat-Xpore API table end point, combined from all chunks. None if any request was unsuccessful.
+    '''
+    # Request the whole table if the recodes show it is small enough, without probing
+    n_body_cells = get_body_cube_size(body)
+    if (n_body_cells is not None) and (n_body_cells <= max_cells):
+        return request_table_json(table_headers, body, table_cache = table_cache, stream = stream)
+
+    # Request the first geography to find the number of cells per geography
+    probe_body = get_probe_body(body, geog_field_id)
+    probe_data = request_table_json(table_headers, probe_body, table_cache = table_cache, stream = stream)
+    if probe_data is None:
+        return None
+
+    chunk_plan = plan_table_chunks(body, geog_field_id, probe_data, max_cells, split_field_id = split_field_id)
+    if chunk_plan is None:
+        if probe_body is body:
+            return probe_data
+        return request_table_json(table_headers, body, table_cache = table_cache, stream = stream)
+
+    def request_chunk(chunk_body):
+        if chunk_body == probe_body:
+            return probe_data
+        return request_table_json(table_headers, chunk_body, table_cache = table_cache, stream = stream)
+
+    print('Requesting table in {} chunks.'.format(len(chunk_plan['bodies'])))
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        chunk_data = list(executor.map(stat_xplore_metrics.in_current_stage(request_chunk), chunk_plan['bodies']))
+    if any(data is None for data in chunk_data):
+        return None
+
+    return combine_table_chunks(chunk_plan, chunk_data)
+
+def plan_table_chunks(body, geog_field_id, probe_data, max_cells, split_field_id = None):
+    '''Split a request body into the bodies of chunks of no more than max_cells, using the data returned for a single 
+    geography to find the number of cells per geography. See request_table_in_chunks.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+        geog_field_id (str): The field ID of the geography field, whose recodes are split into chunks
+        probe_data (dict): The data returned by the Stat-Xplore API table end point for the first geography only
+        max_cells (int): The maximum number of cells to request in a single request
+
+    Kwargs:
+        split_field_id (str, None): Default None. The field ID of a second field to split into chunks if a single geography is 
+            larger than max_cells.
+
+    Returns:
+        dict: Dictionary with the following items: 'bodies' - the request bodies of the chunks, ordered by geography chunk 
+            then split field chunk; 'geog_field_id'; 'split_field_id'; 'n_split_chunks' - the number of chunks of the split 
+            field per geography chunk; 'geog_include_total' - whether the last geography chunk is the geography total; 
+            'split_include_total' - whether the last split field chunk of each geography chunk is the split field total.
+            None if the whole table is no larger than max_cells.
+    '''
+    if (split_field_id is not None) and (split_field_id not in get_dimension_field_ids(body)):
+        print('Field {} is not a dimension of the request so cannot be split.'.format(split_field_id))
+        split_field_id = None
+
+    geog_items = body['recodes'][geog_field_id]['map']
+    geog_include_total = body['recodes'][geog_field_id].get('total', False)
+
+    cells_per_geog = get_cube_size(probe_data)
+
+    n_geog_items = len(geog_items) + int(geog_include_total)
+    if cells_per_geog * n_geog_items <= max_cells:
+        return None
+
+    # Split the second field if a single geography has too many cells
+    split_chunks = [None]
+    split_include_total = False
+    if (cells_per_geog > max_cells) and (split_field_id is not None):
+        split_field_items = get_response_field(probe_data, split_field_id)['items']
+        split_field_groups = [item['uris'] for item in split_field_items if item['type'] != 'Total']
+        split_include_total = len(split_field_groups) < len(split_field_items)
+        cells_per_split_item = max(1, cells_per_geog // len(split_field_items))
+        split_chunk_size = max(1, max_cells // cells_per_split_item)
+        split_chunks = [split_field_groups[i:i+split_chunk_size] for i in range(0, len(split_field_groups), split_chunk_size)]
+        cells_per_geog = cells_per_split_item * min(split_chunk_size, len(split_field_groups))
+
+        # As with the geography total, the split field total is requested as a single group of all of its items
+        if split_include_total:
+            split_chunks.append([[uri for split_field_group in split_field_groups for uri in split_field_group]])
+    elif cells_per_geog > max_cells:
+        print('A single geography has {} cells, more than max_cells. Set split_field_id to split another field as well.'.format(cells_per_geog))
+
+    if split_chunks == [None]:
+        split_field_id = None
+
+    geog_chunk_size = max(1, max_cells // cells_per_geog)
+    geog_chunks = [geog_items[i:i+geog_chunk_size] for i in range(0, len(geog_items), geog_chunk_size)]
+
+    # The geography total is requested as a single group of all geographies
+    if geog_include_total:
+        geog_chunks.append([[geog for geog_item in geog_items for geog in geog_item]])
+
+    chunk_bodies = []
+    for geog_chunk in geog_chunks:
+        for split_chunk in split_chunks:
+            chunk_body = get_chunk_body(body, geog_field_id, geog_chunk)
+            if split_chunk is not None:
+                chunk_body = get_chunk_body(chunk_body, split_field_id, split_chunk)
+            chunk_bodies.append(chunk_body)
+
+    return {'bodies':chunk_bodies,
+            'geog_field_id':geog_field_id,
+            'split_field_id':split_field_id,
+            'n_split_chunks':len(split_chunks),
+            'geog_include_total':geog_include_total,
+            'split_include_total':split_include_total}
+
+def combine_table_chunks(chunk_plan, chunk_data):
+    '''Combine the data returned for each chunk of a chunk plan into the data that would have been returned by a single request.
+
+    Args:
+        chunk_plan (dict): The chunk plan, as returned by plan_table_chunks
+        chunk_data (list of dict): The data returned by the Stat-Xplore API table end point for each of the chunk plan bodies
+
+    Returns:
+        dict: The combined data
+    '''
+    geog_field_id = chunk_plan['geog_field_id']
+    split_field_id = chunk_plan['split_field_id']
+    n_split_chunks = chunk_plan['n_split_chunks']
+
+    # Combine the chunks of the second field for each geography chunk, then combine the geography chunks
+    geog_chunk_data = []
+    for i in range(0, len(chunk_data), n_split_chunks):
+        row_data = chunk_data[i:i+n_split_chunks]
+        if chunk_plan['split_include_total']:
+            row_data[-1] = label_field_total(row_data[-1], split_field_id)
+        geog_chunk_data.append(merge_table_responses(row_data, split_field_id) if split_field_id is not None else row_data[0])
+
+    if chunk_plan['geog_include_total']:
+        geog_chunk_data[-1] = label_field_total(geog_chunk_data[-1], geog_field_id)
+
+    return merge_table_responses(geog_chunk_data, geog_field_id)
+
+def label_field_total(dict_response, field_id):
+    '''Label the single group of all items of a field, requested in place of the field total, as the total.
+
+    Args:
+        dict_response (dict): Dictionary of data returned by the Stat-Xpore API table end point for the single group
+        field_id (str): The field ID of the grouped field
+
+    Returns:
+        dict: A copy of the data with the field's item labelled as the total
+    '''
+    labelled = dict(dict_response)
+    labelled['fields'] = [dict(field) for field in dict_response['fields']]
+    get_response_field(labelled, field_id)['items'] = [{'type':'Total', 'labels':['Total'], 'uris':[]}]
+    return labelled
+
+def get_dimension_field_ids(body):
+    '''Get the field IDs of the dimensions of a request body. Dimensions are given either as field IDs or as lists of field IDs.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+
+    Returns:
+        list of str: The field IDs
+    '''
+    return [field_id for dimension in body['dimensions'] for field_id in ([dimension] if isinstance(dimension, str) else dimension)]
+
+def get_geography_field_id(body):
+    '''Get the geography field ID of a request body. This is the first field with a map of recodes.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+
+    Returns:
+        str: The geography field ID
+    '''
+    return [field_id for field_id, recode in body['recodes'].items() if 'map' in recode][0]
+
+def get_chunk_body(body, field_id, field_map):
+    '''Copy a request body, replacing the recodes of a field with a map of a chunk of the field's items. 
+    The chunk does not include the field total.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+        field_id (str): The field ID of the field to recode
+        field_map (list of list of str): The recode map of the chunk of field items
+
+    Returns:
+        dict: The request body of the chunk
+    '''
+    chunk_body = dict(body)
+    chunk_body['recodes'] = dict(body['recodes'])
+    chunk_body['recodes'][field_id] = {'map':field_map, 'total':False}
+
+    return chunk_body
+
+def get_probe_body(body, geog_field_id):
+    '''Get the body of the request for the first geography, used to find the number of cells per geography. See request_table_in_chunks.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+        geog_field_id (str): The field ID of the geography field
+
+    Returns:
+        dict: The request body of the first geography. The body itself if it has a single geography and no geography total,
+            so that the probe is the whole table.
+    '''
+    geog_recode = body['recodes'][geog_field_id]
+    if (len(geog_recode['map']) == 1) and (geog_recode.get('total', False) == False):
+        return body
+    return get_chunk_body(body, geog_field_id, geog_recode['map'][:1])
+
+def get_body_cube_size(body):
+    '''Get the total number of cells, across all measures, that the Stat-Xplore API table end point will return for a 
+    request body, from the recodes of its fields.
+
+    Args:
+        body (dict): The request body, as returned by build_request_body
+
+    Returns:
+        int: The number of cells. None if a field of the body isn't recoded to a map of items, since the number of items 
+            of the field isn't known without the schema.
+    '''
+    n_cells = len(body['measures'])
+    for field_id in get_dimension_field_ids(body):
+        recode = body['recodes'].get(field_id, {})
+        if 'map' not in recode:
+            return None
+        n_cells *= len(recode['map']) + int(recode.get('total', False))
+    return n_cells
+
+def get_response_field(dict_response, field_id):
+    '''Get the field with the input field ID from the data returned by the Stat-Xplore API table end point.'''
+    return [field for field in dict_response['fields'] if field['uri'] == field_id][0]
+
+def get_cube_size(dict_response):
+    '''Get the total number of cells, across all measures, in the data returned by the Stat-Xplore API table end point.'''
+    n_cells_per_measure = int(np.prod([len(field['items']) for field in dict_response['fields']]))
+    return n_cells_per_measure * len(dict_response['measures'])
+
+def merge_table_responses(responses, field_id):
+    '''Combine the data returned by several requests to the Stat-Xplore API table end point that differ only in the 
+    items of one field. The field items and the cubes of each measure are concatenated along that field.
+
+    Args:
+        responses (list of dict): The data returned by the Stat-Xplore API table end point, in the order to combine them
+        field_id (str): The field ID of the field to combine along
+
+    Returns:
+        dict: The combined data
+    '''
+    if len(responses) == 1:
+        return responses[0]
+
+    field_uris = [field['uri'] for field in responses[0]['fields']]
+    axis = field_uris.index(field_id)
+
+    merged = dict(responses[0])
+    merged['fields'] = [dict(field) for field in responses[0]['fields']]
+    merged['fields'][axis]['items'] = [item for response in responses for item in get_response_field(response, field_id)['items']]
+
+    merged['cubes'] = {}
+    for measure_uri in responses[0]['cubes']:
+        cubes_arrays = [np.asarray(response['cubes'][measure_uri]['values']) for response in responses]
+        merged['cubes'][measure_uri] = {'values':np.concatenate(cubes_arrays, axis = axis)}
+
+    return merged
+
+
+def build_request_body(table_headers, schema_headers, measure_id, field_ids = None, fields_include_total = None, df_schema = None, geog_folder_label = 'Geography (residence-based)', geog_field_label= 'National - Regional - LA - OAs', geog_level_label = 'Local Authority', check_cache = False, schema_filename = 'schema.csv', field_recodes = None):
     '''For an input measure ID and field IDs as well as the labels for the geography folder, field and level to get data for 
     build that dictionary of data to send to the Stat-Xplore table end point to request data.
 
     Args:
         table_headers (dict): The headers to uses for the request to the table endpoint of the Stat-Xplore API
         schema_headers (dict): The headers to uses for the request to the schema endpoint of the Stat-Xplore API
-        measure_id (str): The id of the measure to request data for. This is the dataset, such as Attendence Allowance claimants, 
-            that data is returned for
+        measure_id (str or list of str): The id of the measure to request data for. This is the dataset, such as Attendence Allowance claimants, 
+            that data is returned for. A list of measure ids can be given, these must all be from the same database.
 
     Kwargs:
         field_ids (list of str, None): Default None. The field IDs of the fields to in intersect they data by
         fields_include_total (str or list of str): The field IDs of the fields which will include the total across all field values in the returned data
             This cannot be the date field.
-        df_schema (pandas DataFrame, None): Default to None. A DataFrame of the Stat-Xplore schema
+        df_schema (pandas DataFrame, SchemaTree, None): Default to None. The Stat-Xplore schema, as a DataFrame or a SchemaTree.
+            If None, the complete cached schema is used if check_cache is set and there is one, otherwise only the schema items
+            the body needs are requested, see stat_xplore_schema.get_lazy_schema_tree.
         geog_folder_label (str): Defaults to 'Geography (residence-based)'. The label of the geography folder to get geography recodes from
         geog_field_label (str): Defaults tp 'National - Regional - LA - OAs'. The label of the geography field to get geography recodes from.
         geog_level_label (str): Defaults to 'Local Authority'. The label of the level (ie LAs, LSOAs etc) to get recodes for
+        check_cache (bool): Default False. Set whether to use the cached schema and geography recodes
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema. Geography recodes are cached alongside it
+        field_recodes (dict, None): Default None. Field IDs as keys and lists of field value IDs as values. The data of these fields
+            is only requested for the listed values, eg to request only the latest dates of the date field. The fields must also be 
+            in field_ids, and include a total if they are in fields_include_total.
 
     Returns:
-        dict: Dictionary with keys 'database', 'measures', 'recodes', 'dimensions'. This dictionary is sent to the stat-xplore API when requesting data
+        dict: Dictionary with keys 'database', 'measures', 'recodes', 'dimensions'. This dictionary is sent to the stat-xplore API when requesting data.
+            Raises a ValueError if the geography recodes could not all be requested.
 
     '''
 
+    # Resolve the schema once for all lookups. Without a schema, only the items the body needs are requested
+    df_schema = stat_xplore_schema.get_schema_tree(schema_headers, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename, lazy = True)
+
     # Get database id
-    database_id = 'str:database:' + measure_id.split(':')[-2]
+    database_id = get_database_id(measure_id)
+
+    recodes_values = get_geography_recodes_request_body(schema_headers, database_id, geog_folder_label = geog_folder_label, geog_field_label= geog_field_label, geog_level_label = geog_level_label, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename)
 
+    dimensions_values = get_dimensions_body(schema_headers, database_id, field_ids, df_schema = df_schema, check_cache = check_cache, schema_filename = schema_filename)
+
+    return assemble_request_body(database_id, measure_id, recodes_values, dimensions_values, fields_include_total = fields_include_total, field_recodes = field_recodes)
+
+def assemble_request_body(database_id, measure_id, recodes_values, dimensions_values, fields_include_total = None, field_recodes = None):
+    '''Put the request body together from the geography recodes and dimensions looked up in the schema. See build_request_body.
+
+    Args:
+        database_id (str): The ID of the database
+        measure_id (str or list of str): The id of the measure, or list of ids of measures, to request data for
+        recodes_values (dict): The geography recodes, as returned by get_geography_recodes_request_body
+        dimensions_values (list): The dimensions of the other fields, as returned by get_dimensions_body
+
+    Kwargs:
+        fields_include_total (str or list of str, None): Default None. The field IDs of the fields which include the total across all field values
+        field_recodes (dict, None): Default None. Field IDs as keys and lists of field value IDs as values, to request only those values
+
+    Returns:
+        dict: Dictionary with keys 'database', 'measures', 'recodes', 'dimensions'
+    '''
     database_value = database_id
 
     measures_values = get_measures_request_body(measure_id)
 
-    recodes_values = get_geography_recodes_request_body(schema_headers, database_id, geog_folder_label = geog_folder_label, geog_field_label= geog_field_label, geog_level_label = geog_level_label, df_schema = df_schema)
-
-    dimensions_values = get_dimensions_body(schema_headers, database_id, field_ids, df_schema = df_schema)
+    recodes_values = dict(recodes_values)
 
     # Add in geography recode field id to the dimensions
     dimensions_values = dimensions_values + [[i] for i in list(recodes_values.keys())]
 
+    if fields_include_total is None:
+        fields_include_total = []
+    fields_include_total = [fields_include_total] if isinstance(fields_include_total, str) else fields_include_total
+
+    # Recode the fields to request only some of their values. These come after the geography recodes, so that the
+    # geography is still the first field with a map of recodes
+    if field_recodes is not None:
+        for field, field_values in field_recodes.items():
+            if field in recodes_values.keys():
+                continue
+            recodes_values.update(format_recodes_for_api({field:field_values}, include_total = field in fields_include_total))
+
     # Add in the field totals to the recodes so that the returned data includes field totals (ie total for all genders)
-    if fields_include_total is not None:
-        fields_include_total = [fields_include_total] if isinstance(fields_include_total, str) else fields_include_total
+    if len(fields_include_total) > 0:
         # Ensure that existing recode items are not changed
         # The dimension id is the element within the array
         for field in fields_include_total:
@@ -241,7 +974,26 @@ def build_request_body(table_headers, schema_headers, measure_id, field_ids = No
 
     return body
 
-def get_dimensions_body(schema_headers, database_id, field_ids, df_schema = None):
+def get_database_id(measure_ids):
+    '''Get the ID of the database the input measure IDs belong to. 
+
+    Args:
+        measure_ids (str or list of str): The measure IDs, eg 'str:count:CA_In_Payment:V_F_CA_In_Payment' or 
+            'str:statfn:CA_In_Payment:V_F_CA_In_Payment:AMOUNT:SUM'
+
+    Returns:
+        str: The database ID, eg 'str:database:CA_In_Payment'
+    '''
+    measure_ids = [measure_ids] if isinstance(measure_ids, str) else measure_ids
+
+    # The database name is the third part of every type of measure ID
+    database_ids = set('str:database:' + measure_id.split(':')[2] for measure_id in measure_ids)
+    if len(database_ids) != 1:
+        raise ValueError('Measures must all belong to the same database. Measures {} belong to databases {}'.format(measure_ids, sorted(database_ids)))
+
+    return database_ids.pop()
+
+def get_dimensions_body(schema_headers, database_id, field_ids, df_schema = None, check_cache = False, schema_filename = 'schema.csv'):
     '''Format the fields IDs to the required format for the dimensions section of the data request body. 
     If field IDs is None, get all available fields for the given database.
 
@@ -249,14 +1001,16 @@ def get_dimensions_body(schema_headers, database_id, field_ids, df_schema = None
         schema_headers (dict): The headers of the request.
         database_id (str): The ID of the database to get dimension fields for.
         field_ids (str or list of str or None): The fields to use as dimensions in the data request
-        df_schema (pandas DataFrame or None): The stat-xplore schema
+        df_schema (pandas DataFrame, SchemaTree or None): The stat-xplore schema
+        check_cache (bool): Default False. Set whether to use the cached schema if df_schema is None
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema
 
     Returns:
         list: The field ids to use as dimensions properly formatted
 
     '''
 
-    all_field_ids_dict = stat_xplore_schema.get_database_fields(schema_headers, database_id, df_schema = df_schema)
+    all_field_ids_dict = stat_xplore_schema.get_database_fields(schema_headers, database_id, df_schema = df_schema, check_cache = check_cache, cache_filename = schema_filename)
     all_field_ids = list(all_field_ids_dict.values())
     
     if field_ids is None:
@@ -294,12 +1048,20 @@ def get_geography_recodes_request_body(schema_headers, database_id, geog_folder_
         geog_folder_label (str): Defaults to 'Geography (residence-based)'. The label of the geography folder to get geography recodes from
         geog_field_label (str): Defaults tp 'National - Regional - LA - OAs'. The label of the geography field to get geography recodes from
         geog_level_label (str): Defaults to 'Local Authority'. The label of the level (ie LAs, LSOAs etc) to get recodes for
+        check_cache (bool): Default False. Set whether to use the cached schema and geography recodes
+        schema_filename (str): Default 'schema.csv'. The filename of the cached schema. Geography recodes are cached alongside it
 
+    Returns:
+        dict: The geography recodes in the format of the request body. Raises a ValueError if any page of the recodes could not be requested.
     '''
 
     # Get the recodes
     recodes_dict = stat_xplore_schema.geography_recodes_for_geog_folder_geog_level(schema_headers, database_id, geog_folder_label, geog_field_label, geog_level_label, df_schema, check_cache, schema_filename)
 
+    # Fail rather than request data for only some geographies
+    if list(recodes_dict.values())[0] is None:
+        raise ValueError('Unable to get the {} recodes of {}.'.format(geog_level_label, database_id))
+
     # Format the recodes
     recodes_data = format_recodes_for_api(recodes_dict, include_total = True)
 
@@ -370,20 +1132,23 @@ def gen_xyz(x_max, y_max, z_max):
            for z in range(z_max):
                     yield x,y,z
 
-def request_table(table_headers, table_data):
-    '''Send request for table to API. Check request was successful.
+def request_table(table_headers, table_data, stream = False):
+    '''Send request for table to API using the shared Stat-Xplore client. Check request was successful.
 
     Args:
-        url (str): The url of the request.
         table_headers (dict): The headers of the request.
-    '''
-    global table_url
-    table_response = requests.post(table_url, headers = table_headers, data = table_data)
+        table_data (str): The JSON formatted body of the request.
 
-    # Check that request was successful. If not print message and exit.
-    if table_response.raise_for_status() is not None:
-        print("Unsuccessful request to url:{}\nCheck url and API key.".format(url))
-        print("Response status:\n{}".format(table_response.raise_for_status()))
+    Kwargs:
+        stream (bool): Default False. Set whether to stream the response content rather than read it straight away
+    '''
+    try:
+        table_response = stat_xplore_client.post(table_url, headers = table_headers, data = table_data, stream = stream)
+        table_response.raise_for_status()
+    except requests.RequestException as err:
+        # Check that request was successful. If not print message and exit.
+        print("Unsuccessful request to url:{}\nCheck url and API key.".format(table_url))
+        print("Response status:\n{}".format(err))
         return {'success':False, 'response':None}
-    else:
-        return {'success':True, 'response':table_response}
+
+    return {'success':True, 'response':table_response}
@@ -0,0 +1,34 @@
+# Shared fixtures of the stat_xplore_scraper tests. The scraper modules are imported by name, so the scraper directory
+# is added to the path.
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stat_xplore_scraper'))
+
+import stat_xplore_client
+import stat_xplore_mock_server
+
+
+@pytest.fixture(autouse = True)
+def fast_retries(monkeypatch):
+    '''Use a client session that retries failed requests once without waiting, so that tests of failures are quick.
+    The retry settings are also used by the async client.'''
+    monkeypatch.setattr(stat_xplore_client, 'session', stat_xplore_client.create_session(max_retries = 1, backoff_factor = 0))
+    monkeypatch.setattr(stat_xplore_client, 'max_retries', 1)
+    monkeypatch.setattr(stat_xplore_client, 'backoff_factor', 0)
+    stat_xplore_client.clear_cache()
+    yield
+    stat_xplore_client.clear_cache()
+
+@pytest.fixture
+def mock_server():
+    '''A mock Stat-Xplore API with a 450 value geography valueset, 5 pages of recodes.'''
+    with stat_xplore_mock_server.mock_stat_xplore_api(n_folders = 2, n_databases = 1, n_geography_values = 450) as mock_server:
+        yield mock_server
+
+@pytest.fixture
+def geography_valueset(mock_server):
+    '''The id and location of the Local Authority valueset of the first database of the mock schema.'''
+    valueset_id = 'str:valueset:MOCK0_0:V_F_MOCK0_0:COA_CODE:V_C_LA'
+    return valueset_id, stat_xplore_mock_server.get_item_location(mock_server['url'], valueset_id, mock_server['server'].mock['schema']['root_id'])
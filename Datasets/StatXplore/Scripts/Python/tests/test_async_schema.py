@@ -0,0 +1,55 @@
+# Tests of the async schema crawl of stat_xplore_async
+import asyncio
+import concurrent.futures
+import pytest
+import stat_xplore_schema
+import stat_xplore_async
+
+pytestmark = pytest.mark.skipif(stat_xplore_async.aiohttp is None, reason = 'aiohttp is not installed')
+
+
+async def crawl_while_locked(mock_server, schema_filename, crawl_lock):
+    client = await stat_xplore_async.open_client()
+    try:
+        crawl = asyncio.ensure_future(stat_xplore_async.get_full_schema(client, {}, schema_filename = schema_filename))
+
+        # The crawl waits for the lock, without requesting the schema or blocking the event loop
+        await asyncio.sleep(0.2)
+        assert crawl.done() == False
+        assert mock_server['counts']['schema'] == 0
+
+        crawl_lock.release()
+        return await crawl
+    finally:
+        await stat_xplore_async.close_client(client)
+
+def test_async_crawl_waits_for_the_schema_crawl_lock(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    crawl_lock = stat_xplore_schema.get_schema_crawl_lock(schema_filename)
+    crawl_lock.acquire()
+
+    df_schema = asyncio.run(crawl_while_locked(mock_server, schema_filename, crawl_lock))
+
+    assert crawl_lock.locked() == False
+    df_sync_schema = stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'sync_schema.csv'))
+    assert sorted(df_schema['id']) == sorted(df_sync_schema['id'])
+
+async def crawl_concurrently(schema_filenames):
+    client = await stat_xplore_async.open_client()
+    try:
+        crawls = [stat_xplore_async.get_full_schema(client, {}, schema_filename = schema_filename) for schema_filename in schema_filenames]
+        return await asyncio.wait_for(asyncio.gather(*crawls), timeout = 30)
+    finally:
+        await stat_xplore_async.close_client(client)
+
+def test_crawls_waiting_for_the_lock_leave_worker_threads_free(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+
+    async def crawl_with_one_worker_thread():
+        # Waiting crawls must not take the only worker thread the crawl holding the lock needs
+        asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers = 1))
+        return await crawl_concurrently([schema_filename]*3)
+
+    df_schemas = asyncio.run(crawl_with_one_worker_thread())
+    assert all(sorted(df_schema['id']) == sorted(df_schemas[0]['id']) for df_schema in df_schemas)
+    assert stat_xplore_schema.get_schema_crawl_lock(schema_filename).locked() == False
@@ -0,0 +1,74 @@
+# Tests of requesting table data with the async client of stat_xplore_async
+import asyncio
+import pandas as pd
+import pytest
+import stat_xplore_client
+import stat_xplore_schema
+import stat_xplore_table
+import stat_xplore_async
+import stat_xplore_mock_server
+
+pytestmark = pytest.mark.skipif(stat_xplore_async.aiohttp is None, reason = 'aiohttp is not installed')
+
+measure_id = 'str:count:MOCK0_0:V_F_MOCK0_0'
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F0']
+
+
+@pytest.fixture
+def no_sync_schema_requests(monkeypatch):
+    '''Fail the test if a schema request is sent with the shared synchronous client.'''
+    def request_schema(*args, **kwargs):
+        raise AssertionError('Schema requested with the synchronous client')
+    monkeypatch.setattr(stat_xplore_schema, 'request_schema', request_schema)
+
+async def run_with_client(get_result, max_concurrency = stat_xplore_async.default_max_concurrency):
+    client = await stat_xplore_async.open_client(max_concurrency = max_concurrency)
+    try:
+        return await get_result(client)
+    finally:
+        await stat_xplore_async.close_client(client)
+
+def test_build_request_body_matches_sync(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    body = stat_xplore_table.build_request_body({}, {}, measure_id, field_ids = field_ids, schema_filename = schema_filename)
+    stat_xplore_client.clear_cache()
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+
+    async_body = asyncio.run(run_with_client(lambda client: stat_xplore_async.build_request_body(client, {}, measure_id, field_ids = field_ids, schema_filename = schema_filename)))
+    assert async_body == body
+    assert len(body['recodes']['str:field:MOCK0_0:V_F_MOCK0_0:COA_CODE']['map']) == 450
+    # The database, geography folder and field, and 5 pages of recodes
+    assert mock_server['counts']['schema'] == 8
+
+def test_measure_data_without_sync_requests(mock_server, tmp_path, no_sync_schema_requests):
+    schema_filename = str(tmp_path/'schema.csv')
+
+    async def get_data(client):
+        return await asyncio.gather(*[stat_xplore_async.get_stat_xplore_measure_data(client, {}, {}, measure_id, field_ids = field_ids, schema_filename = schema_filename)
+                                      for _ in range(3)])
+
+    results = asyncio.run(run_with_client(get_data, max_concurrency = 2))
+    assert all(result['data'] is not None for result in results)
+    pd.testing.assert_frame_equal(results[1]['data'], results[0]['data'])
+    # 450 local authorities and the total, by the 10 values of the field
+    assert len(results[0]['data']) == 451*10
+
+def test_cached_schema_and_recodes_are_used(mock_server, tmp_path, no_sync_schema_requests):
+    schema_filename = str(tmp_path/'schema.csv')
+
+    def build_body(client):
+        return stat_xplore_async.build_request_body(client, {}, measure_id, field_ids = field_ids, check_cache = True, schema_filename = schema_filename)
+
+    body = asyncio.run(run_with_client(build_body))
+    stat_xplore_client.clear_cache()
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+
+    assert asyncio.run(run_with_client(build_body)) == body
+    assert mock_server['counts']['schema'] == 0
+
+def test_failed_recode_page(mock_server, geography_valueset, tmp_path):
+    valueset_url = geography_valueset[1]
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url + '?pageNumber=3'])
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_with_client(lambda client: stat_xplore_async.build_request_body(client, {}, measure_id, field_ids = field_ids, schema_filename = str(tmp_path/'schema.csv'))))
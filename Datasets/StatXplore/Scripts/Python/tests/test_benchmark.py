@@ -0,0 +1,62 @@
+# Tests of the benchmarks, see stat_xplore_benchmark. The benchmarks are run once against a small mock API, and the
+# request counts and relative timings and memory that the scraper's optimisations are expected to give are checked.
+import math
+import pytest
+import stat_xplore_benchmark
+
+schema_size = {'n_folders':2, 'n_databases':1, 'n_values':10, 'n_geography_values':450}
+cube_shape = (450, 12, 10)
+shape_name = '450x12x10'
+
+
+@pytest.fixture(scope = 'module')
+def results():
+    return stat_xplore_benchmark.run_benchmarks(schema_size = schema_size, cube_shapes = [cube_shape], latency = 0.01,
+                                                table_latency = 0.01, max_workers = 8, repeats = 1, sparse_density = 0.05)
+
+def test_all_benchmarks_are_run(results):
+    names = ['schema_crawl', 'lazy_schema', 'recode_paging', 'recode_paging_concurrent', 'measure_data']
+    names += [name + '_' + shape_name for name in ['table_request', 'table_request_stream', 'unpack', 'unpack_categorical',
+                                                   'unpack_stream', 'wide', 'wide_pivot', 'unpack_sparse',
+                                                   'unpack_sparse_all_cells', 'select_cube_store', 'select_reparse']]
+    assert set(names) <= set(results)
+
+def test_lazy_schema_makes_fewer_requests_than_a_crawl(results):
+    assert results['lazy_schema']['requests'] <= 4
+    assert results['lazy_schema']['requests'] * 4 < results['schema_crawl']['requests']
+
+def test_concurrent_recode_paging(results):
+    assert results['recode_paging_concurrent']['requests'] == results['recode_paging']['requests']
+    assert results['recode_paging_concurrent']['seconds'] < results['recode_paging']['seconds']
+
+def test_unpack(results):
+    result = results['unpack_' + shape_name]
+    assert result['cells'] == math.prod(cube_shape)
+    assert result['cells_per_second'] > 100000
+    assert results['unpack_categorical_' + shape_name]['peak_mb'] < result['peak_mb']
+
+def test_wide_uses_less_memory_than_pivoting(results):
+    assert results['wide_' + shape_name]['cells'] == results['wide_pivot_' + shape_name]['cells']
+    assert results['wide_' + shape_name]['peak_mb'] < results['wide_pivot_' + shape_name]['peak_mb']
+
+def test_sparse_unpack_drops_zeros(results):
+    sparse = results['unpack_sparse_' + shape_name]
+    dense = results['unpack_sparse_all_cells_' + shape_name]
+    assert dense['rows'] == math.prod(cube_shape)
+    assert sparse['rows'] < dense['rows'] * 0.2
+    assert sparse['peak_mb'] < dense['peak_mb']
+
+def test_cube_store_select(results):
+    cube_store = results['select_cube_store_' + shape_name]
+    reparse = results['select_reparse_' + shape_name]
+    assert cube_store['rows'] == reparse['rows'] == math.prod(cube_shape[1:])
+    assert cube_store['seconds'] < reparse['seconds']
+    assert cube_store['peak_mb'] < reparse['peak_mb']
+
+def test_compare_results(results):
+    assert stat_xplore_benchmark.compare_results(results, results) == []
+
+    baseline = {'lazy_schema':dict(results['lazy_schema'], requests = results['lazy_schema']['requests'] - 1)}
+    regressions = stat_xplore_benchmark.compare_results(results, baseline, tolerance = 0)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('lazy_schema requests')
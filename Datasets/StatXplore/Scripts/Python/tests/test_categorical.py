@@ -0,0 +1,47 @@
+# Tests of returning table field columns as pandas Categoricals, see the categorical option of
+# stat_xplore_table.get_stat_xplore_measure_data and stat_xplore_table.build_field_column
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+
+measure_id = 'str:count:MOCK0_0:V_F_MOCK0_0'
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F0', 'str:field:MOCK0_0:V_F_MOCK0_0:F1']
+geog_field_id = 'str:field:MOCK0_0:V_F_MOCK0_0:COA_CODE'
+
+
+@pytest.fixture
+def measure_data(mock_server, tmp_path):
+    '''The data of the mock measure by two fields and the local authorities, with and without categorical columns.'''
+    def get_data(categorical):
+        return stat_xplore_table.get_stat_xplore_measure_data({}, {}, measure_id, field_ids = field_ids, fields_include_total = field_ids[0],
+                                                              categorical = categorical, check_cache = True, schema_filename = str(tmp_path/'schema.csv'))['data']
+    return get_data(False), get_data(True)
+
+def test_categorical_data_matches_object_data(measure_data):
+    df_objects, df_categorical = measure_data
+    value_columns = ['value']
+    field_columns = [column for column in df_objects.columns if column not in value_columns]
+
+    assert list(df_categorical.columns) == list(df_objects.columns)
+    assert all(isinstance(df_categorical[column].dtype, pd.CategoricalDtype) for column in field_columns)
+    as_objects = {column:object for column in field_columns}
+    pd.testing.assert_frame_equal(df_categorical.astype(as_objects), df_objects.astype(as_objects))
+
+def test_categories_are_the_field_items_in_order(measure_data):
+    df_categorical = measure_data[1]
+    for field_id in field_ids + [geog_field_id]:
+        categories = list(df_categorical[field_id].cat.categories)
+        assert categories == list(pd.unique(measure_data[0][field_id]))
+    assert list(df_categorical[field_ids[0]].cat.categories)[-1] == 'Total'
+    assert len(df_categorical[geog_field_id].cat.categories) == 451
+
+def test_categorical_data_uses_less_memory(measure_data):
+    df_objects, df_categorical = measure_data
+    assert df_categorical.memory_usage(deep = True).sum() * 5 < df_objects.memory_usage(deep = True).sum()
+
+def test_categories_are_kept_when_rows_are_dropped():
+    field_values = ['a', 'b', 'c']
+    column = stat_xplore_table.build_field_column(field_values, np.array([2, 0, 2], dtype = 'uint8'), categorical = True)
+    assert list(column) == ['c', 'a', 'c']
+    assert list(column.categories) == field_values
@@ -0,0 +1,107 @@
+# Tests of the cache of GET responses of stat_xplore_client
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import stat_xplore_client
+
+
+class FakeSession():
+    '''A session that returns a response with an ETag and max-age for each url, and 304 to a matching If-None-Match.'''
+    def __init__(self, max_age = 60, delay = 0):
+        self.max_age = max_age
+        self.delay = delay
+        self.requests = []
+
+    def get(self, url, headers = None, timeout = None):
+        self.requests.append((url, dict(headers)))
+        time.sleep(self.delay)
+        response = requests.Response()
+        response.url = url
+        response.headers['ETag'] = '"{}"'.format(url)
+        response.headers['Cache-Control'] = 'max-age={}'.format(self.max_age)
+        if headers.get('If-None-Match') == response.headers['ETag']:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = '{{"url":"{}","key":"{}"}}'.format(url, headers.get('APIKey')).encode('utf-8')
+        return response
+
+def use_fake_session(monkeypatch, max_age = 60, delay = 0):
+    fake_session = FakeSession(max_age = max_age, delay = delay)
+    monkeypatch.setattr(stat_xplore_client, 'session', fake_session)
+    return fake_session
+
+def test_fresh_response_is_reused(monkeypatch):
+    fake_session = use_fake_session(monkeypatch)
+    first = stat_xplore_client.get('http://mock/a', headers = {'APIKey':'one'})
+    second = stat_xplore_client.get('http://mock/a', headers = {'APIKey':'one'})
+    assert len(fake_session.requests) == 1
+    assert second.json() == first.json()
+    assert second.headers['ETag'] == '"http://mock/a"'
+    assert second is not first
+
+def test_cache_is_keyed_on_headers(monkeypatch):
+    fake_session = use_fake_session(monkeypatch)
+    stat_xplore_client.get('http://mock/a', headers = {'APIKey':'one'})
+    other = stat_xplore_client.get('http://mock/a', headers = {'APIKey':'two'})
+    assert len(fake_session.requests) == 2
+    assert other.json()['key'] == 'two'
+
+def test_stale_response_is_revalidated(monkeypatch):
+    fake_session = use_fake_session(monkeypatch, max_age = 0)
+    stat_xplore_client.get('http://mock/a')
+    revalidated = stat_xplore_client.get('http://mock/a')
+    assert fake_session.requests[1][1]['If-None-Match'] == '"http://mock/a"'
+    assert revalidated.status_code == 200
+    assert revalidated.json()['url'] == 'http://mock/a'
+
+def test_least_recently_used_responses_are_evicted(monkeypatch):
+    use_fake_session(monkeypatch)
+    size = len(stat_xplore_client.get('http://mock/a').content)
+    monkeypatch.setattr(stat_xplore_client, 'get_cache_max_bytes', 2*size)
+    stat_xplore_client.get('http://mock/b')
+    stat_xplore_client.get('http://mock/a')
+    stat_xplore_client.get('http://mock/c')
+    assert [key[0] for key in stat_xplore_client.get_cache] == ['http://mock/a', 'http://mock/c']
+    assert stat_xplore_client.get_cache_bytes == 2*size
+    assert all(set(cached.keys()).isdisjoint(['response']) for cached in stat_xplore_client.get_cache.values())
+
+def assert_cache_bytes_are_counted():
+    assert stat_xplore_client.get_cache_bytes == sum(len(cached['content']) for cached in stat_xplore_client.get_cache.values())
+    assert stat_xplore_client.get_cache_bytes <= stat_xplore_client.get_cache_max_bytes
+
+def get_concurrently(urls, headers = None, max_workers = 8):
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        return list(executor.map(lambda url: stat_xplore_client.get(url, headers = headers).json(), urls))
+
+def test_concurrent_gets(monkeypatch):
+    fake_session = use_fake_session(monkeypatch, delay = 0.01)
+    urls = ['http://mock/{}'.format(i % 4) for i in range(64)]
+
+    assert [response['url'] for response in get_concurrently(urls)] == urls
+    assert len(stat_xplore_client.get_cache) == 4
+    assert_cache_bytes_are_counted()
+
+    # Once cached, fresh responses are returned to every thread without requests
+    n_requests = len(fake_session.requests)
+    assert [response['url'] for response in get_concurrently(urls)] == urls
+    assert len(fake_session.requests) == n_requests
+
+def test_concurrent_gets_with_different_headers(monkeypatch):
+    use_fake_session(monkeypatch, delay = 0.01)
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        responses = list(executor.map(lambda i: stat_xplore_client.get('http://mock/a', headers = {'APIKey':str(i % 2)}).json(), range(32)))
+    assert [response['key'] for response in responses] == [str(i % 2) for i in range(32)]
+    assert len(stat_xplore_client.get_cache) == 2
+
+def test_concurrent_revalidation_and_eviction(monkeypatch):
+    fake_session = use_fake_session(monkeypatch, max_age = 0)
+    size = len(stat_xplore_client.get('http://mock/0').content)
+    monkeypatch.setattr(stat_xplore_client, 'get_cache_max_bytes', 3*size)
+    urls = ['http://mock/{}'.format(i % 6) for i in range(96)]
+
+    assert [response['url'] for response in get_concurrently(urls)] == urls
+    assert len(stat_xplore_client.get_cache) == 3
+    assert_cache_bytes_are_counted()
+    assert any('If-None-Match' in headers for url, headers in fake_session.requests)
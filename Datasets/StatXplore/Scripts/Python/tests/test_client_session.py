@@ -0,0 +1,55 @@
+# Tests of the shared session of stat_xplore_client, which retries requests that fail with transient error statuses
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import stat_xplore_client
+import stat_xplore_mock_server
+
+
+def use_session(monkeypatch, max_retries = 3, backoff_factor = 0):
+    monkeypatch.setattr(stat_xplore_client, 'session', stat_xplore_client.create_session(max_retries = max_retries, backoff_factor = backoff_factor))
+
+def get_schema_root(mock_server):
+    return stat_xplore_client.get(mock_server['schema_url'], use_cache = False)
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_transient_failures_are_retried(mock_server, monkeypatch, status):
+    use_session(monkeypatch)
+    stat_xplore_mock_server.fail_requests(mock_server, [mock_server['schema_url']], status = status, times = 2)
+
+    response = get_schema_root(mock_server)
+    assert response.status_code == 200
+    assert response.json()['id'] == 'str:folder:root'
+    assert mock_server['counts']['schema'] == 3
+
+def test_failure_is_returned_after_the_last_retry(mock_server, monkeypatch):
+    use_session(monkeypatch, max_retries = 2)
+    stat_xplore_mock_server.fail_requests(mock_server, [mock_server['schema_url']])
+
+    assert get_schema_root(mock_server).status_code == 500
+    assert mock_server['counts']['schema'] == 3
+
+def test_client_errors_are_not_retried(mock_server, monkeypatch):
+    use_session(monkeypatch)
+    response = stat_xplore_client.get(mock_server['schema_url'] + '/str:folder:missing', use_cache = False)
+    assert response.status_code == 404
+    assert mock_server['counts']['schema'] == 1
+
+def test_retries_back_off(mock_server, monkeypatch):
+    def time_retries(backoff_factor):
+        use_session(monkeypatch, backoff_factor = backoff_factor)
+        stat_xplore_mock_server.fail_requests(mock_server, [mock_server['schema_url']], times = 3)
+        start = time.perf_counter()
+        assert get_schema_root(mock_server).status_code == 200
+        return time.perf_counter() - start
+
+    # The waits before the second and third retries are 2 and 4 times the backoff factor
+    assert time_retries(0) < 0.2
+    assert time_retries(0.1) >= 0.6
+
+def test_session_is_shared(monkeypatch):
+    monkeypatch.setattr(stat_xplore_client, 'session', None)
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        sessions = list(executor.map(lambda i: stat_xplore_client.get_session(), range(32)))
+    assert all(session is sessions[0] for session in sessions)
+    assert sessions[0].get_adapter('https://stat-xplore.dwp.gov.uk').max_retries.total == stat_xplore_client.max_retries
@@ -0,0 +1,57 @@
+# Tests of requesting the children of schema items concurrently, see stat_xplore_schema.get_children_schemas and the
+# max_workers option of stat_xplore_schema.get_full_schema
+import time
+import threading
+import pandas as pd
+import pytest
+import stat_xplore_client
+import stat_xplore_schema
+
+
+def track_concurrency(monkeypatch, delay = lambda url: 0.02, get_children_schema_of_url = stat_xplore_schema.get_children_schema_of_url):
+    '''Wrap get_children_schema_of_url to wait before each request and record the most requests in flight at once.'''
+    state = {'in_flight':0, 'peak':0, 'threads':set()}
+    lock = threading.Lock()
+
+    def tracked(url, *args, **kwargs):
+        with lock:
+            state['in_flight'] += 1
+            state['peak'] = max(state['peak'], state['in_flight'])
+            state['threads'].add(threading.get_ident())
+        try:
+            time.sleep(delay(url))
+            return get_children_schema_of_url(url, *args, **kwargs)
+        finally:
+            with lock:
+                state['in_flight'] -= 1
+
+    monkeypatch.setattr(stat_xplore_schema, 'get_children_schema_of_url', tracked)
+    return state
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_children_are_returned_in_the_order_of_the_locations(monkeypatch, max_workers):
+    locations = ['http://mock/schema/{}'.format(i) for i in range(6)]
+    # The first locations take longest, so they finish last
+    state = track_concurrency(monkeypatch, delay = lambda url: 0.01*(6 - int(url.split('/')[-1])),
+                              get_children_schema_of_url = lambda url, *args: {'success':True, 'schema':url})
+
+    results = stat_xplore_schema.get_children_schemas(locations, {}, max_workers = max_workers)
+    assert [result['schema'] for result in results] == locations
+    assert state['peak'] == max_workers
+    if max_workers == 1:
+        assert state['threads'] == {threading.get_ident()}
+
+def test_full_schema_is_the_same_for_any_max_workers(mock_server, tmp_path):
+    df_serial = stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'serial.csv'), max_workers = 1)
+    serial_requests = mock_server['counts']['schema']
+    stat_xplore_client.clear_cache()
+
+    df_concurrent = stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'concurrent.csv'), max_workers = 8)
+    assert mock_server['counts']['schema'] == 2*serial_requests
+    pd.testing.assert_frame_equal(df_concurrent, df_serial)
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_full_schema_requests_at_most_max_workers_at_once(mock_server, tmp_path, monkeypatch, max_workers):
+    state = track_concurrency(monkeypatch)
+    stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'schema.csv'), max_workers = max_workers)
+    assert state['peak'] == max_workers
@@ -0,0 +1,80 @@
+# Tests of the memory mapped cube store, see stat_xplore_cube_store
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+import stat_xplore_cube_store
+
+geog_field_id = 'str:field:MOCK:V_F_MOCK:GEOG'
+date_field_id = 'str:field:MOCK:V_F_MOCK:DATE'
+
+
+def get_table_json(measure_uris, seed = 0):
+    '''A table response with a geography field of 4 items and a date field of 3 items, for each measure.'''
+    rng = np.random.default_rng(seed)
+    fields = [{'uri':geog_field_id, 'label':'Geography', 'items':[{'type':'RecodeItem', 'uris':['G{}'.format(i)], 'labels':['Geography {}'.format(i)]} for i in range(4)]},
+              {'uri':date_field_id, 'label':'Date', 'items':[{'type':'RecodeItem', 'uris':['D{}'.format(i)], 'labels':['Date {}'.format(i)]} for i in range(3)]}]
+    return {'database':{'uri':'str:database:MOCK', 'annotationKeys':['note']},
+            'annotationMap':{'note':'A note'},
+            'measures':[{'uri':measure_uri, 'label':measure_uri} for measure_uri in measure_uris],
+            'fields':fields,
+            'cubes':{measure_uri:{'values':rng.integers(0, 100, size = (4, 3)).astype('float64').tolist()} for measure_uri in measure_uris}}
+
+def list_cube_files(cube_directory):
+    return sorted(os.path.relpath(os.path.join(directory, filename), cube_directory) for directory, _, filenames in os.walk(cube_directory) for filename in filenames)
+
+def test_cube_round_trip(tmp_path):
+    json_data = get_table_json(['m0', 'm1'])
+    stat_xplore_table.write_response_cube(json_data, str(tmp_path))
+    cube = stat_xplore_cube_store.read_cube(str(tmp_path))
+
+    assert cube['shape'] == (4, 3)
+    assert cube['annotations'] == {'note':'A note'}
+    assert isinstance(cube['values']['m0'], np.memmap)
+    pd.testing.assert_frame_equal(stat_xplore_table.stored_cube_to_dataframe(cube), stat_xplore_table.json_response_to_dataframe(json_data))
+
+def test_select_cube(tmp_path):
+    json_data = get_table_json(['m0'])
+    stat_xplore_table.write_response_cube(json_data, str(tmp_path))
+    cube = stat_xplore_cube_store.read_cube(str(tmp_path))
+
+    selected = stat_xplore_cube_store.select_cube(cube, {geog_field_id:['G1', 'Geography 2'], date_field_id:['D2', 'D0']})
+    assert selected['shape'] == (2, 2)
+    np.testing.assert_array_equal(selected['values']['m0'], np.asarray(json_data['cubes']['m0']['values'])[[1, 2]][:, [2, 0]])
+
+    with pytest.raises(ValueError):
+        stat_xplore_cube_store.select_cube(cube, {geog_field_id:[]})
+    with pytest.raises(KeyError):
+        stat_xplore_cube_store.select_cube(cube, {geog_field_id:['G9']})
+
+def test_rewrite_removes_stale_arrays(tmp_path):
+    cube_directory = str(tmp_path)
+    stat_xplore_table.write_response_cube(get_table_json(['m0', 'm1', 'm2']), cube_directory)
+    stat_xplore_table.write_response_cube(get_table_json(['m0'], seed = 1), cube_directory)
+
+    # The arrays of the cube that was just replaced are kept for readers of its metadata
+    assert len(list_cube_files(cube_directory)) == 1 + 3 + 1
+
+    json_data = get_table_json(['m0'], seed = 2)
+    metadata = stat_xplore_table.write_response_cube(json_data, cube_directory)
+    assert len(list_cube_files(cube_directory)) == 1 + 1 + 1
+
+    cube = stat_xplore_cube_store.read_cube(cube_directory)
+    assert list(cube['values'].keys()) == ['m0']
+    np.testing.assert_array_equal(cube['values']['m0'], json_data['cubes']['m0']['values'])
+    assert metadata == stat_xplore_cube_store.read_cube_metadata(cube_directory)
+
+def test_open_cube_is_unchanged_by_rewrite(tmp_path):
+    cube_directory = str(tmp_path)
+    json_data = get_table_json(['m0'])
+    stat_xplore_table.write_response_cube(json_data, cube_directory)
+    cube = stat_xplore_cube_store.read_cube(cube_directory)
+
+    stat_xplore_table.write_response_cube(get_table_json(['m0'], seed = 1), cube_directory)
+    np.testing.assert_array_equal(cube['values']['m0'], json_data['cubes']['m0']['values'])
+
+def test_missing_cube(tmp_path):
+    assert stat_xplore_cube_store.read_cube_metadata(str(tmp_path)) is None
+    with pytest.raises(FileNotFoundError):
+        stat_xplore_cube_store.read_cube(str(tmp_path))
@@ -0,0 +1,43 @@
+# Tests of appending the data of new periods to stored data, see stat_xplore_incremental.append_measure_data
+import pandas as pd
+import pytest
+import stat_xplore_incremental
+import stat_xplore_output
+
+pytest.importorskip('pyarrow')
+
+geog_field_id = 'str:field:MOCK:V_F_MOCK:LA'
+date_field_id = 'str:field:MOCK:V_F_MOCK:DATE'
+
+
+def get_period_data(date):
+    return pd.DataFrame({geog_field_id:['E08000001', 'E08000002'], 'Local Authority':['Bolton', 'Bury'],
+                         date_field_id:[date, date], 'Date':['Date ' + date, 'Date ' + date], 'value':[1.0, 2.0]})
+
+def read_stored(data_filename):
+    df_stored = stat_xplore_output.read_table(data_filename)['data']
+    return sorted(zip(df_stored[geog_field_id].astype(str), df_stored[date_field_id].astype(str)))
+
+@pytest.mark.parametrize('partition_cols', [['Local Authority'], ['Date'], ['Local Authority', 'Date']])
+def test_append_keeps_stored_periods(tmp_path, partition_cols):
+    data_filename = str(tmp_path/'data.parquet')
+    stat_xplore_incremental.append_measure_data(get_period_data('D0'), data_filename, partition_cols = partition_cols)
+    stat_xplore_incremental.append_measure_data(get_period_data('D1'), data_filename, partition_cols = partition_cols)
+
+    assert read_stored(data_filename) == [('E08000001', 'D0'), ('E08000001', 'D1'), ('E08000002', 'D0'), ('E08000002', 'D1')]
+    assert stat_xplore_incremental.read_stored_field_value_ids(data_filename, date_field_id) == {'D0', 'D1'}
+
+def test_append_to_unpartitioned_file(tmp_path):
+    data_filename = str(tmp_path/'data.parquet')
+    stat_xplore_incremental.append_measure_data(get_period_data('D0'), data_filename)
+    stat_xplore_incremental.append_measure_data(get_period_data('D1'), data_filename)
+
+    assert read_stored(data_filename) == [('E08000001', 'D0'), ('E08000001', 'D1'), ('E08000002', 'D0'), ('E08000002', 'D1')]
+
+def test_append_to_csv(tmp_path):
+    data_filename = str(tmp_path/'data.csv')
+    stat_xplore_incremental.append_measure_data(get_period_data('D0'), data_filename)
+    stat_xplore_incremental.append_measure_data(get_period_data('D1'), data_filename)
+
+    assert stat_xplore_incremental.read_stored_field_value_ids(data_filename, date_field_id) == {'D0', 'D1'}
+    assert len(pd.read_csv(data_filename)) == 4
@@ -0,0 +1,28 @@
+import os
+import json
+import pytest
+import stat_xplore_jobs
+
+
+def write_manifest(tmp_path, **settings):
+    manifest = {'api_key':'mock',
+                'schema_filename':'schema.csv',
+                'output_directory':'output',
+                'jobs':[{'name':'mock_job',
+                         'measure_id':'str:count:MOCK0_0:V_F_MOCK0_0',
+                         'field_ids':['str:field:MOCK0_0:V_F_MOCK0_0:F0']}]}
+    manifest.update(settings)
+    manifest_filename = str(tmp_path / 'manifest.json')
+    with open(manifest_filename, 'w') as f:
+        json.dump(manifest, f)
+    return stat_xplore_jobs.load_manifest(manifest_filename)
+
+@pytest.mark.parametrize('check_cache', [True, False])
+def test_check_cache_setting_reaches_jobs(mock_server, tmp_path, check_cache):
+    manifest = write_manifest(tmp_path, check_cache = check_cache)
+
+    assert stat_xplore_jobs.run_jobs(manifest) == {'mock_job':True}
+    assert os.path.isfile(str(tmp_path / 'output' / 'mock_job_data.csv'))
+
+    # The recode cache is only written when the cache is used
+    assert os.path.isfile(str(tmp_path / 'schema_recodes.json')) == check_cache
@@ -0,0 +1,77 @@
+# Tests of the LazySchemaTree and its cache of schema items, see stat_xplore_schema.get_lazy_schema_tree
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import stat_xplore_schema
+import stat_xplore_schema_tree
+
+database_id = 'str:database:MOCK0_0'
+geography_path = ['Geography (residence-based)', 'National - Regional - LA - OAs', 'Local Authority']
+
+
+def count_writes(monkeypatch):
+    writes = []
+    write_json = stat_xplore_schema.write_json
+    monkeypatch.setattr(stat_xplore_schema, 'write_json', lambda filename, data: (writes.append(filename), write_json(filename, data)))
+    return writes
+
+def test_only_the_path_is_requested(mock_server, tmp_path):
+    tree = stat_xplore_schema.get_lazy_schema_tree({}, schema_filename = str(tmp_path/'schema.csv'))
+    node = tree.resolve(database_id, geography_path)
+    assert node.id == 'str:valueset:MOCK0_0:V_F_MOCK0_0:COA_CODE:V_C_LA'
+    assert mock_server['counts']['schema'] == 3
+
+def test_cache_is_written_once_per_lookup(mock_server, tmp_path, monkeypatch):
+    writes = count_writes(monkeypatch)
+    schema_filename = str(tmp_path/'schema.csv')
+    tree = stat_xplore_schema.get_lazy_schema_tree({}, check_cache = True, schema_filename = schema_filename)
+
+    tree.resolve(database_id, geography_path)
+    assert len(writes) == 1
+
+    with tree.batch():
+        tree.children('str:database:MOCK1_0')
+        tree.children('str:folder:MOCK1_0:geography')
+    assert len(writes) == 2
+
+    # Lookups of items already in the tree don't write the cache
+    tree.resolve(database_id, geography_path)
+    assert len(writes) == 2
+
+def test_cached_items_are_reused_until_they_expire(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_lazy_schema_tree({}, check_cache = True, schema_filename = schema_filename).resolve(database_id, geography_path)
+    n_requests = mock_server['counts']['schema']
+
+    tree = stat_xplore_schema.get_lazy_schema_tree({}, check_cache = True, schema_filename = schema_filename)
+    tree.resolve(database_id, geography_path)
+    assert mock_server['counts']['schema'] == n_requests
+
+    tree = stat_xplore_schema.get_lazy_schema_tree({}, check_cache = True, schema_filename = schema_filename, cache_ttl = 0)
+    tree.resolve(database_id, geography_path)
+    assert mock_server['counts']['schema'] == 2*n_requests
+
+    with open(stat_xplore_schema.get_lazy_schema_cache_filename(schema_filename), 'r') as f:
+        cached_items = json.load(f)
+    assert all(time.time() - cached['fetched'] < 60 for cached in cached_items.values())
+
+def test_children_are_loaded_once_across_threads():
+    fetched = []
+    fetched_lock = threading.Lock()
+
+    def fetch_item(location):
+        with fetched_lock:
+            fetched.append(location)
+        time.sleep(0.01)
+        id = location.split('/')[-1]
+        return {'id':id, 'type':'FOLDER', 'label':id, 'location':location,
+                'children':[{'id':id + str(i), 'type':'FOLDER', 'label':str(i), 'location':location + str(i)} for i in range(3)]}
+
+    tree = stat_xplore_schema_tree.LazySchemaTree(fetch_item, 'http://mock/schema')
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        children = list(executor.map(lambda i: tree.children('a'), range(8)))
+
+    assert fetched == ['http://mock/schema/a']
+    assert all([child.id for child in node_children] == ['a0', 'a1', 'a2'] for node_children in children)
+    assert tree.loaded_ids == {'a'}
@@ -0,0 +1,42 @@
+# Tests of requesting several measures of a database in one table request, see stat_xplore_table.get_stat_xplore_measure_data
+import pytest
+import stat_xplore_client
+import stat_xplore_table
+import stat_xplore_mock_server
+
+measure_ids = ['str:count:MOCK0_0:V_F_MOCK0_0', 'str:statfn:MOCK0_0:V_F_MOCK0_0:AMOUNT:SUM']
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F0']
+
+
+def get_measure_data(measure_id, schema_filename, **kwargs):
+    return stat_xplore_table.get_stat_xplore_measure_data({}, {}, measure_id, field_ids = field_ids, check_cache = True, schema_filename = schema_filename, **kwargs)
+
+def test_measures_are_requested_together(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    df_count = get_measure_data(measure_ids[0], schema_filename)['data']
+    stat_xplore_client.clear_cache()
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+
+    result = get_measure_data(measure_ids, schema_filename)
+    assert mock_server['counts']['table'] == 1
+
+    df_data = result['data']
+    field_columns = [column for column in df_count.columns if column != 'value']
+    assert list(df_data.columns) == field_columns + measure_ids
+    assert df_data[field_columns].equals(df_count[field_columns])
+    # The mock counts of the first measure don't depend on the other measures requested
+    assert list(df_data[measure_ids[0]]) == list(df_count['value'])
+    assert result['annotations'] is not None
+
+def test_measures_of_one_database_in_the_body(mock_server, tmp_path):
+    body = stat_xplore_table.build_request_body({}, {}, measure_ids, field_ids = field_ids, schema_filename = str(tmp_path/'schema.csv'))
+    assert body['database'] == 'str:database:MOCK0_0'
+    assert body['measures'] == measure_ids
+
+@pytest.mark.parametrize('measure_id', [measure_ids[0], measure_ids])
+def test_single_and_list_of_measures_give_one_database(measure_id):
+    assert stat_xplore_table.get_database_id(measure_id) == 'str:database:MOCK0_0'
+
+def test_measures_of_different_databases():
+    with pytest.raises(ValueError):
+        stat_xplore_table.get_database_id([measure_ids[0], 'str:count:MOCK1_0:V_F_MOCK1_0'])
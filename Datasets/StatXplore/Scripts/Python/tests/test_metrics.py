@@ -0,0 +1,126 @@
+# Tests of the request and stage instrumentation, see stat_xplore_metrics
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import stat_xplore_client
+import stat_xplore_table
+import stat_xplore_metrics
+import stat_xplore_mock_server
+
+measure_id = 'str:count:MOCK0_0:V_F_MOCK0_0'
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F0']
+
+
+def get_events(trace, kind, name = None):
+    return [event for event in trace['events'] if (event['kind'] == kind) and ((name is None) or (event['name'] == name))]
+
+def test_measure_data_trace(mock_server, tmp_path):
+    # A table of 451 local authorities by 10 values, requested in chunks of 100 local authorities
+    with stat_xplore_metrics.record_trace(str(tmp_path/'trace.json')) as trace:
+        result = stat_xplore_table.get_stat_xplore_measure_data({}, {}, measure_id, field_ids = field_ids, schema_filename = str(tmp_path/'schema.csv'),
+                                                                max_cells = 1000, max_workers = 4)
+    assert len(result['data']) == 451*10
+
+    stages = {event['name']:event for event in get_events(trace, 'stage')}
+    assert {'build_body', 'valueset_recodes', 'request', 'decode', 'unpack', 'map_labels'} <= set(stages)
+    assert stages['valueset_recodes']['parent'] == 'build_body'
+    assert stages['map_labels']['parent'] == 'unpack'
+    assert stages['unpack']['rows'] == 451*10
+
+    # The recode pages and table chunks are requested in worker threads, and are still recorded in their stages
+    page_requests = [event for event in get_events(trace, 'request', 'http_get') if 'pageNumber' in event['url']]
+    table_requests = get_events(trace, 'request', 'http_post')
+    assert len(page_requests) == 4
+    assert all(event['parent'] == 'valueset_recodes' for event in page_requests)
+    assert len(table_requests) == mock_server['counts']['table'] == 7
+    assert all(event['parent'] == 'request' for event in table_requests)
+    assert len(set(event['thread'] for event in table_requests)) > 1
+    assert all((event['status'] == 200) and (event['bytes'] > 0) for event in table_requests)
+    assert stages['request']['seconds'] >= max(event['seconds'] for event in table_requests)
+
+    # The trace file has the events and their summary
+    with open(str(tmp_path/'trace.json'), 'r') as f:
+        trace_json = json.load(f)
+    assert len(trace_json['events']) == len(trace['events'])
+    assert trace_json['summary']['request:http_post']['count'] == 7
+    assert trace_json['summary']['request:http_post']['bytes'] == sum(event['bytes'] for event in table_requests)
+
+def test_retries_and_failures_are_recorded(mock_server):
+    stat_xplore_mock_server.fail_requests(mock_server, [mock_server['schema_url']], times = 1)
+    missing_url = mock_server['schema_url'] + '/str:folder:missing'
+    with stat_xplore_metrics.record_trace() as trace:
+        stat_xplore_client.get(mock_server['schema_url'], use_cache = False)
+        stat_xplore_client.get(missing_url, use_cache = False)
+
+    root_request, missing_request = get_events(trace, 'request')
+    assert (root_request['status'], root_request['retries'], 'error' in root_request) == (200, 1, False)
+    assert (missing_request['status'], missing_request['error']) == (404, '404 Not Found')
+    summary = stat_xplore_metrics.summarise_trace(trace)['request:http_get']
+    assert (summary['count'], summary['retries'], summary['errors']) == (2, 1, 1)
+
+def test_stage_of_worker_threads():
+    with stat_xplore_metrics.record_trace() as trace:
+        with stat_xplore_metrics.time_stage('outer'):
+            with ThreadPoolExecutor(max_workers = 4) as executor:
+                list(executor.map(stat_xplore_metrics.in_current_stage(lambda i: stat_xplore_metrics.record_cache('wrapped', True)), range(8)))
+                list(executor.map(lambda i: stat_xplore_metrics.record_cache('unwrapped', True), range(8)))
+            stat_xplore_metrics.record_progress('progress', done = 1)
+
+    assert all(event['parent'] == 'outer' for event in get_events(trace, 'cache', 'wrapped'))
+    assert all(event['parent'] is None for event in get_events(trace, 'cache', 'unwrapped'))
+    assert all(event['thread'] != threading.current_thread().name for event in get_events(trace, 'cache'))
+    assert get_events(trace, 'progress')[0]['parent'] == 'outer'
+    assert get_events(trace, 'stage')[0]['parent'] is None
+
+def test_failed_stage_is_recorded():
+    with stat_xplore_metrics.record_trace() as trace:
+        with pytest.raises(ValueError):
+            with stat_xplore_metrics.time_stage('failing'):
+                raise ValueError('Stage failed')
+        with stat_xplore_metrics.time_stage('after'):
+            pass
+
+    failed, after = get_events(trace, 'stage')
+    assert failed['error'] == repr(ValueError('Stage failed'))
+    assert failed['seconds'] is not None
+    # The failed stage isn't left as the current stage
+    assert after['parent'] is None
+
+def test_summarise_trace():
+    trace = stat_xplore_metrics.create_trace()
+    for event in [{'kind':'stage', 'name':'unpack', 'seconds':1.0},
+                  {'kind':'stage', 'name':'unpack', 'seconds':3.0, 'error':'ValueError()'},
+                  {'kind':'request', 'name':'http_get', 'seconds':0.5, 'bytes':100, 'retries':2, 'cache':'fresh'},
+                  {'kind':'request', 'name':'http_get', 'seconds':None, 'bytes':None, 'retries':0, 'cache':None},
+                  {'kind':'cache', 'name':'table_cache', 'seconds':0, 'hit':True},
+                  {'kind':'cache', 'name':'table_cache', 'seconds':0, 'hit':False},
+                  {'kind':'cache', 'name':'table_cache', 'seconds':0, 'hit':False}]:
+        trace['callback'](event)
+
+    assert stat_xplore_metrics.summarise_trace(trace) == {
+        'stage:unpack':{'count':2, 'seconds':4.0, 'max_seconds':3.0, 'errors':1},
+        'request:http_get':{'count':2, 'seconds':0.5, 'max_seconds':0.5, 'errors':0, 'bytes':100, 'retries':2, 'cache_hits':1},
+        'cache:table_cache':{'count':3, 'seconds':0.0, 'max_seconds':0.0, 'errors':0, 'hits':1, 'misses':2}}
+
+def test_events_are_only_recorded_while_tracing():
+    with stat_xplore_metrics.record_trace() as trace:
+        stat_xplore_metrics.record_cache('during', True)
+    stat_xplore_metrics.record_cache('after', True)
+
+    assert [event['name'] for event in trace['events']] == ['during']
+    assert trace['callback'] not in stat_xplore_metrics.callbacks
+
+def test_failing_callback_does_not_stop_recording(capsys):
+    def failing_callback(event):
+        raise RuntimeError('Callback failed')
+
+    stat_xplore_metrics.add_callback(failing_callback)
+    try:
+        with stat_xplore_metrics.record_trace() as trace:
+            stat_xplore_metrics.record_cache('cache', True)
+    finally:
+        stat_xplore_metrics.remove_callback(failing_callback)
+
+    assert len(trace['events']) == 1
+    assert 'Callback failed' in capsys.readouterr().out
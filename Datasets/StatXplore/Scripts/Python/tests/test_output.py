@@ -0,0 +1,112 @@
+# Tests of writing Stat-Xplore data to Parquet and Arrow files and reading it back, see stat_xplore_output
+import os
+import pandas as pd
+import pytest
+import stat_xplore_table
+import stat_xplore_output
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+measure_id = 'str:count:MOCK0_0:V_F_MOCK0_0'
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F0']
+geog_field_id = 'str:field:MOCK0_0:V_F_MOCK0_0:COA_CODE'
+
+
+@pytest.fixture
+def measure_data(mock_server, tmp_path):
+    return stat_xplore_table.get_stat_xplore_measure_data({}, {}, measure_id, field_ids = field_ids, check_cache = True, schema_filename = str(tmp_path/'schema.csv'))
+
+def get_field_columns(df_data):
+    return [column for column in df_data.columns if column != 'value']
+
+def as_objects(df_data):
+    return df_data.astype({column:object for column in get_field_columns(df_data)})
+
+@pytest.mark.parametrize('extension', ['.parquet', '.arrow'])
+@pytest.mark.parametrize('categorical', [False, True])
+def test_round_trip(measure_data, tmp_path, extension, categorical):
+    df_data = measure_data['data']
+    if categorical:
+        df_data = df_data.astype({column:'category' for column in get_field_columns(df_data)})
+    filename = str(tmp_path/('data' + extension))
+
+    assert stat_xplore_output.write_table(df_data, filename, annotations = measure_data['annotations']) == True
+    result = stat_xplore_output.read_table(filename)
+
+    assert result['annotations'] == measure_data['annotations'] != None
+    assert list(result['data'].columns) == list(df_data.columns)
+    assert all(isinstance(result['data'][column].dtype, pd.CategoricalDtype) for column in get_field_columns(df_data))
+    pd.testing.assert_frame_equal(as_objects(result['data']), as_objects(df_data))
+
+def test_field_columns_are_dictionary_encoded(measure_data, tmp_path):
+    filename = str(tmp_path/'data.parquet')
+    stat_xplore_output.write_table(measure_data['data'], filename)
+
+    schema = pq.read_schema(filename)
+    for column in get_field_columns(measure_data['data']):
+        assert pa.types.is_dictionary(schema.field(column).type)
+    assert pa.types.is_floating(schema.field('value').type)
+    # Each of the 451 local authorities and the total is stored once in the dictionary
+    geog_column = pq.read_table(filename, columns = [geog_field_id]).column(geog_field_id)
+    assert len(geog_column.chunk(0).dictionary) == 451
+
+@pytest.mark.parametrize('extension', ['.parquet', '.arrow'])
+def test_data_hash(measure_data, tmp_path, extension):
+    df_data = measure_data['data']
+    filename = str(tmp_path/('data' + extension))
+    stat_xplore_output.write_table(df_data, filename)
+    assert stat_xplore_output.read_data_hash(filename) == stat_xplore_output.get_data_hash(df_data)
+
+    # Unchanged data leaves the file untouched
+    modified_time = os.path.getmtime(filename) - 10
+    os.utime(filename, (modified_time, modified_time))
+    assert stat_xplore_output.write_table(df_data, filename, skip_unchanged = True) == False
+    assert os.path.getmtime(filename) == modified_time
+
+    df_changed = df_data.copy()
+    df_changed.loc[0, 'value'] = df_changed.loc[0, 'value'] + 1
+    assert stat_xplore_output.get_data_hash(df_changed) != stat_xplore_output.get_data_hash(df_data)
+    assert stat_xplore_output.write_table(df_changed, filename, skip_unchanged = True) == True
+    assert stat_xplore_output.read_data_hash(filename) == stat_xplore_output.get_data_hash(df_changed)
+
+def test_data_hash_of_a_file_without_one(tmp_path):
+    filename = str(tmp_path/'data.parquet')
+    pq.write_table(pa.table({'value':[1.0]}), filename)
+    assert stat_xplore_output.read_data_hash(filename) is None
+    assert stat_xplore_output.read_data_hash(str(tmp_path/'missing.parquet')) is None
+
+@pytest.mark.parametrize('extension', ['.parquet', '.arrow'])
+def test_partitioned_round_trip(measure_data, tmp_path, extension):
+    df_data = measure_data['data']
+    field_label = [column for column in get_field_columns(df_data) if column not in field_ids + [geog_field_id]][0]
+    filename = str(tmp_path/('data' + extension))
+    stat_xplore_output.write_table(df_data, filename, annotations = measure_data['annotations'], partition_cols = [field_label], compression = 'zstd')
+
+    assert len(os.listdir(filename)) == df_data[field_label].nunique()
+    result = stat_xplore_output.read_table(filename)
+    assert result['annotations'] == measure_data['annotations']
+
+    # Partition columns are read back last
+    df_read = as_objects(result['data'])[list(df_data.columns)]
+    sort_columns = [field_ids[0], geog_field_id]
+    pd.testing.assert_frame_equal(df_read.sort_values(sort_columns).reset_index(drop = True), as_objects(df_data).sort_values(sort_columns).reset_index(drop = True))
+
+    # Only the rows of the partition filtered on are read
+    label = df_data[field_label].iloc[0]
+    df_partition = stat_xplore_output.read_table(filename, filters = ds.field(field_label) == label)['data']
+    assert len(df_partition) == (df_data[field_label] == label).sum()
+    assert set(df_partition[field_label].astype(str)) == {label}
+
+def test_csv_skip_unchanged(measure_data, tmp_path):
+    filename = str(tmp_path/'data.csv')
+    assert stat_xplore_output.write_csv(measure_data['data'], filename) == True
+    assert stat_xplore_output.write_csv(measure_data['data'], filename, skip_unchanged = True) == False
+    assert stat_xplore_output.write_csv(measure_data['data'].head(10), filename, skip_unchanged = True) == True
+    assert len(pd.read_csv(filename)) == 10
+
+def test_unknown_output_format(tmp_path):
+    with pytest.raises(ValueError):
+        stat_xplore_output.get_output_format(str(tmp_path/'data.txt'))
+    assert stat_xplore_output.get_output_format(str(tmp_path/'data.txt'), output_format = 'ipc') == 'ipc'
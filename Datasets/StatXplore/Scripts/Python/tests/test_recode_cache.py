@@ -0,0 +1,41 @@
+import json
+import stat_xplore_schema
+import stat_xplore_mock_server
+
+
+def test_complete_recodes_are_cached(mock_server, geography_valueset, tmp_path):
+    valueset_url = geography_valueset[1]
+    recode_cache_filename = str(tmp_path / 'schema_recodes.json')
+
+    recodes = stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename)
+
+    with open(recode_cache_filename) as f:
+        assert json.load(f)[valueset_url]['recodes'] == recodes
+
+    # Read from the cache without a request
+    n_requests = mock_server['counts']['schema']
+    assert stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename) == recodes
+    assert mock_server['counts']['schema'] == n_requests
+
+def test_failed_page_is_not_cached(mock_server, geography_valueset, tmp_path):
+    valueset_url = geography_valueset[1]
+    recode_cache_filename = str(tmp_path / 'schema_recodes.json')
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url + '?pageNumber=3'])
+
+    assert stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename) is None
+    assert valueset_url not in stat_xplore_schema.load_recode_cache(recode_cache_filename)
+
+    # Once the page can be requested all recodes are fetched and cached
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url + '?pageNumber=3'], status = None)
+    assert len(stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename)) == 450
+
+def test_default_ttl_is_read_on_lookup(mock_server, geography_valueset, tmp_path, monkeypatch):
+    valueset_url = geography_valueset[1]
+    recode_cache_filename = str(tmp_path / 'schema_recodes.json')
+    stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename)
+
+    # With a ttl of 0 the cached recodes are stale and requested again
+    monkeypatch.setattr(stat_xplore_schema, 'default_recode_cache_ttl', 0)
+    n_requests = mock_server['counts']['schema']
+    stat_xplore_schema.get_valueset_recodes({}, valueset_url, check_cache = True, recode_cache_filename = recode_cache_filename)
+    assert mock_server['counts']['schema'] > n_requests
@@ -0,0 +1,50 @@
+import pytest
+import stat_xplore_schema
+import stat_xplore_table
+import stat_xplore_mock_server
+
+
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_all_pages_in_order(mock_server, geography_valueset, max_workers):
+    valueset_id, valueset_url = geography_valueset
+    expected = mock_server['server'].mock['schema']['items'][valueset_id]['children']
+
+    recodes = stat_xplore_schema.get_recodes_from_valueset_location_all_pages({}, valueset_url, max_workers = max_workers)
+
+    assert len(expected) == 450
+    assert recodes == expected
+
+def test_numbered_pages_without_last_page(mock_server, geography_valueset):
+    valueset_id, valueset_url = geography_valueset
+    expected = mock_server['server'].mock['schema']['items'][valueset_id]['children']
+
+    # Batches of 3 pages, past the 5th and last page
+    recodes = stat_xplore_schema.get_recodes_from_numbered_pages({}, valueset_url + '?pageNumber=2', 'pageNumber', 2, 1, max_workers = 3)
+
+    assert recodes == expected[100:]
+
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_failed_page_is_not_skipped(mock_server, geography_valueset, max_workers):
+    valueset_url = geography_valueset[1]
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url + '?pageNumber=3'])
+
+    assert stat_xplore_schema.get_recodes_from_valueset_location_all_pages({}, valueset_url, max_workers = max_workers) is None
+
+def test_failed_first_page(mock_server, geography_valueset):
+    valueset_url = geography_valueset[1]
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url])
+
+    assert stat_xplore_schema.get_recodes_from_valueset_location_all_pages({}, valueset_url) is None
+
+def test_build_request_body_fails_on_failed_page(mock_server, geography_valueset, tmp_path):
+    valueset_url = geography_valueset[1]
+    stat_xplore_mock_server.fail_requests(mock_server, [valueset_url + '?pageNumber=3'])
+
+    with pytest.raises(ValueError):
+        stat_xplore_table.build_request_body({}, {}, 'str:count:MOCK0_0:V_F_MOCK0_0', schema_filename = str(tmp_path / 'schema.csv'))
+
+def test_build_request_body_has_all_geographies(mock_server, tmp_path):
+    body = stat_xplore_table.build_request_body({}, {}, 'str:count:MOCK0_0:V_F_MOCK0_0', schema_filename = str(tmp_path / 'schema.csv'))
+
+    geog_field_id = stat_xplore_table.get_geography_field_id(body)
+    assert len(body['recodes'][geog_field_id]['map']) == 450
@@ -0,0 +1,79 @@
+# Tests of refreshing a cached schema, see stat_xplore_schema.refresh_schema
+import os
+import json
+import threading
+import pandas as pd
+import stat_xplore_client
+import stat_xplore_schema
+
+field_id = 'str:field:MOCK0_0:V_F_MOCK0_0:F0'
+valueset_id = 'str:valueset:MOCK0_0:V_F_MOCK0_0:F0:C_F0'
+
+
+def refresh(schema_filename, **kwargs):
+    stat_xplore_client.clear_cache()
+    stat_xplore_schema.refresh_schema({}, schema_filename = schema_filename, **kwargs)
+    return pd.read_csv(schema_filename).set_index('id')
+
+def test_relabelled_child_is_refreshed(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+
+    mock_server['server'].mock['schema']['items'][field_id]['label'] = 'Renamed field'
+    df_schema = refresh(schema_filename)
+    assert df_schema.loc[field_id, 'label'] == 'Renamed field'
+
+def test_child_with_new_type_is_refreshed(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+
+    mock_server['server'].mock['schema']['items'][field_id]['type'] = 'MEASURE'
+    df_schema = refresh(schema_filename)
+    assert df_schema.loc[field_id, 'type'] == 'MEASURE'
+
+def test_unchanged_schema_is_kept(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    df_full_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+
+    df_schema = refresh(schema_filename)
+    assert sorted(df_schema.index) == sorted(df_full_schema['id'])
+
+def test_trusted_database_keeps_its_cached_sub_tree(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    refresh(schema_filename)
+
+    # A change below a field of the database, which leaves the database itself unchanged
+    mock_server['server'].mock['schema']['items'][valueset_id]['label'] = 'Renamed valueset'
+    df_schema = refresh(schema_filename, trust_unchanged_types = ['DATABASE'])
+    assert df_schema.loc[valueset_id, 'label'] != 'Renamed valueset'
+
+    df_schema = refresh(schema_filename)
+    assert df_schema.loc[valueset_id, 'label'] == 'Renamed valueset'
+
+def test_validators_are_saved(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    refresh(schema_filename)
+
+    with open(stat_xplore_schema.get_validators_filename(schema_filename), 'r') as f:
+        validators = json.load(f)
+    assert stat_xplore_schema.schema_url in validators
+    assert [filename for filename in os.listdir(tmp_path) if filename.endswith('.tmp')] == []
+
+def test_refresh_waits_for_the_schema_crawl_lock(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    stat_xplore_client.clear_cache()
+
+    crawl_lock = stat_xplore_schema.get_schema_crawl_lock(schema_filename)
+    with crawl_lock:
+        refresh_thread = threading.Thread(target = stat_xplore_schema.refresh_schema, args = ({},), kwargs = {'schema_filename':schema_filename})
+        refresh_thread.start()
+        refresh_thread.join(0.5)
+        assert refresh_thread.is_alive() == True
+        assert os.path.exists(stat_xplore_schema.get_validators_filename(schema_filename)) == False
+
+    refresh_thread.join(10)
+    assert refresh_thread.is_alive() == False
+    assert os.path.exists(stat_xplore_schema.get_validators_filename(schema_filename)) == True
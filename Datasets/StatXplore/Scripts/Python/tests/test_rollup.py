@@ -0,0 +1,67 @@
+# Tests of rolling data up to coarser geographies, see stat_xplore_rollup
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+import stat_xplore_rollup
+
+geog_field_id = 'str:field:MOCK:V_F_MOCK:LSOA'
+date_field_id = 'str:field:MOCK:V_F_MOCK:DATE'
+lsoa_codes = ['E0100000{}'.format(i) for i in range(4)]
+df_lookup = pd.DataFrame({'LSOA11CD':lsoa_codes, 'LAD11CD':['E08000001', 'E08000001', 'E08000002', 'E08000002'],
+                          'LAD11NM':['Bolton', 'Bolton', 'Bury', 'Bury']})
+
+
+def get_data(values, measure_uris = ['str:count:MOCK:V_F_MOCK']):
+    '''Long format data of LSOAs, with the geography total, by two dates. values has a row per LSOA and a column per date.'''
+    geog_items = [{'type':'RecodeItem', 'uris':['str:value:MOCK:V_C_LSOA:' + code], 'labels':['LSOA ' + code]} for code in lsoa_codes]
+    geog_items.append({'type':'Total', 'labels':['Total']})
+    date_items = [{'type':'RecodeItem', 'uris':['D{}'.format(i)], 'labels':['Date {}'.format(i)]} for i in range(2)]
+
+    values = [list(row) for row in values]
+    values.append([None if all(row[i] is None for row in values) else sum(row[i] or 0 for row in values) for i in range(2)])
+    json_data = {'measures':[{'uri':measure_uri} for measure_uri in measure_uris],
+                 'fields':[{'uri':geog_field_id, 'label':'LSOA', 'items':geog_items}, {'uri':date_field_id, 'label':'Date', 'items':date_items}],
+                 'cubes':{measure_uri:{'values':values} for measure_uri in measure_uris}}
+    return stat_xplore_table.json_response_to_dataframe(json_data)
+
+def test_rollup_sums_values_with_nulls():
+    df_data = get_data([[1, None], [2, None], [3, 4], [None, None]])
+    assert df_data['value'].dtype == object
+
+    df_rollup = stat_xplore_rollup.rollup_geography(df_data, geog_field_id, df_lookup, 'LSOA11CD', 'LAD11CD', parent_label_column = 'LAD11NM')
+    assert list(df_rollup.columns) == list(df_data.columns)
+
+    values = df_rollup.set_index([geog_field_id, date_field_id])['value']
+    assert values[('E08000001', 'D0')] == 3
+    assert np.isnan(values[('E08000001', 'D1')])
+    assert values[('E08000002', 'D0')] == 3
+    assert values[('E08000002', 'D1')] == 4
+    assert values[('Total', 'D0')] == 6
+    assert df_rollup.loc[df_rollup[geog_field_id] == 'E08000002', 'LSOA'].unique().tolist() == ['Bury']
+
+def test_rollup_of_several_measures():
+    measure_uris = ['str:count:MOCK:V_F_MOCK', 'str:statfn:MOCK:V_F_MOCK:AMOUNT:SUM']
+    df_data = get_data([[1, 2], [3, 4], [5, 6], [7, 8]], measure_uris = measure_uris)
+    assert stat_xplore_rollup.get_value_columns(df_data) == measure_uris
+
+    df_rollup = stat_xplore_rollup.rollup_geography(df_data, geog_field_id, df_lookup, 'LSOA11CD', 'LAD11CD')
+    assert df_rollup.set_index([geog_field_id, date_field_id]).loc[('E08000002', 'D1'), measure_uris].tolist() == [14, 14]
+
+def test_unmatched_geographies():
+    df_data = get_data([[1, 1], [1, 1], [1, 1], [1, 1]])
+    df_partial_lookup = df_lookup.iloc[:3]
+    assert stat_xplore_rollup.get_unmatched_geographies(df_data, geog_field_id, df_partial_lookup, 'LSOA11CD') == [lsoa_codes[3]]
+
+    with pytest.raises(ValueError):
+        stat_xplore_rollup.rollup_geography(df_data, geog_field_id, df_partial_lookup, 'LSOA11CD', 'LAD11CD')
+
+    df_rollup = stat_xplore_rollup.rollup_geography(df_data, geog_field_id, df_partial_lookup, 'LSOA11CD', 'LAD11CD', drop_unmatched = True)
+    assert df_rollup.set_index([geog_field_id, date_field_id]).loc[('E08000002', 'D0'), 'value'] == 1
+
+def test_check_geography_totals():
+    df_data = get_data([[1, None], [2, None], [3, 4], [None, None]])
+    df_data.loc[(df_data[geog_field_id] == 'Total') & (df_data[date_field_id] == 'D0'), 'value'] = 5
+
+    df_check = stat_xplore_rollup.check_geography_totals(df_data, geog_field_id)
+    assert df_check.set_index(date_field_id)['disclosure_difference'].to_dict() == {'D0':True, 'D1':False}
@@ -0,0 +1,91 @@
+# Tests of resuming an interrupted schema crawl, see stat_xplore_schema.get_full_schema
+import os
+import json
+import pandas as pd
+import stat_xplore_client
+import stat_xplore_schema
+import stat_xplore_mock_server
+
+database_id = 'str:database:MOCK0_0'
+
+
+def get_database_location(mock_server):
+    return stat_xplore_mock_server.get_item_location(mock_server['url'], database_id, mock_server['server'].mock['schema']['root_id'])
+
+def crawl_with_failed_database(mock_server, schema_filename):
+    '''Crawl the schema with the requests for the database failing, leaving the crawl to be resumed.'''
+    stat_xplore_client.clear_cache()
+    database_location = get_database_location(mock_server)
+    stat_xplore_mock_server.fail_requests(mock_server, [database_location])
+    df_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename, checkpoint_batch_size = 2)
+    stat_xplore_mock_server.fail_requests(mock_server, [database_location], status = None)
+    stat_xplore_client.clear_cache()
+    return df_schema
+
+def test_failed_locations_are_kept_in_the_checkpoint(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    df_schema = crawl_with_failed_database(mock_server, schema_filename)
+
+    partial_filename, checkpoint_filename = stat_xplore_schema.get_checkpoint_filenames(schema_filename)
+    assert os.path.exists(partial_filename) == True
+    assert os.path.exists(schema_filename) == False
+    with open(checkpoint_filename, 'r') as f:
+        assert json.load(f)['pending'] == [get_database_location(mock_server)]
+    assert (df_schema['parent_id'] == database_id).sum() == 0
+
+def test_resumed_crawl_matches_a_full_crawl(mock_server, tmp_path):
+    df_full_schema = stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'full_schema.csv'))
+    full_crawl_requests = mock_server['counts']['schema']
+
+    schema_filename = str(tmp_path/'schema.csv')
+    crawl_with_failed_database(mock_server, schema_filename)
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+
+    df_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename, checkpoint_batch_size = 2)
+    # Only the failed database and its children are requested again
+    assert mock_server['counts']['schema'] < full_crawl_requests - 1
+    assert sorted(df_schema['id']) == sorted(df_full_schema['id'])
+    assert df_schema['id'].is_unique == True
+
+    partial_filename, checkpoint_filename = stat_xplore_schema.get_checkpoint_filenames(schema_filename)
+    assert os.path.exists(partial_filename) == False
+    assert os.path.exists(checkpoint_filename) == False
+    pd.testing.assert_frame_equal(pd.read_csv(schema_filename), df_schema)
+
+def test_rows_after_the_checkpoint_are_dropped(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    crawl_with_failed_database(mock_server, schema_filename)
+
+    # Rows written after the last checkpoint, as if the crawl was interrupted while appending a batch
+    partial_filename = stat_xplore_schema.get_checkpoint_filenames(schema_filename)[0]
+    df_partial_schema = pd.read_csv(partial_filename)
+    df_partial_schema.tail(2).to_csv(partial_filename, mode = 'a', header = False, index = False)
+
+    df_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    assert df_schema['id'].is_unique == True
+
+def test_crawl_without_resume_starts_again(mock_server, tmp_path):
+    df_full_schema = stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'full_schema.csv'))
+    full_crawl_requests = mock_server['counts']['schema']
+
+    schema_filename = str(tmp_path/'schema.csv')
+    crawl_with_failed_database(mock_server, schema_filename)
+    stat_xplore_mock_server.reset_request_counts(mock_server)
+
+    df_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename, resume = False)
+    assert mock_server['counts']['schema'] == full_crawl_requests
+    assert sorted(df_schema['id']) == sorted(df_full_schema['id'])
+
+def test_failed_crawl_leaves_the_cached_schema(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    df_full_schema = stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+
+    # A new crawl that fails part way, then a resume that fails again
+    crawl_with_failed_database(mock_server, schema_filename)
+    pd.testing.assert_frame_equal(pd.read_csv(schema_filename), df_full_schema)
+    stat_xplore_mock_server.fail_requests(mock_server, [get_database_location(mock_server)])
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    pd.testing.assert_frame_equal(pd.read_csv(schema_filename), df_full_schema)
+
+    # The incomplete crawl isn't used as a cached schema
+    assert os.path.exists(stat_xplore_schema.get_checkpoint_filenames(schema_filename)[1]) == True
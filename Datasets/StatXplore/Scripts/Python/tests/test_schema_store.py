@@ -0,0 +1,87 @@
+# Tests of the in memory index of the cached schema csv, see stat_xplore_schema.load_schema_store
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+import stat_xplore_schema
+
+database_id = 'str:database:MOCK0_0'
+
+
+@pytest.fixture
+def schema_filename(mock_server, tmp_path):
+    schema_filename = str(tmp_path/'schema.csv')
+    stat_xplore_schema.get_full_schema({}, schema_filename = schema_filename)
+    stat_xplore_schema.clear_schema_store()
+    yield schema_filename
+    stat_xplore_schema.clear_schema_store()
+
+def count_reads(monkeypatch):
+    reads = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, 'read_csv', lambda filename, **kwargs: (reads.append(filename), read_csv(filename, **kwargs))[1])
+    return reads
+
+def rename_database(schema_filename, label):
+    '''Rewrite the cached schema with a new database label, moving its modified time on so the change is seen.'''
+    df_schema = pd.read_csv(schema_filename)
+    df_schema.loc[df_schema['id'] == database_id, 'label'] = label
+    modified_time = os.path.getmtime(schema_filename)
+    df_schema.to_csv(schema_filename, index = False)
+    os.utime(schema_filename, (modified_time + 10, modified_time + 10))
+
+def test_store_is_read_once(schema_filename, monkeypatch):
+    reads = count_reads(monkeypatch)
+    schema_store = stat_xplore_schema.load_schema_store(schema_filename)
+
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        schema_stores = list(executor.map(stat_xplore_schema.load_schema_store, [schema_filename]*16))
+    assert all(store is schema_store for store in schema_stores)
+    assert reads == [schema_filename]
+
+def test_store_matches_the_cached_schema(schema_filename):
+    schema_store = stat_xplore_schema.load_schema_store(schema_filename)
+    df_schema = pd.read_csv(schema_filename)
+
+    pd.testing.assert_frame_equal(schema_store['schema'], df_schema)
+    for row in df_schema.itertuples():
+        assert schema_store['id_by_location'][row.location] == row.id
+        assert schema_store['location_by_id'][row.id] == row.location
+    pd.testing.assert_frame_equal(schema_store['children_by_parent_id'][database_id], df_schema.loc[df_schema['parent_id'] == database_id])
+
+def test_modified_file_is_read_again(schema_filename, monkeypatch):
+    schema_store = stat_xplore_schema.load_schema_store(schema_filename)
+    rename_database(schema_filename, 'Renamed database')
+    reads = count_reads(monkeypatch)
+
+    reloaded_store = stat_xplore_schema.load_schema_store(schema_filename)
+    assert reloaded_store is not schema_store
+    assert reads == [schema_filename]
+    assert reloaded_store['tree'].get(database_id).label == 'Renamed database'
+    assert stat_xplore_schema.load_schema_store(schema_filename) is reloaded_store
+
+def test_cleared_store_is_read_again(schema_filename, monkeypatch):
+    schema_store = stat_xplore_schema.load_schema_store(schema_filename)
+    stat_xplore_schema.clear_schema_store(schema_filename)
+    reads = count_reads(monkeypatch)
+
+    assert stat_xplore_schema.load_schema_store(schema_filename) is not schema_store
+    assert reads == [schema_filename]
+
+def test_cached_children_use_the_store(schema_filename, mock_server, monkeypatch):
+    reads = count_reads(monkeypatch)
+    database_location = stat_xplore_schema.load_schema_store(schema_filename)['location_by_id'][database_id]
+    schema_requests = mock_server['counts']['schema']
+
+    for _ in range(3):
+        result = stat_xplore_schema.get_children_schema_of_url(database_location, {}, check_cache = True, cache_filename = schema_filename)
+        assert result['from_cache'] == True
+    assert set(result['schema']['parent_id']) == {database_id}
+    assert mock_server['counts']['schema'] == schema_requests
+    assert reads == [schema_filename]
+
+    # A change to the cached schema is seen by the next lookup
+    rename_database(schema_filename, 'Renamed database')
+    folder_location = stat_xplore_schema.load_schema_store(schema_filename)['location_by_id']['str:folder:fmock0']
+    result = stat_xplore_schema.get_children_schema_of_url(folder_location, {}, check_cache = True, cache_filename = schema_filename)
+    assert list(result['schema']['label']) == ['Renamed database']
@@ -0,0 +1,92 @@
+# Tests of looking schema items up with a SchemaTree, see stat_xplore_schema_tree and stat_xplore_schema.get_schema_tree.
+# Lookups are compared with filtering the schema DataFrame, as the table functions did before the tree.
+import gc
+import pandas as pd
+import pytest
+import stat_xplore_schema
+import stat_xplore_schema_tree
+
+database_id = 'str:database:MOCK0_0'
+geography_path = ['Geography (residence-based)', 'National - Regional - LA - OAs', 'Local Authority']
+
+
+@pytest.fixture
+def df_schema(mock_server, tmp_path):
+    return stat_xplore_schema.get_full_schema({}, schema_filename = str(tmp_path/'schema.csv'))
+
+def filter_children(df_schema, parent_id, type = None, label = None):
+    '''The children of a schema item, found by filtering the schema DataFrame.'''
+    df_children = df_schema.loc[df_schema['parent_id'] == parent_id]
+    if type is not None:
+        df_children = df_children.loc[df_children['type'] == type]
+    if label is not None:
+        df_children = df_children.loc[df_children['label'] == label]
+    return df_children
+
+def test_get_by_id_matches_the_dataframe(df_schema):
+    tree = stat_xplore_schema.get_schema_tree(df_schema = df_schema)
+
+    assert len(tree) == len(df_schema)
+    for row in df_schema.itertuples():
+        node = tree.get(row.id)
+        assert (node.type, node.label, node.location) == (row.type, row.label, row.location)
+        assert tree.get_by_location(row.location) is node
+        assert (node.parent.id if node.parent is not None else None) == (row.parent_id if pd.notna(row.parent_id) else None)
+
+@pytest.mark.parametrize('type', [None, 'FIELD', 'FOLDER', 'COUNT'])
+def test_children_match_the_dataframe(df_schema, type):
+    tree = stat_xplore_schema.get_schema_tree(df_schema = df_schema)
+
+    for parent_id in df_schema['id']:
+        assert [node.id for node in tree.children(parent_id, type = type)] == list(filter_children(df_schema, parent_id, type = type)['id'])
+
+def test_resolve_matches_the_dataframe(df_schema):
+    tree = stat_xplore_schema.get_schema_tree(df_schema = df_schema)
+
+    parent_id = database_id
+    for i, label in enumerate(geography_path):
+        df_child = filter_children(df_schema, parent_id, label = label)
+        assert len(df_child) == 1
+        parent_id = df_child['id'].iloc[0]
+        assert tree.resolve(database_id, geography_path[:i + 1]).id == parent_id
+
+    geog_field_id, valueset_location = stat_xplore_schema.get_geography_valueset_location(df_schema, database_id, *geography_path)
+    assert geog_field_id == filter_children(df_schema, filter_children(df_schema, database_id, label = geography_path[0])['id'].iloc[0], label = geography_path[1])['id'].iloc[0]
+    assert valueset_location == df_schema.loc[df_schema['id'] == parent_id, 'location'].iloc[0]
+
+    with pytest.raises(KeyError):
+        tree.resolve(database_id, ['Missing folder'])
+
+def test_database_fields_match_the_dataframe(df_schema):
+    df_fields = filter_children(df_schema, database_id, type = 'FIELD')
+    assert stat_xplore_schema.get_database_fields({}, database_id, df_schema = df_schema) == dict(zip(df_fields['label'], df_fields['id']))
+
+def test_to_dataframe_round_trip(df_schema):
+    df_tree = stat_xplore_schema.get_schema_tree(df_schema = df_schema).to_dataframe()
+    assert list(df_tree.columns) == stat_xplore_schema_tree.schema_columns
+    pd.testing.assert_frame_equal(df_tree.fillna(''), df_schema[stat_xplore_schema_tree.schema_columns].fillna(''), check_dtype = False)
+
+def test_dataframe_is_indexed_once(df_schema, monkeypatch):
+    tree = stat_xplore_schema.get_schema_tree(df_schema = df_schema)
+    from_dataframe_calls = []
+    from_dataframe = stat_xplore_schema_tree.SchemaTree.from_dataframe
+    monkeypatch.setattr(stat_xplore_schema_tree.SchemaTree, 'from_dataframe', lambda df: (from_dataframe_calls.append(df), from_dataframe(df))[1])
+
+    assert stat_xplore_schema.get_schema_tree(df_schema = df_schema) is tree
+    stat_xplore_schema.get_database_fields({}, database_id, df_schema = df_schema)
+    stat_xplore_schema.get_geography_valueset_location(df_schema, database_id, *geography_path)
+    assert from_dataframe_calls == []
+
+    # A copy is a different schema, and is indexed separately
+    assert stat_xplore_schema.get_schema_tree(df_schema = df_schema.copy()) is not tree
+    assert len(from_dataframe_calls) == 1
+
+def test_tree_is_dropped_with_the_dataframe(df_schema):
+    df_copy = df_schema.copy()
+    stat_xplore_schema.get_schema_tree(df_schema = df_copy)
+    key = id(df_copy)
+    assert key in stat_xplore_schema.schema_trees
+
+    del df_copy
+    gc.collect()
+    assert key not in stat_xplore_schema.schema_trees
@@ -0,0 +1,81 @@
+# Tests of dropping the zero cells of table responses, see stat_xplore_table.json_response_to_sparse and the drop_zeros
+# option of stat_xplore_table.json_response_to_dataframe
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+
+measure_uris = ['str:count:MOCK:V_F_MOCK', 'str:statfn:MOCK:V_F_MOCK:AMOUNT:SUM']
+
+
+def get_response(n_measures = 1, seed = 0):
+    '''A 3 by 4 by 5 table response with mostly zero cells, a suppressed cell, and a cell that is only zero for the first measure.'''
+    rng = np.random.default_rng(seed)
+    shape = (3, 4, 5)
+    fields = [{'uri':'str:field:MOCK:V_F_MOCK:F{}'.format(i), 'label':'Field {}'.format(i),
+               'items':[{'type':'RecodeItem', 'uris':['F{}_{}'.format(i, j)], 'labels':['Field {} value {}'.format(i, j)]} for j in range(n)]}
+              for i, n in enumerate(shape)]
+
+    cubes = []
+    for i in range(n_measures):
+        values = np.where(rng.random(shape) < 0.2, rng.integers(1, 100, shape), 0).astype(object)
+        values[0, 0, 0] = None
+        values[2, 3, 4] = 0 if i == 0 else 7
+        cubes.append(values.tolist())
+    return {'measures':[{'uri':measure_uri} for measure_uri in measure_uris[:n_measures]],
+            'fields':fields,
+            'cubes':{measure_uri:{'values':values} for measure_uri, values in zip(measure_uris, cubes)}}
+
+def get_value_columns(df_data):
+    return [column for column in df_data.columns if (column == 'value') or (column in measure_uris)]
+
+@pytest.mark.parametrize('n_measures', [1, 2])
+@pytest.mark.parametrize('categorical', [False, True])
+def test_drop_zeros_matches_dense_data_without_zero_rows(n_measures, categorical):
+    dict_response = get_response(n_measures = n_measures)
+    df_dense = stat_xplore_table.json_response_to_dataframe(dict_response, categorical = categorical)
+    df_sparse = stat_xplore_table.json_response_to_dataframe(dict_response, categorical = categorical, drop_zeros = True)
+
+    value_columns = get_value_columns(df_dense)
+    df_values = df_dense[value_columns].apply(pd.to_numeric)
+    df_expected = df_dense.loc[((df_values != 0) & df_values.notna()).any(axis = 1)].reset_index(drop = True)
+
+    assert 0 < len(df_sparse) < len(df_dense)
+    assert list(df_sparse.columns) == list(df_dense.columns)
+    pd.testing.assert_frame_equal(df_sparse, df_expected, check_categorical = False)
+
+def test_drop_zeros_keeps_cells_that_are_not_zero_for_another_measure():
+    df_sparse = stat_xplore_table.json_response_to_dataframe(get_response(n_measures = 2), drop_zeros = True)
+    df_cell = df_sparse.loc[(df_sparse['str:field:MOCK:V_F_MOCK:F0'] == 'F0_2') & (df_sparse['str:field:MOCK:V_F_MOCK:F1'] == 'F1_3')
+                            & (df_sparse['str:field:MOCK:V_F_MOCK:F2'] == 'F2_4')]
+    assert df_cell[measure_uris].values.tolist() == [[0, 7]]
+
+@pytest.mark.parametrize('n_measures', [1, 2])
+def test_sparse_reconstructs_the_cube(n_measures):
+    dict_response = get_response(n_measures = n_measures)
+    sparse = stat_xplore_table.json_response_to_sparse(dict_response)
+
+    assert sparse['shape'] == (3, 4, 5)
+    assert sparse['field_uris'] == [field['uri'] for field in dict_response['fields']]
+    assert sparse['coords'].shape == (3, len(sparse['values'][measure_uris[0]]))
+    for measure_uri in measure_uris[:n_measures]:
+        cubes_array = pd.to_numeric(np.asarray(dict_response['cubes'][measure_uri]['values']).ravel()).reshape(sparse['shape'])
+        dense = np.zeros(sparse['shape'])
+        dense[tuple(sparse['coords'])] = sparse['values'][measure_uri]
+        np.testing.assert_array_equal(dense, np.nan_to_num(cubes_array))
+
+def test_sparse_matches_drop_zeros():
+    dict_response = get_response()
+    sparse = stat_xplore_table.json_response_to_sparse(dict_response)
+    df_sparse = stat_xplore_table.json_response_to_dataframe(dict_response, drop_zeros = True)
+
+    for i, field_uri in enumerate(sparse['field_uris']):
+        assert list(df_sparse[field_uri]) == [sparse['items']['uris'][i][code] for code in sparse['coords'][i]]
+    assert list(df_sparse['value']) == list(sparse['values'][measure_uris[0]])
+
+def test_all_zero_cube():
+    dict_response = get_response()
+    dict_response['cubes'][measure_uris[0]]['values'] = np.zeros((3, 4, 5)).tolist()
+
+    assert len(stat_xplore_table.json_response_to_dataframe(dict_response, drop_zeros = True)) == 0
+    assert stat_xplore_table.json_response_to_sparse(dict_response)['coords'].shape == (3, 0)
@@ -0,0 +1,58 @@
+# Tests of the streaming decode of table responses, see stat_xplore_stream
+import io
+import json
+import numpy as np
+import pytest
+import stat_xplore_stream
+import stat_xplore_mock_server
+
+
+def get_response_content(n_values = 5, suppressed = False):
+    mock_schema = stat_xplore_mock_server.build_mock_schema(n_folders = 1, n_databases = 1, n_values = n_values)
+    body = {'database':'str:database:MOCK0_0',
+            'measures':['str:count:MOCK0_0:V_F_MOCK0_0'],
+            'recodes':{'str:field:MOCK0_0:V_F_MOCK0_0:F0':{'map':[['a'], ['b'], ['c']], 'total':True}},
+            'dimensions':[['str:field:MOCK0_0:V_F_MOCK0_0:F0'], ['str:field:MOCK0_0:V_F_MOCK0_0:F1'], ['str:field:MOCK0_0:V_F_MOCK0_0:F2']]}
+    json_data = stat_xplore_mock_server.get_table_json(mock_schema, body)
+    if suppressed:
+        json_data['cubes']['str:count:MOCK0_0:V_F_MOCK0_0']['values'][1][2][3] = None
+    return json.dumps(json_data).encode('utf-8')
+
+@pytest.fixture(params = ['ijson', 'json'])
+def decoder(request, monkeypatch):
+    '''Decode with ijson, if it is installed, and with the json module fallback.'''
+    if request.param == 'ijson':
+        if stat_xplore_stream.ijson is None:
+            pytest.skip('ijson is not installed')
+    else:
+        monkeypatch.setattr(stat_xplore_stream, 'ijson', None)
+    return request.param
+
+@pytest.mark.parametrize('suppressed', [False, True])
+def test_decode_matches_json(decoder, suppressed):
+    content = get_response_content(suppressed = suppressed)
+    json_data = json.loads(content)
+    decoded = stat_xplore_stream.decode_table_response(io.BytesIO(content))
+
+    assert {key:value for key, value in decoded.items() if key != 'cubes'} == {key:value for key, value in json_data.items() if key != 'cubes'}
+    for measure_uri, cube in json_data['cubes'].items():
+        expected = np.array(cube['values'], dtype = 'float64')
+        assert decoded['cubes'][measure_uri]['values'].shape == (4, 5, 5)
+        np.testing.assert_array_equal(decoded['cubes'][measure_uri]['values'], expected)
+    assert np.isnan(decoded['cubes']['str:count:MOCK0_0:V_F_MOCK0_0']['values']).sum() == int(suppressed)
+
+def test_spool_response():
+    class StreamedResponse():
+        closed = False
+
+        def iter_content(self, chunk_size = 1):
+            content = get_response_content()
+            return (content[i:i+chunk_size] for i in range(0, len(content), chunk_size))
+
+        def close(self):
+            self.closed = True
+
+    response = StreamedResponse()
+    with stat_xplore_stream.spool_response(response, chunk_size = 100) as response_file:
+        assert response_file.read() == get_response_content()
+    assert response.closed == True
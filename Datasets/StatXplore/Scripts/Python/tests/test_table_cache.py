@@ -0,0 +1,67 @@
+# Tests of the disk cache of table responses, see stat_xplore_cache
+import os
+import time
+import stat_xplore_cache
+
+
+def get_body(i):
+    return {'database':'str:database:MOCK', 'measures':['str:count:MOCK:{}'.format(i)], 'recodes':{}, 'dimensions':[]}
+
+def set_age(table_cache, body, age):
+    cache_filename = stat_xplore_cache.get_cache_filename(table_cache, body)
+    cached_time = time.time() - age
+    os.utime(cache_filename, (cached_time, cached_time))
+
+def list_cached(table_cache):
+    return sorted(filename for filename in os.listdir(table_cache['cache_dir']) if filename.endswith('.json.gz'))
+
+def test_cached_response_round_trip(tmp_path):
+    table_cache = stat_xplore_cache.create_table_cache(str(tmp_path))
+    stat_xplore_cache.cache_response(table_cache, get_body(0), b'{"cubes":{}}')
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(0)) == b'{"cubes":{}}'
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(1)) is None
+    assert table_cache['stats'] == {'hits':1, 'misses':1, 'evictions':0, 'expired':0}
+
+def test_equal_bodies_share_a_key():
+    body = get_body(0)
+    reordered_body = dict(reversed(list(body.items())))
+    assert stat_xplore_cache.get_body_key(body) == stat_xplore_cache.get_body_key(reordered_body)
+
+def test_expired_response_is_deleted_on_lookup(tmp_path):
+    table_cache = stat_xplore_cache.create_table_cache(str(tmp_path), max_age = 60)
+    stat_xplore_cache.cache_response(table_cache, get_body(0), b'0')
+    set_age(table_cache, get_body(0), 120)
+
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(0)) is None
+    assert list_cached(table_cache) == []
+    assert table_cache['stats']['expired'] == 1
+
+def test_expired_responses_are_deleted_on_eviction(tmp_path):
+    table_cache = stat_xplore_cache.create_table_cache(str(tmp_path), max_age = 60)
+    for i in range(3):
+        stat_xplore_cache.cache_response(table_cache, get_body(i), b'0')
+    set_age(table_cache, get_body(0), 120)
+    set_age(table_cache, get_body(1), 120)
+
+    stat_xplore_cache.cache_response(table_cache, get_body(3), b'0')
+    assert list_cached(table_cache) == sorted(os.path.basename(stat_xplore_cache.get_cache_filename(table_cache, get_body(i))) for i in [2, 3])
+    assert table_cache['stats']['expired'] == 2
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    table_cache = stat_xplore_cache.create_table_cache(str(tmp_path))
+    content = os.urandom(1000)
+    stat_xplore_cache.cache_response(table_cache, get_body(0), content)
+    file_size = os.path.getsize(stat_xplore_cache.get_cache_filename(table_cache, get_body(0)))
+    table_cache['max_bytes'] = 2*file_size
+
+    stat_xplore_cache.cache_response(table_cache, get_body(1), content)
+    # Make the first response the most recently used, so the second is evicted
+    for i, last_used in [(0, time.time()), (1, time.time() - 60)]:
+        cache_filename = stat_xplore_cache.get_cache_filename(table_cache, get_body(i))
+        os.utime(cache_filename, (last_used, os.path.getmtime(cache_filename)))
+    stat_xplore_cache.cache_response(table_cache, get_body(2), content)
+
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(0)) == content
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(1)) is None
+    assert stat_xplore_cache.get_cached_response(table_cache, get_body(2)) == content
+    assert table_cache['stats']['evictions'] == 1
@@ -0,0 +1,139 @@
+# Tests of splitting a table request into chunks and combining the chunks, see stat_xplore_table.request_table_in_chunks
+import asyncio
+import numpy as np
+import pytest
+import stat_xplore_table
+import stat_xplore_async
+
+geog_field_id = 'str:field:MOCK:V_F_MOCK:GEOG'
+split_field_id = 'str:field:MOCK:V_F_MOCK:DATE'
+measure_id = 'str:count:MOCK:V_F_MOCK'
+field_values = {geog_field_id:['G{}'.format(i) for i in range(5)], split_field_id:['D{}'.format(i) for i in range(4)]}
+
+
+def get_value(geog, date):
+    return 10*int(geog[1:]) + int(date[1:])
+
+def get_table_json(body):
+    '''The response of the table end point to a body, with each item the sum of the values of its group of field values.'''
+    fields = []
+    for dimension in body['dimensions']:
+        field_id = dimension if isinstance(dimension, str) else dimension[0]
+        recode = body['recodes'].get(field_id, {})
+        groups = recode['map'] if 'map' in recode else [[value] for value in field_values[field_id]]
+        items = [{'type':'RecodeItem', 'uris':group, 'labels':['+'.join(group)]} for group in groups]
+        if recode.get('total', False):
+            items.append({'type':'Total', 'uris':[], 'labels':['Total']})
+        fields.append({'uri':field_id, 'label':field_id, 'items':items})
+
+    def get_item_values(field, item):
+        return item['uris'] if item['type'] != 'Total' else field_values[field['uri']]
+
+    geog_field, split_field = [[field for field in fields if field['uri'] == field_id][0] for field_id in [geog_field_id, split_field_id]]
+    values = np.array([[sum(get_value(geog, date) for geog in get_item_values(geog_field, geog_item) for date in get_item_values(split_field, split_item))
+                        for split_item in split_field['items']] for geog_item in geog_field['items']])
+    if fields[0]['uri'] == split_field_id:
+        values = values.T
+
+    return {'measures':[{'uri':measure_id, 'label':'Count'}], 'fields':fields, 'cubes':{measure_id:{'values':values.tolist()}}}
+
+def get_body(dimensions, split_include_total = True):
+    recodes = {geog_field_id:{'map':[[geog] for geog in field_values[geog_field_id]], 'total':True}}
+    if split_include_total:
+        recodes[split_field_id] = {'total':True}
+    return {'database':'str:database:MOCK', 'measures':[measure_id], 'recodes':recodes, 'dimensions':dimensions}
+
+def request_in_chunks(body, max_cells):
+    probe_data = get_table_json(stat_xplore_table.get_chunk_body(body, geog_field_id, body['recodes'][geog_field_id]['map'][:1]))
+    chunk_plan = stat_xplore_table.plan_table_chunks(body, geog_field_id, probe_data, max_cells, split_field_id = split_field_id)
+    return chunk_plan, stat_xplore_table.combine_table_chunks(chunk_plan, [get_table_json(chunk_body) for chunk_body in chunk_plan['bodies']])
+
+def assert_same_table(combined, expected):
+    assert [[item['labels'] for item in field['items']] for field in combined['fields']] == [[item['labels'] for item in field['items']] for field in expected['fields']]
+    np.testing.assert_array_equal(np.asarray(combined['cubes'][measure_id]['values']), np.asarray(expected['cubes'][measure_id]['values']))
+
+@pytest.mark.parametrize('dimensions', [[[split_field_id], [geog_field_id]], [split_field_id, [geog_field_id]]])
+def test_split_field_is_found_in_flat_dimensions(dimensions):
+    chunk_plan, combined = request_in_chunks(get_body(dimensions), max_cells = 3)
+    assert chunk_plan['split_field_id'] == split_field_id
+    assert all(len(stat_xplore_table.get_response_field(get_table_json(chunk_body), split_field_id)['items'])*len(chunk_body['recodes'][geog_field_id]['map']) <= 3
+               for chunk_body in chunk_plan['bodies'])
+
+@pytest.mark.parametrize('split_include_total', [True, False])
+def test_chunks_combine_to_the_whole_table(split_include_total):
+    body = get_body([split_field_id, [geog_field_id]], split_include_total = split_include_total)
+    chunk_plan, combined = request_in_chunks(body, max_cells = 3)
+    assert chunk_plan['split_include_total'] == split_include_total
+    assert chunk_plan['n_split_chunks'] == 2 + int(split_include_total)
+    assert_same_table(combined, get_table_json(body))
+
+def test_geography_only_chunks():
+    body = get_body([[split_field_id], [geog_field_id]])
+    chunk_plan, combined = request_in_chunks(body, max_cells = 10)
+    assert chunk_plan['split_field_id'] is None
+    assert len(chunk_plan['bodies']) == 4
+    assert_same_table(combined, get_table_json(body))
+
+def test_small_table_is_not_split():
+    body = get_body([[split_field_id], [geog_field_id]])
+    probe_data = get_table_json(stat_xplore_table.get_chunk_body(body, geog_field_id, body['recodes'][geog_field_id]['map'][:1]))
+    assert stat_xplore_table.plan_table_chunks(body, geog_field_id, probe_data, 30, split_field_id = split_field_id) is None
+
+@pytest.fixture
+def table_requests(monkeypatch):
+    '''Answer table requests from get_table_json, recording the body of each request.'''
+    requests = []
+    def request_table_json(table_headers, body, table_cache = None, stream = False):
+        requests.append(body)
+        return get_table_json(body)
+    async def request_table_json_async(client, table_headers, body, table_cache = None):
+        return request_table_json(table_headers, body)
+    monkeypatch.setattr(stat_xplore_table, 'request_table_json', request_table_json)
+    monkeypatch.setattr(stat_xplore_async, 'request_table_json', request_table_json_async)
+    return requests
+
+def request_table_in_chunks(body, max_cells, use_async = False):
+    if use_async:
+        return asyncio.run(stat_xplore_async.request_table_in_chunks(None, {}, body, geog_field_id, max_cells, split_field_id = split_field_id))
+    return stat_xplore_table.request_table_in_chunks({}, body, geog_field_id, max_cells, split_field_id = split_field_id)
+
+def test_body_cube_size():
+    body = get_body([[split_field_id], [geog_field_id]])
+    assert stat_xplore_table.get_body_cube_size(body) is None
+    body['recodes'][split_field_id] = {'map':[['D0'], ['D1']], 'total':True}
+    assert stat_xplore_table.get_body_cube_size(body) == 6*3
+    body['measures'] = [measure_id, 'str:statfn:MOCK:V_F_MOCK:AMOUNT:SUM']
+    assert stat_xplore_table.get_body_cube_size(body) == 6*3*2
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_small_recoded_table_is_not_probed(table_requests, use_async):
+    body = get_body([[split_field_id], [geog_field_id]])
+    body['recodes'][split_field_id] = {'map':[['D0'], ['D1']], 'total':True}
+
+    assert_same_table(request_table_in_chunks(body, 18, use_async = use_async), get_table_json(body))
+    assert table_requests == [body]
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_small_table_is_probed_then_requested(table_requests, use_async):
+    body = get_body([[split_field_id], [geog_field_id]])
+
+    assert_same_table(request_table_in_chunks(body, 30, use_async = use_async), get_table_json(body))
+    assert len(table_requests) == 2
+    assert table_requests[-1] == body
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_probe_of_a_single_geography_is_the_whole_table(table_requests, use_async):
+    body = get_body([[split_field_id], [geog_field_id]])
+    body['recodes'][geog_field_id] = {'map':[['G0', 'G1']], 'total':False}
+
+    assert_same_table(request_table_in_chunks(body, 30, use_async = use_async), get_table_json(body))
+    assert table_requests == [body]
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_probe_is_reused_as_a_chunk(table_requests, use_async):
+    body = get_body([[split_field_id], [geog_field_id]])
+
+    assert_same_table(request_table_in_chunks(body, 5, use_async = use_async), get_table_json(body))
+    # A chunk per geography and the geography total, with the first geography's chunk the probe
+    assert len(table_requests) == 6
+    assert len(set(str(request_body) for request_body in table_requests)) == 6
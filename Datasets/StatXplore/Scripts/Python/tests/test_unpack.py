@@ -0,0 +1,102 @@
+# Tests of unpacking table responses into long format, see stat_xplore_table.json_response_to_dataframe, cube_to_dataframe
+# and unpack_cube_data. The data is compared with a reference unpack that loops over every cell, as the scraper first did.
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+
+measure_uris = ['str:count:MOCK:V_F_MOCK', 'str:statfn:MOCK:V_F_MOCK:AMOUNT:SUM', 'str:statfn:MOCK:V_F_MOCK:AMOUNT:MEAN']
+
+
+def get_response(shape, n_measures = 1, seed = 0):
+    '''A table response with a field per dimension of shape. The last item of the first field is a total, two items of the
+    last field share a label, and some cells are suppressed (None).'''
+    rng = np.random.default_rng(seed)
+    fields = []
+    for i, n in enumerate(shape):
+        items = [{'type':'RecodeItem', 'uris':['F{}_{}'.format(i, j)], 'labels':['Field {} value {}'.format(i, j)]} for j in range(n)]
+        if (i == 0) & (n > 1):
+            items[-1] = {'type':'Total', 'labels':['Total']}
+        if (i == len(shape) - 1) & (n > 2):
+            items[1]['labels'] = items[0]['labels']
+        fields.append({'uri':'str:field:MOCK:V_F_MOCK:F{}'.format(i), 'label':'Field {}'.format(i), 'items':items})
+
+    cubes = {}
+    for measure_uri in measure_uris[:n_measures]:
+        values = rng.integers(0, 1000, shape).astype(object)
+        values[rng.random(shape) < 0.1] = None
+        cubes[measure_uri] = {'values':values.tolist()}
+    return {'measures':[{'uri':measure_uri} for measure_uri in measure_uris[:n_measures]], 'fields':fields, 'cubes':cubes}
+
+def reference_unpack(dict_response):
+    '''Unpack the response one cell at a time, with the last field changing fastest.'''
+    fields = dict_response['fields']
+    measures = [measure['uri'] for measure in dict_response['measures']]
+    value_headers = measures if len(measures) > 1 else ['value']
+
+    def item_value(item, key):
+        return item['labels'][0] if item['type'] == 'Total' else item[key][0]
+
+    rows = []
+    for position in itertools.product(*[range(len(field['items'])) for field in fields]):
+        row = []
+        for field, j in zip(fields, position):
+            row += [item_value(field['items'][j], 'uris'), item_value(field['items'][j], 'labels')]
+        for measure_uri in measures:
+            values = dict_response['cubes'][measure_uri]['values']
+            for j in position:
+                values = values[j]
+            row.append(values)
+        rows.append(row)
+
+    columns = list(itertools.chain(*[[field['uri'], field['label']] for field in fields])) + value_headers
+    return pd.DataFrame(rows, columns = columns)
+
+def assert_frame_matches_reference(df_data, df_reference):
+    assert list(df_data.columns) == list(df_reference.columns)
+    assert len(df_data) == len(df_reference)
+    for column in df_data.columns:
+        # Suppressed values are kept as missing rather than zero
+        assert list(df_data[column].isna()) == list(df_reference[column].isna())
+        assert list(df_data[column].dropna()) == list(df_reference[column].dropna())
+
+@pytest.mark.parametrize('shape', [(5,), (4, 6), (3, 4, 5), (2, 3, 2, 4)])
+@pytest.mark.parametrize('n_measures', [1, 3])
+def test_unpack_matches_reference(shape, n_measures):
+    dict_response = get_response(shape, n_measures = n_measures)
+    df_data = stat_xplore_table.json_response_to_dataframe(dict_response)
+
+    assert_frame_matches_reference(df_data, reference_unpack(dict_response))
+
+@pytest.mark.parametrize('shape', [(5,), (3, 4, 5)])
+@pytest.mark.parametrize('n_measures', [1, 3])
+def test_categorical_unpack_matches_reference(shape, n_measures):
+    dict_response = get_response(shape, n_measures = n_measures)
+    df_data = stat_xplore_table.json_response_to_dataframe(dict_response, categorical = True)
+    df_reference = reference_unpack(dict_response)
+
+    assert_frame_matches_reference(df_data, df_reference)
+    for field in dict_response['fields']:
+        for header in [field['uri'], field['label']]:
+            assert isinstance(df_data[header].dtype, pd.CategoricalDtype)
+            # Each field item is a category once, in the order of the field items
+            assert list(df_data[header].cat.categories) == list(dict.fromkeys(df_reference[header]))
+    pd.testing.assert_frame_equal(df_data.astype(object), stat_xplore_table.json_response_to_dataframe(dict_response).astype(object))
+
+def test_cube_to_dataframe_matches_reference():
+    dict_response = get_response((3, 4, 5), n_measures = 2)
+    field_items, field_headers = stat_xplore_table.unpack_response_fields(dict_response)
+    cubes_arrays = [np.asarray(dict_response['cubes'][measure_uri]['values']) for measure_uri in measure_uris[:2]]
+
+    df_data = stat_xplore_table.cube_to_dataframe(field_items, field_headers, measure_uris[:2], cubes_arrays)
+    assert_frame_matches_reference(df_data, reference_unpack(dict_response))
+
+def test_unpack_cube_data_matches_reference():
+    dict_response = get_response((3, 4, 5))
+    field_items, field_headers = stat_xplore_table.unpack_response_fields(dict_response)
+    cubes_array = np.asarray(dict_response['cubes'][measure_uris[0]]['values'])
+
+    dict_data = stat_xplore_table.unpack_cube_data(field_items['uris'], field_headers['uris'], cubes_array)
+    df_reference = reference_unpack(dict_response)
+    assert_frame_matches_reference(pd.DataFrame(dict_data), df_reference[field_headers['uris'] + ['value']])
@@ -0,0 +1,83 @@
+# Tests of reshaping table responses into wide format, see stat_xplore_table.json_response_to_wide_dataframe
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import stat_xplore_table
+import stat_xplore_mock_server
+
+field_ids = ['str:field:MOCK0_0:V_F_MOCK0_0:F{}'.format(i) for i in range(3)]
+field_labels = ['Field {}'.format(i) for i in range(3)]
+measure_uri = 'str:count:MOCK0_0:V_F_MOCK0_0'
+
+
+def get_response():
+    mock_schema = stat_xplore_mock_server.build_mock_schema(n_folders = 1, n_databases = 1, n_values = 4)
+    body = {'database':'str:database:MOCK0_0',
+            'measures':[measure_uri],
+            'recodes':{field_ids[0]:{'map':[['a'], ['b'], ['c']], 'total':True}},
+            'dimensions':[[field_id] for field_id in field_ids]}
+    return json.loads(json.dumps(stat_xplore_mock_server.get_table_json(mock_schema, body)))
+
+def pivot(dict_response, row_fields, column_fields):
+    '''Build the long format data and pivot it, to compare with the wide data.'''
+    df_data = stat_xplore_table.json_response_to_dataframe(dict_response)
+    return df_data.set_index(row_fields + column_fields)['value'].unstack(column_fields)
+
+@pytest.mark.parametrize('row_fields', [[0], [1], [0, 2], [2, 0]])
+def test_wide_matches_pivoted_long_data(row_fields):
+    dict_response = get_response()
+    column_fields = [i for i in range(3) if i not in row_fields]
+
+    df_wide = stat_xplore_table.json_response_to_wide_dataframe(dict_response, [field_ids[i] for i in row_fields])
+    df_pivot = pivot(dict_response, [field_labels[i] for i in row_fields], [field_labels[i] for i in column_fields])
+
+    assert df_wide.shape == df_pivot.shape
+    pd.testing.assert_frame_equal(df_wide, df_pivot.reindex(index = df_wide.index, columns = df_wide.columns), check_dtype = False)
+
+def test_column_field_order():
+    dict_response = get_response()
+    df_wide = stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids[1], column_field_ids = [field_ids[2], field_ids[0]])
+    df_pivot = pivot(dict_response, [field_labels[1]], [field_labels[2], field_labels[0]])
+
+    assert df_wide.columns.names == [field_labels[2], field_labels[0]]
+    pd.testing.assert_frame_equal(df_wide, df_pivot.reindex(index = df_wide.index, columns = df_wide.columns), check_dtype = False)
+
+def test_wide_indexed_by_uris():
+    dict_response = get_response()
+    df_wide = stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids[1], item_values_to_return = 'uris')
+    df_labels = stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids[1])
+
+    assert df_wide.index.name == field_ids[1]
+    assert df_wide.columns.names == [field_ids[0], field_ids[2]]
+    assert list(df_wide.index) == [item['uris'][0] for item in dict_response['fields'][1]['items']]
+    np.testing.assert_array_equal(df_wide.values, df_labels.values)
+
+def test_wide_with_several_measures():
+    dict_response = get_response()
+    second_measure_uri = 'str:statfn:MOCK0_0:V_F_MOCK0_0:AMOUNT:SUM'
+    dict_response['measures'].append({'uri':second_measure_uri})
+    dict_response['cubes'][second_measure_uri] = {'values':(np.array(dict_response['cubes'][measure_uri]['values'])*2).tolist()}
+
+    df_wide = stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids[0])
+    assert df_wide.columns.names == ['measure', field_labels[1], field_labels[2]]
+    np.testing.assert_array_equal(df_wide[second_measure_uri].values, df_wide[measure_uri].values*2)
+
+def test_wide_without_column_fields():
+    dict_response = get_response()
+    df_wide = stat_xplore_table.json_response_to_wide_dataframe(dict_response, field_ids)
+    df_data = stat_xplore_table.json_response_to_dataframe(dict_response)
+
+    assert list(df_wide.columns) == ['value']
+    np.testing.assert_array_equal(df_wide['value'].values, df_data['value'].values.astype('float64'))
+
+@pytest.mark.parametrize('row_field_ids, column_field_ids, item_values_to_return',
+                         [([], None, 'labels'),
+                          ([field_ids[0]], ['str:field:MISSING'], 'labels'),
+                          ([field_ids[0]], [field_ids[0], field_ids[1], field_ids[2]], 'labels'),
+                          ([field_ids[0]], [field_ids[1]], 'labels'),
+                          ([field_ids[0]], None, 'codes')])
+def test_invalid_fields(row_field_ids, column_field_ids, item_values_to_return):
+    with pytest.raises(ValueError):
+        stat_xplore_table.json_response_to_wide_dataframe(get_response(), row_field_ids, column_field_ids = column_field_ids,
+                                                          item_values_to_return = item_values_to_return)